@@ -1,7 +1,10 @@
+# Imported first so that the profiler can time the other imports.
+import profiler
 import streamlit as st
 import leafmap.foliumap as leafmap
 
 st.set_page_config(layout="wide")
+profiler.start()
 
 # Customize the sidebar
 markdown = """
@@ -41,4 +44,9 @@ m.add_basemap("ESA WorldCover 2020 S2 FCC")
 m.add_basemap("ESA WorldCover 2020 S2 TCC")
 m.add_basemap("ESA WorldCover 2020")
 m.add_legend(title="ESA Land Cover", builtin_legend="ESA_WorldCover")
-m.to_streamlit(height=700)
+with profiler.span("map", "render map") as info:
+    if profiler.ENABLED:
+        info["bytes"] = len(m.get_root().render())
+    m.to_streamlit(height=700)
+
+profiler.panel()
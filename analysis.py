@@ -0,0 +1,999 @@
+"""Earth Engine analyses shared by the Streamlit pages."""
+
+import logging
+import math
+import os
+import time
+import uuid
+
+import ee
+import geemap.foliumap as geemap
+import numpy as np
+import pandas as pd
+
+import profiler
+from shared_cache import get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Reductions estimated to touch more pixels than this are run as batch table
+# exports instead of synchronous getInfo() calls, which time out or coarsen
+# the result (bestEffort) for large regions at fine scales. Exports need a
+# folder for temporary table assets; without one, large reductions stay
+# synchronous.
+EXPORT_PIXEL_THRESHOLD = float(os.environ.get("EE_EXPORT_PIXEL_THRESHOLD", 1e10))
+EXPORT_ASSET_ROOT = os.environ.get("EE_EXPORT_ASSET_ROOT")
+EXPORT_POLL_INTERVAL = 10
+EXPORT_TIMEOUT = float(os.environ.get("EE_EXPORT_TIMEOUT", 3 * 3600))
+
+EARTH_RADIUS = 6371008.8
+WORLD_BOUNDS = [-180.0, -90.0, 180.0, 90.0]
+
+
+def estimate_pixels(bounds, scale):
+    """Estimate the number of pixels a reduction within bounds touches.
+
+    The area of the bounding box is computed locally, so the estimate costs no
+    request. It overestimates irregular regions, which only errs towards
+    exporting.
+
+    Args:
+        bounds (list): [minx, miny, maxx, maxy] of the region in degrees.
+        scale (float): Pixel size in meters.
+    """
+    minx, miny, maxx, maxy = bounds
+    width = math.radians(maxx - minx)
+    height = abs(math.sin(math.radians(maxy)) - math.sin(math.radians(miny)))
+    return EARTH_RADIUS**2 * width * height / (scale * scale)
+
+
+def use_export(bounds, scale, images=1):
+    """Whether a reduction of images within bounds should run as an export.
+
+    Without bounds the size of the region is unknown and the reduction stays
+    synchronous.
+    """
+    if bounds is None:
+        return False
+    pixels = estimate_pixels(bounds, scale) * images
+    if pixels <= EXPORT_PIXEL_THRESHOLD:
+        return False
+    if not EXPORT_ASSET_ROOT:
+        logger.warning(
+            "Reducing about %.3g pixels synchronously; set EE_EXPORT_ASSET_ROOT "
+            "to run large reductions as batch exports",
+            pixels,
+        )
+        return False
+    return True
+
+
+def reduce_params(export):
+    """Pixel limits for reduceRegion, strict when the result is exported."""
+    if export:
+        return {"maxPixels": 1e13}
+    return {"maxPixels": 1e12, "bestEffort": True}
+
+
+def export_table(collection, description, poll=None, poll_interval=None, timeout=None):
+    """Export a table to a temporary asset, wait for it and return its rows.
+
+    Args:
+        collection (ee.FeatureCollection): The table to export.
+        description (str): Names the task and its temporary asset.
+        poll (callable): Called with the task status while waiting, e.g. to
+            report progress. An exception raised by it, such as a cancelled
+            job, cancels the export.
+        timeout (float): Seconds to wait before cancelling the export;
+            ``EXPORT_TIMEOUT`` by default.
+
+    Returns:
+        list: The properties of every exported feature.
+    """
+    timeout = EXPORT_TIMEOUT if timeout is None else timeout
+    asset_id = f"{EXPORT_ASSET_ROOT}/{description}_{uuid.uuid4().hex[:8]}"
+    task = ee.batch.Export.table.toAsset(
+        collection=collection, description=description, assetId=asset_id
+    )
+    task.start()
+    logger.info("Started export %s to %s", task.id, asset_id)
+
+    started = time.monotonic()
+    state = None
+    try:
+        while True:
+            status = task.status()
+            state = status["state"]
+            if state == "COMPLETED":
+                break
+            if state in ("FAILED", "CANCELLED", "CANCEL_REQUESTED"):
+                raise ee.EEException(
+                    f"Export {description} {state.lower()}: "
+                    f"{status.get('error_message', '')}"
+                )
+            if time.monotonic() - started > timeout:
+                raise ee.EEException(
+                    f"Export {description} timed out after {timeout:.0f} s"
+                )
+            if poll is not None:
+                poll(status)
+            time.sleep(poll_interval or EXPORT_POLL_INTERVAL)
+    except BaseException:
+        # Do not leave a task running that nobody waits for.
+        if state not in ("FAILED", "CANCELLED", "CANCEL_REQUESTED"):
+            logger.info("Cancelling export %s", task.id)
+            task.cancel()
+        raise
+
+    try:
+        features = ee.FeatureCollection(asset_id).getInfo()["features"]
+    finally:
+        ee.data.deleteAsset(asset_id)
+    return [feature["properties"] for feature in features]
+
+
+def fetch_table(collection, export=False, description="water_stats", poll=None):
+    """Return the properties of every feature of a computed collection."""
+    if export:
+        return export_table(collection, description, poll)
+    features = collection.getInfo()["features"]
+    return [feature["properties"] for feature in features]
+
+
+def grouped_area(image, region, scale, group_name, export=None, bounds=None, poll=None):
+    """Sum the pixel area (ha) of an image for every value of its band.
+
+    Args:
+        export (bool): Run the reduction as a batch export; by default only
+            when it is estimated to be large from ``bounds``.
+        bounds (list): [minx, miny, maxx, maxy] of the region in degrees.
+        poll (callable): Passed on to :func:`export_table`.
+
+    Returns:
+        list: One dict per group with the group value and its area in ``sum``.
+    """
+    if export is None:
+        export = use_export(bounds, scale)
+
+    stats = (
+        ee.Image.pixelArea()
+        .divide(1e4)
+        .addBands(image)
+        .reduceRegion(
+            **{
+                "reducer": ee.Reducer.sum().group(groupField=1, groupName=group_name),
+                "geometry": region,
+                "scale": scale,
+                **reduce_params(export),
+            }
+        )
+    )
+    groups = ee.FeatureCollection(
+        ee.List(stats.get("groups")).map(
+            lambda group: ee.Feature(None, ee.Dictionary(group))
+        )
+    )
+    return fetch_table(groups, export, f"{group_name}_area", poll)
+
+
+landcover_classes = {
+    "Dynamic World": {
+        0: "Water",
+        1: "Trees",
+        2: "Grass",
+        3: "Flooded vegetation",
+        4: "Crops",
+        5: "Shrub and scrub",
+        6: "Built area",
+        7: "Bare ground",
+        8: "Snow and ice",
+    },
+    "ESA Land Cover": {
+        10: "Tree cover",
+        20: "Shrubland",
+        30: "Grassland",
+        40: "Cropland",
+        50: "Built-up",
+        60: "Bare / sparse vegetation",
+        70: "Snow and ice",
+        80: "Permanent water bodies",
+        90: "Herbaceous wetland",
+        95: "Mangroves",
+        100: "Moss and lichen",
+    },
+    "ESRI Land Cover": {
+        1: "Water",
+        2: "Trees",
+        3: "Grass",
+        4: "Flooded vegetation",
+        5: "Crops",
+        6: "Scrub/Shrub",
+        7: "Built area",
+        8: "Bare ground",
+        9: "Snow/Ice",
+        10: "Clouds",
+    },
+}
+
+# Class values of every product are below this, so two class images can be
+# packed into one integer band as left * CLASS_FACTOR + right.
+CLASS_FACTOR = 1000
+
+
+def landcover_image(dataset, region=None, start_date=None, end_date=None):
+    """Return a single-band land cover class image for the dataset."""
+    if dataset == "Dynamic World":
+        if region is None:
+            region = ee.Geometry.BBox(-179, -89, 179, 89)
+        image = geemap.dynamic_world(
+            region, start_date, end_date, return_type="class"
+        )
+    elif dataset == "ESA Land Cover":
+        image = ee.ImageCollection("ESA/WorldCover/v100").first().select("Map")
+    elif dataset == "ESRI Land Cover":
+        image = ee.ImageCollection(
+            "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
+        ).mosaic()
+    else:
+        raise ValueError(f"Unknown land cover dataset: {dataset}")
+
+    return image.rename("class").toInt()
+
+
+def landcover_crosstab(
+    left, right, region, scale=100, start_date=None, end_date=None
+):
+    """Cross-tabulate two land cover products over a region.
+
+    Both class images are packed into one band and summed with a single
+    grouped area reducer, so the whole matrix costs one request.
+
+    Returns:
+        tuple: A long table with the area of every class pair and the
+            confusion matrix (left classes as rows, right classes as columns),
+            both in hectares.
+    """
+    if left == right:
+        raise ValueError("Select two different land cover datasets")
+
+    left_image = landcover_image(left, region, start_date, end_date)
+    right_image = landcover_image(right, region, start_date, end_date)
+    combined = left_image.multiply(CLASS_FACTOR).add(right_image).rename("code")
+
+    groups = grouped_area(combined, region, scale, "code")
+
+    records = []
+    for group in groups:
+        code = int(group["code"])
+        left_value, right_value = divmod(code, CLASS_FACTOR)
+        records.append(
+            {
+                left: landcover_classes[left].get(left_value, str(left_value)),
+                right: landcover_classes[right].get(right_value, str(right_value)),
+                "Area (ha)": round(group["sum"], 2),
+            }
+        )
+
+    df = pd.DataFrame(records, columns=[left, right, "Area (ha)"])
+    total = df["Area (ha)"].sum()
+    df["Percentage"] = (df["Area (ha)"] / total * 100).round(2) if total else 0.0
+    df = df.sort_values("Area (ha)", ascending=False).reset_index(drop=True)
+
+    matrix = df.pivot_table(
+        index=left, columns=right, values="Area (ha)", aggfunc="sum", fill_value=0
+    )
+    return df, matrix
+
+
+datasets = [
+    "JRC Max Water Extent (1984-2020)",
+    "JRC Water Occurrence (1984-2020)",
+    "JRC Monthly Water History (1984-2020)",
+    "Dynamic World 2020",
+    "ESA Global Land Cover 2020",
+    "ESRI Global Land Cover 2020",
+    "OpenStreetMap Water Layer",
+    "Global River Width (GRWL)",
+    "Global floodplains (GFPLAIN250m)",
+    "HydroLAKES",
+]
+
+
+def dataset_image(dataset, water_only, region=None):
+    """Return the Earth Engine object displayed for a water dataset."""
+    if dataset == "JRC Max Water Extent (1984-2020)":
+
+        image = (
+            ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("max_extent").selfMask()
+        )
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+    elif dataset == "JRC Water Occurrence (1984-2020)":
+        image = ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("occurrence")
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "JRC Monthly Water History (1984-2020)":
+        image = (
+            ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
+            .map(lambda img: img.eq(2).selfMask())
+            .max()
+            .selfMask()
+        )
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "Dynamic World 2020":
+        start_date = "2020-01-01"
+        end_date = "2021-01-01"
+        if water_only:
+            image = geemap.dynamic_world(
+                region, start_date, end_date, return_type="class"
+            )
+
+            image = image.eq(0).selfMask()
+        else:
+            image = geemap.dynamic_world(
+                region, start_date, end_date, return_type="hillshade"
+            )
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "ESA Global Land Cover 2020":
+        image = ee.ImageCollection("ESA/WorldCover/v100").first()
+
+        if water_only:
+            image = image.eq(80).selfMask()
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "ESRI Global Land Cover 2020":
+
+        image = ee.ImageCollection(
+            "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
+        ).mosaic()
+
+        if water_only:
+            image = image.eq(1).selfMask()
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "OpenStreetMap Water Layer":
+        image = ee.ImageCollection(
+            "projects/sat-io/open-datasets/OSM_waterLayer"
+        ).mosaic()
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "Global River Width (GRWL)":
+
+        image = ee.ImageCollection(
+            "projects/sat-io/open-datasets/GRWL/water_mask_v01_01"
+        ).mosaic()
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "Global floodplains (GFPLAIN250m)":
+        image = ee.ImageCollection("projects/sat-io/open-datasets/GFPLAIN250").mosaic()
+
+        if region is not None:
+            image = image.clip(region)
+
+        return image
+
+    elif dataset == "HydroLAKES":
+        vector = ee.FeatureCollection(
+            "projects/sat-io/open-datasets/HydroLakes/lake_poly_v10"
+        )
+
+        if region is not None:
+            vector = vector.filterBounds(region)
+
+        return vector
+
+    raise ValueError(f"Unknown dataset: {dataset}")
+
+
+def area_by_group(
+    dataset, region, scale=1000, water_only=True, export=None, bounds=None, poll=None
+):
+    """Compute the area (ha) of every pixel value of a dataset within a region.
+
+    Returns:
+        pd.DataFrame: One row per pixel value, indexed by ``group``, with its
+            area (ha) and its fraction of the total area (``percentage``).
+    """
+    image = dataset_image(dataset, water_only, region)
+    if not isinstance(image, ee.Image):
+        raise ValueError(f"{dataset} is not a raster dataset")
+
+    groups = grouped_area(image.select(0), region, scale, "group", export, bounds, poll)
+    area = pd.Series(
+        {group["group"]: group["sum"] for group in groups}, name="area", dtype=float
+    ).sort_index()
+    total = area.sum()
+    df = pd.DataFrame(
+        {
+            "area": area.round(2),
+            "percentage": (area / total).round(4) if total else 0.0,
+        }
+    )
+    df.index.name = "group"
+    return df
+
+
+def occurrence_histogram(
+    region, scale=1000, bin_width=1, export=None, bounds=None, poll=None
+):
+    """Compute the area distribution of JRC water occurrence.
+
+    A single area-weighted fixed-bin histogram replaces the grouped area
+    reducer over up to 101 occurrence values. The bins are turned into area,
+    percentage and cumulative percentage locally.
+
+    Returns:
+        pd.DataFrame: One row per bin, indexed by the lower bound of the bin
+            (occurrence in %), with the area (ha), percentage and cum_pct.
+    """
+    if export is None:
+        export = use_export(bounds, scale)
+
+    bins = int(np.ceil(101 / bin_width))
+    image = (
+        ee.Image("JRC/GSW1_3/GlobalSurfaceWater")
+        .select("occurrence")
+        .addBands(ee.Image.pixelArea().divide(1e4))
+    )
+    stats = image.reduceRegion(
+        **{
+            "reducer": ee.Reducer.fixedHistogram(0, bins * bin_width, bins)
+            .splitWeights(),
+            "geometry": region,
+            "scale": scale,
+            **reduce_params(export),
+        }
+    )
+    histogram = ee.List(stats.values().get(0))
+    rows = fetch_table(
+        ee.FeatureCollection(
+            histogram.map(
+                lambda row: ee.Feature(
+                    None, {"bin": ee.List(row).get(0), "area": ee.List(row).get(1)}
+                )
+            )
+        ),
+        export,
+        "occurrence_histogram",
+        poll,
+    )
+
+    lower = np.array([row["bin"] for row in rows], dtype=float)
+    area = np.array([row["area"] for row in rows], dtype=float)
+    order = np.argsort(lower)
+    lower, area = lower[order], area[order]
+
+    total = area.sum()
+    percentage = area / total * 100 if total else np.zeros_like(area)
+    df = pd.DataFrame(
+        {
+            "area": area.round(2),
+            "percentage": percentage.round(2),
+            "cum_pct": np.cumsum(percentage).round(2),
+        },
+        index=pd.Index(lower.astype(int), name="group"),
+    )
+    return df
+
+
+def water_mask(dataset, region=None, window=None):
+    """Return a 0/1 water mask for the dataset, or None for vector datasets.
+
+    ``window`` is the ``(start_date, end_date, start_month, end_month)`` the
+    JRC monthly history is limited to, as in :func:`monthly_water_images`;
+    the whole history is used without it.
+    """
+    if dataset == "JRC Max Water Extent (1984-2020)":
+        image = ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("max_extent")
+    elif dataset == "JRC Water Occurrence (1984-2020)":
+        image = (
+            ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("occurrence").gte(50)
+        )
+    elif dataset == "JRC Monthly Water History (1984-2020)":
+        if window is not None:
+            image = monthly_water_images(*window).max()
+        else:
+            image = (
+                ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
+                .map(lambda img: img.eq(2))
+                .max()
+            )
+    elif dataset == "Dynamic World 2020":
+        if region is None:
+            region = ee.Geometry.BBox(-179, -89, 179, 89)
+        image = geemap.dynamic_world(
+            region, "2020-01-01", "2021-01-01", return_type="class"
+        ).eq(0)
+    elif dataset == "ESA Global Land Cover 2020":
+        image = ee.ImageCollection("ESA/WorldCover/v100").first().eq(80)
+    elif dataset == "ESRI Global Land Cover 2020":
+        image = (
+            ee.ImageCollection(
+                "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
+            )
+            .mosaic()
+            .eq(1)
+        )
+    elif dataset == "OpenStreetMap Water Layer":
+        image = (
+            ee.ImageCollection("projects/sat-io/open-datasets/OSM_waterLayer")
+            .mosaic()
+            .gt(0)
+        )
+    elif dataset == "Global River Width (GRWL)":
+        image = (
+            ee.ImageCollection("projects/sat-io/open-datasets/GRWL/water_mask_v01_01")
+            .mosaic()
+            .eq(255)
+        )
+    elif dataset == "Global floodplains (GFPLAIN250m)":
+        image = (
+            ee.ImageCollection("projects/sat-io/open-datasets/GFPLAIN250")
+            .mosaic()
+            .gt(0)
+        )
+    else:
+        return None
+
+    return image.unmask(0).rename("water").toByte()
+
+
+def water_agreement(datasets, region=None, window=None):
+    """Count how many of the datasets classify each pixel as water.
+
+    Pixels that no dataset classifies as water are masked. Vector datasets
+    such as HydroLAKES are skipped. ``window`` limits the JRC monthly history
+    (see :func:`water_mask`).
+
+    Returns:
+        tuple: The agreement image and the list of datasets it was built from.
+    """
+    masks = []
+    used = []
+    for dataset in datasets:
+        mask = water_mask(dataset, region, window)
+        if mask is not None:
+            masks.append(mask)
+            used.append(dataset)
+
+    if not masks:
+        raise ValueError("Select at least one raster water dataset")
+
+    image = ee.ImageCollection.fromImages(masks).sum().rename("agreement").toByte()
+    image = image.selfMask()
+    if region is not None:
+        image = image.clip(region)
+    return image, used
+
+
+def agreement_area(image, region, scale=1000, export=None, bounds=None, poll=None):
+    """Compute the area (ha) of every agreement level in one grouped reduction."""
+    groups = grouped_area(image, region, scale, "level", export, bounds, poll)
+
+    df = pd.DataFrame(
+        [(int(g["level"]), round(g["sum"], 2)) for g in groups],
+        columns=["Datasets agreeing", "Area (ha)"],
+    )
+    total = df["Area (ha)"].sum()
+    df["Percentage"] = (df["Area (ha)"] / total * 100).round(2) if total else 0.0
+    return df.sort_values("Datasets agreeing").reset_index(drop=True)
+
+
+def monthly_water_images(start_date, end_date, start_month, end_month):
+    """Return the JRC monthly water masks for a date and month window."""
+    return (
+        ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
+        .filterDate(start_date, end_date)
+        .filter(ee.Filter.calendarRange(start_month, end_month, "month"))
+        .map(lambda img: img.eq(2).selfMask())
+    )
+
+
+def month_count(start_date, end_date, start_month, end_month):
+    """Return an upper bound of the monthly images in a date and month window."""
+    years = int(end_date[:4]) - int(start_date[:4]) + 1
+    months = (end_month - start_month) % 12 + 1
+    return years * months
+
+
+def monthly_water_area(
+    region,
+    start_date,
+    end_date,
+    start_month=1,
+    end_month=12,
+    scale=1000,
+    export=None,
+    bounds=None,
+    poll=None,
+):
+    """Compute the JRC monthly water area (ha) within a region.
+
+    The dates and areas are fetched together, so the whole series costs one
+    request. Reductions estimated to be large from ``bounds`` are exported as
+    a batch table unless ``export`` is given explicitly.
+
+    Returns:
+        pd.DataFrame: One row per month with the Date, Year and Area (ha).
+    """
+    images = monthly_water_images(start_date, end_date, start_month, end_month)
+
+    if export is None:
+        count = month_count(start_date, end_date, start_month, end_month)
+        export = use_export(bounds, scale, count)
+
+    def cal_area(img):
+        pixel_area = img.multiply(ee.Image.pixelArea()).divide(1e4)
+        img_area = pixel_area.reduceRegion(
+            **{
+                "geometry": region,
+                "reducer": ee.Reducer.sum(),
+                "scale": scale,
+                **reduce_params(export),
+            }
+        )
+        return ee.Feature(
+            None, {"Date": img.get("system:index"), "area": img_area.get("water")}
+        )
+
+    rows = fetch_table(
+        ee.FeatureCollection(images.map(cal_area)), export, "monthly", poll
+    )
+    # Exported tables do not keep the order of the collection.
+    rows = sorted(rows, key=lambda row: row["Date"])
+
+    labels = [row["Date"] for row in rows]
+    values = [row.get("area") for row in rows]
+    dates = [d[:4] for d in labels]
+    return pd.DataFrame({"Date": labels, "Year": dates, "Area (ha)": values})
+
+
+def yearly_water_area(df, reducer="mean"):
+    """Aggregate a monthly water area table by year."""
+    result = df.groupby("Year").agg({"Area (ha)": reducer})
+    df2 = pd.DataFrame({"Year": result.index, "Area (ha)": result["Area (ha)"]})
+    return df2.reset_index(drop=True)
+
+
+CHANGE_BANDS = ["area_1", "area_2", "gain", "loss", "persistent"]
+
+
+def period_water(start_year, end_year):
+    """Pixels that are water in at least half of the observed years of a period."""
+    years = ee.ImageCollection("JRC/GSW1_3/YearlyHistory").filter(
+        ee.Filter.calendarRange(start_year, end_year, "year")
+    )
+    # Class 0 is no data; 2 and 3 are seasonal and permanent water.
+    water = years.map(lambda img: img.gte(2).updateMask(img.gt(0))).mean()
+    return water.gte(0.5).unmask(0)
+
+
+def water_change_image(period1, period2):
+    """Water area (ha) of two periods and its gain, loss and persistence.
+
+    Args:
+        period1 (tuple): First and last year of the first period.
+        period2 (tuple): First and last year of the second period.
+    """
+    first = period_water(*period1)
+    second = period_water(*period2)
+    masks = ee.Image.cat(
+        [
+            first,
+            second,
+            first.Not().And(second),
+            first.And(second.Not()),
+            first.And(second),
+        ]
+    ).rename(CHANGE_BANDS)
+    return masks.multiply(ee.Image.pixelArea().divide(1e4))
+
+
+def water_change_by_feature(
+    collection, field, names, period1, period2, scale=5000, chunk_size=25, workers=4
+):
+    """Compute the water change of every named feature in chunked calls.
+
+    Features are reduced with one ``reduceRegions`` call per chunk of
+    ``chunk_size`` names, and chunks run concurrently, so a whole collection
+    costs a few requests instead of one per feature.
+
+    Returns:
+        pd.DataFrame: One row per feature with the areas of both periods, the
+            gain, loss and persistent area in ha, and the net change in %.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    image = water_change_image(period1, period2)
+    names = list(names)
+    chunks = [names[i : i + chunk_size] for i in range(0, len(names), chunk_size)]
+
+    def reduce_chunk(chunk):
+        features = collection.filter(ee.Filter.inList(field, chunk))
+        stats = image.reduceRegions(
+            collection=features, reducer=ee.Reducer.sum(), scale=scale, tileScale=4
+        )
+        # Only the statistics travel back, not the feature geometries.
+        stats = stats.map(lambda f: f.select([field] + CHANGE_BANDS, None, False))
+        return fetch_table(stats)
+
+    with ThreadPoolExecutor(workers) as executor:
+        rows = [row for chunk in executor.map(reduce_chunk, chunks) for row in chunk]
+
+    df = pd.DataFrame(rows, columns=[field] + CHANGE_BANDS)
+    df = df.rename(
+        columns={
+            field: "Name",
+            "area_1": f"Area {period1[0]}-{period1[1]} (ha)",
+            "area_2": f"Area {period2[0]}-{period2[1]} (ha)",
+            "gain": "Gain (ha)",
+            "loss": "Loss (ha)",
+            "persistent": "Persistent (ha)",
+        }
+    )
+    first, second = df.columns[1], df.columns[2]
+    df["Net change (%)"] = 100 * (df[second] - df[first]) / df[first].replace(0, np.nan)
+    return df.sort_values("Net change (%)", ascending=False).reset_index(drop=True)
+
+
+# The row position of an uploaded feature; private so it cannot clash with
+# an attribute of the upload.
+FEATURE_ID = "_feature"
+
+
+def feature_batches(
+    gdf, scale, images=1, max_features=100, max_vertices=50000, max_pixels=1e9
+):
+    """Split features into groups small enough for one reduceRegions call.
+
+    A batch closes when adding a feature would exceed the number of features,
+    the vertices sent in the request payload or the pixels reduced at
+    ``scale``. Every feature is reduced over ``images`` images, so the pixel
+    budget is shared between them. A feature exceeding a limit on its own
+    gets a batch of its own.
+
+    Returns:
+        list: Lists of row positions in ``gdf``.
+    """
+    import shapely
+
+    vertices = shapely.get_num_coordinates(gdf.geometry.values)
+    # Areas in an equal-area projection, in m².
+    pixels = gdf.geometry.to_crs(epsg=6933).area.to_numpy() / (scale * scale)
+    max_pixels = max_pixels / max(images, 1)
+
+    batches = []
+    batch, batch_vertices, batch_pixels = [], 0, 0.0
+    for i, (n, p) in enumerate(zip(vertices, pixels)):
+        if batch and (
+            len(batch) >= max_features
+            or batch_vertices + n > max_vertices
+            or batch_pixels + p > max_pixels
+        ):
+            batches.append(batch)
+            batch, batch_vertices, batch_pixels = [], 0, 0.0
+        batch.append(i)
+        batch_vertices += n
+        batch_pixels += p
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def feature_statistics(
+    gdf,
+    start_date,
+    end_date,
+    start_month=1,
+    end_month=12,
+    scale=1000,
+    workers=4,
+    progress=None,
+):
+    """Compute the water area and monthly series of every uploaded feature.
+
+    Features are reduced in concurrent batches of ``reduceRegions`` calls
+    (see :func:`feature_batches`) and the results are joined back to the
+    feature attributes by row position, kept in the ``FEATURE_ID`` column so
+    an uploaded ``feature`` attribute is left alone.
+
+    Args:
+        gdf (gpd.GeoDataFrame): The uploaded features.
+        progress (callable): Called with the fraction of batches done.
+
+    Returns:
+        tuple: A table of the attributes with the JRC maximum water extent
+            area and the mean monthly water area of each feature, and a long
+            table of the monthly water area of each feature.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    gdf = gdf[gdf.geometry.notna()]
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+    gdf = gdf.to_crs(epsg=4326).reset_index(drop=True)
+    gdf[FEATURE_ID] = range(len(gdf))
+
+    max_extent = (
+        ee.Image("JRC/GSW1_3/GlobalSurfaceWater")
+        .select("max_extent")
+        .multiply(ee.Image.pixelArea().divide(1e4))
+    )
+    images = monthly_water_images(start_date, end_date, start_month, end_month)
+
+    def reduce_batch(rows):
+        features = geemap.gdf_to_ee(
+            gdf.iloc[rows][[FEATURE_ID, gdf.geometry.name]], geodesic=False
+        )
+        extent = max_extent.reduceRegions(
+            collection=features, reducer=ee.Reducer.sum(), scale=scale, tileScale=4
+        ).map(lambda f: f.select([FEATURE_ID, "sum"], None, False))
+
+        def monthly(img):
+            area = img.multiply(ee.Image.pixelArea().divide(1e4)).unmask(0)
+            stats = area.reduceRegions(
+                collection=features, reducer=ee.Reducer.sum(), scale=scale
+            )
+            date = img.get("system:index")
+            return stats.map(
+                lambda f: f.select([FEATURE_ID, "sum"], None, False).set("Date", date)
+            )
+
+        series = images.map(monthly).flatten()
+        # Both tables come back in one request.
+        result = ee.Dictionary(
+            {"extent": extent.toList(len(rows)), "series": series.toList(1000000)}
+        ).getInfo()
+        return (
+            [f["properties"] for f in result["extent"]],
+            [f["properties"] for f in result["series"]],
+        )
+
+    # The maximum extent and every monthly image are reduced per feature.
+    count = month_count(start_date, end_date, start_month, end_month)
+    batches = feature_batches(gdf, scale, 1 + count)
+    extent_rows, series_rows = [], []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(reduce_batch, rows) for rows in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            extent, series = future.result()
+            extent_rows.extend(extent)
+            series_rows.extend(series)
+            if progress is not None:
+                progress(done / len(batches))
+
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    series = pd.DataFrame(series_rows, columns=[FEATURE_ID, "Date", "sum"]).rename(
+        columns={"sum": "Area (ha)"}
+    )
+    series["Year"] = series["Date"].str[:4]
+    series = series.sort_values([FEATURE_ID, "Date"]).reset_index(drop=True)
+
+    extent = pd.DataFrame(extent_rows, columns=[FEATURE_ID, "sum"]).rename(
+        columns={"sum": "Max water extent (ha)"}
+    )
+    monthly_mean = (
+        series.groupby(FEATURE_ID)["Area (ha)"].mean().rename("Mean monthly area (ha)")
+    )
+    summary = attributes.merge(extent, on=FEATURE_ID, how="left").merge(
+        monthly_mean, left_on=FEATURE_ID, right_index=True, how="left"
+    )
+    return summary, attributes.merge(series, on=FEATURE_ID, how="right")
+
+
+osm_water_classes = {
+    1: "Ocean",
+    2: "Large Lake/River",
+    3: "Major River",
+    4: "Canal",
+    5: "Small Stream",
+}
+
+INSPECT_PRECISION = 4
+INSPECT_TTL = 86400
+
+
+def inspector_image():
+    """One image with a band per dataset sampled by :func:`inspect_point`."""
+    return ee.Image.cat(
+        [
+            ee.Image("JRC/GSW1_3/GlobalSurfaceWater")
+            .select("occurrence")
+            .rename("jrc_occurrence"),
+            ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1")
+            .filterDate("2020-01-01", "2021-01-01")
+            .select("label")
+            .mode()
+            .rename("dynamic_world"),
+            ee.ImageCollection("ESA/WorldCover/v100").first().rename("esa"),
+            ee.ImageCollection(
+                "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
+            )
+            .mosaic()
+            .rename("esri"),
+            ee.ImageCollection("projects/sat-io/open-datasets/OSM_waterLayer")
+            .mosaic()
+            .rename("osm_water"),
+            ee.ImageCollection("projects/sat-io/open-datasets/GFPLAIN250")
+            .mosaic()
+            .rename("gfplain"),
+        ]
+    )
+
+
+def inspect_point(longitude, latitude):
+    """Sample every water and land cover dataset at a point in one request.
+
+    Coordinates are rounded to ``INSPECT_PRECISION`` decimals (about 10 m)
+    and the values are cached by the rounded point, so clicking around the
+    same spot costs no further requests.
+
+    Returns:
+        pd.DataFrame: The dataset, its pixel value and the class name.
+    """
+    longitude = round(longitude, INSPECT_PRECISION)
+    latitude = round(latitude, INSPECT_PRECISION)
+    key = f"inspect:{longitude}:{latitude}"
+    cache = get_shared_cache()
+    values = cache.get(key)
+    profiler.count("inspector", values is not None)
+    if values is None:
+        values = (
+            inspector_image()
+            .reduceRegion(
+                reducer=ee.Reducer.first(),
+                geometry=ee.Geometry.Point([longitude, latitude]),
+                scale=10,
+            )
+            .getInfo()
+        )
+        cache.set(key, values, INSPECT_TTL)
+
+    rows = [
+        ("JRC Water Occurrence (%)", "jrc_occurrence", None),
+        ("Dynamic World 2020", "dynamic_world", landcover_classes["Dynamic World"]),
+        ("ESA Global Land Cover 2020", "esa", landcover_classes["ESA Land Cover"]),
+        ("ESRI Global Land Cover 2020", "esri", landcover_classes["ESRI Land Cover"]),
+        ("OpenStreetMap Water Layer", "osm_water", osm_water_classes),
+        ("Global floodplains (GFPLAIN250m)", "gfplain", {1: "Floodplain"}),
+    ]
+    records = []
+    for name, band, classes in rows:
+        value = values.get(band)
+        label = None
+        if classes is not None and value is not None:
+            label = classes.get(int(value))
+        records.append({"Dataset": name, "Value": value, "Class": label})
+    return pd.DataFrame(records)
@@ -0,0 +1,288 @@
+"""Headless HTTP API for the surface water analyses.
+
+Run the service with:
+
+    python api.py --port 8000 --workers 4
+
+Endpoints (GET with query parameters, or POST with a JSON body):
+
+    /datasets                  List the datasets.
+    /monthly-water-area        JRC monthly water area, aggregated by year.
+    /area-by-group             Area of every pixel value of a dataset.
+    /metrics                   Earth Engine request, queue and throttle counters.
+
+The region is given as ``country`` (a name from the countries collection),
+``bbox`` (``minx,miny,maxx,maxy``) or, for POST, a GeoJSON ``geometry``.
+Add ``format=csv`` or ``format=parquet`` to download a table instead of JSON.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import ee
+import geemap.foliumap as geemap
+from shapely.geometry import shape
+
+import ee_client
+import shared_cache
+from analysis import area_by_group, datasets, monthly_water_area, yearly_water_area
+from spatial_index import get_country_index
+
+logger = logging.getLogger("api")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Engine:
+    """Run analyses in a bounded worker pool and cache their results.
+
+    Results go to the cache shared by the workers of the deployment (see
+    :mod:`shared_cache`). Identical requests arriving while a computation is
+    running wait for that computation instead of starting another one.
+    """
+
+    def __init__(self, workers=4, max_queue=32, cache=None, ttl=3600):
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.cache = cache or shared_cache.get_shared_cache()
+        self.ttl = ttl
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, func, *args):
+        result = self.cache.get(f"api:{key}")
+        if result is not None:
+            return result
+
+        submitted = False
+        with self.lock:
+            future = self.running.get(key)
+            if future is None:
+                if not self.slots.acquire(blocking=False):
+                    raise HTTPError(503, "Too many pending requests, try again later")
+                future = self.executor.submit(func, *args)
+                self.running[key] = future
+                submitted = True
+
+        # A future that is already done runs the callback in this thread, and
+        # the callback takes the lock.
+        if submitted:
+            future.add_done_callback(lambda f: self._done(key, f))
+        return future.result()
+
+    def _done(self, key, future):
+        if future.exception() is None:
+            self.cache.set(f"api:{key}", future.result(), self.ttl)
+        with self.lock:
+            self.running.pop(key, None)
+        self.slots.release()
+
+
+def get_region(params):
+    if "geometry" in params:
+        geometry = params["geometry"]
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        return ee.Geometry(geometry, None, False)
+    elif "bbox" in params:
+        try:
+            minx, miny, maxx, maxy = [float(v) for v in params["bbox"].split(",")]
+        except ValueError:
+            raise HTTPError(400, "bbox must be minx,miny,maxx,maxy")
+        return ee.Geometry.BBox(minx, miny, maxx, maxy)
+    elif "country" in params:
+        return ee.FeatureCollection("users/giswqs/public/countries").filter(
+            ee.Filter.eq("NAME", params["country"])
+        )
+    else:
+        raise HTTPError(400, "Specify a country, bbox or geometry")
+
+
+def get_bounds(params):
+    """Return [minx, miny, maxx, maxy] of a valid region, computed locally.
+
+    The bounds decide whether a reduction runs as a batch export; None for an
+    unknown country leaves it synchronous.
+    """
+    if "geometry" in params:
+        geometry = params["geometry"]
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        return list(shape(geometry).bounds)
+    elif "bbox" in params:
+        return [float(v) for v in params["bbox"].split(",")]
+    countries = get_country_index("NAME")
+    if params["country"] in countries.rows:
+        return countries.bounds(params["country"])
+    return None
+
+
+def get_number(params, name, default, cast=int):
+    try:
+        return cast(params.get(name, default))
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Invalid value for {name}")
+
+
+def monthly_water_area_handler(params):
+    region = get_region(params)
+    bounds = get_bounds(params)
+    start_year = get_number(params, "start_year", 1984)
+    end_year = get_number(params, "end_year", 2021)
+    start_month = get_number(params, "start_month", 6)
+    end_month = get_number(params, "end_month", 9)
+    scale = get_number(params, "scale", 1000, float)
+    reducer = params.get("reducer", "mean")
+    if reducer not in ["sum", "mean", "min", "max"]:
+        raise HTTPError(400, "reducer must be sum, mean, min or max")
+
+    start_date = f"{start_year}-{str(start_month).zfill(2)}-01"
+    end_date = f"{end_year}-{str(end_month).zfill(2)}-01"
+
+    def compute():
+        df = monthly_water_area(
+            region, start_date, end_date, start_month, end_month, scale, bounds=bounds
+        )
+        if str(params.get("yearly", "1")) == "0":
+            return df
+        return yearly_water_area(df, reducer)
+
+    return compute
+
+
+def area_by_group_handler(params):
+    region = get_region(params)
+    bounds = get_bounds(params)
+    dataset = params.get("dataset")
+    if dataset not in datasets:
+        raise HTTPError(400, f"dataset must be one of {datasets}")
+    scale = get_number(params, "scale", 1000, float)
+    water_only = str(params.get("water_only", "1")) != "0"
+
+    def compute():
+        df = area_by_group(dataset, region, scale, water_only, bounds=bounds)
+        return df.reset_index()
+
+    return compute
+
+
+routes = {
+    "/monthly-water-area": monthly_water_area_handler,
+    "/area-by-group": area_by_group_handler,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    engine = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.handle_request(url.path, dict(parse_qsl(url.query)))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError:
+                return self.send_error_json(400, "Request body must be JSON")
+            if not isinstance(body, dict):
+                return self.send_error_json(400, "Request body must be a JSON object")
+            params.update(body)
+        self.handle_request(url.path, params)
+
+    def handle_request(self, path, params):
+        if path == "/datasets":
+            return self.send_body(200, json.dumps(datasets), "application/json")
+        if path == "/metrics":
+            metrics = ee_client.get_client().metrics()
+            return self.send_body(200, json.dumps(metrics), "application/json")
+
+        handler = routes.get(path)
+        if handler is None:
+            return self.send_error_json(404, f"Unknown endpoint: {path}")
+
+        fmt = params.pop("format", "json")
+        if fmt not in ["json", "csv", "parquet"]:
+            return self.send_error_json(400, "format must be json, csv or parquet")
+
+        key = hashlib.sha1(
+            json.dumps([path, params], sort_keys=True).encode()
+        ).hexdigest()
+        try:
+            df = self.engine.run(key, handler(params))
+        except HTTPError as e:
+            return self.send_error_json(e.status, str(e))
+        except ee.EEException as e:
+            return self.send_error_json(502, str(e))
+        except ValueError as e:
+            # Invalid parameters, e.g. a vector dataset where a raster is needed.
+            return self.send_error_json(400, str(e))
+        except Exception as e:
+            logger.exception("Request %s failed", self.path)
+            return self.send_error_json(500, str(e))
+
+        if fmt == "csv":
+            self.send_body(200, df.to_csv(index=False), "text/csv")
+        elif fmt == "parquet":
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+            self.send_body(200, buffer.getvalue(), "application/octet-stream")
+        else:
+            self.send_body(200, df.to_json(orient="records"), "application/json")
+
+    def send_error_json(self, status, message):
+        self.send_body(status, json.dumps({"error": message}), "application/json")
+
+    def send_body(self, status, body, content_type):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the water analyses as JSON")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--cache-ttl", type=int, default=3600)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    geemap.ee_initialize()
+    ee_client.install()
+
+    Handler.engine = Engine(args.workers, args.max_queue, ttl=args.cache_ttl)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logger.info("Serving on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
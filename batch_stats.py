@@ -0,0 +1,218 @@
+"""Compute JRC monthly water area for many ROIs from the command line.
+
+Example:
+
+    python batch_stats.py basins.gpkg -o basins.parquet --id-field HYBAS_ID
+
+Completed ROIs are appended to a checkpoint file next to the output, so an
+interrupted run picks up where it stopped when started again with the same
+arguments.
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import ee_client
+
+logger = logging.getLogger("batch_stats")
+
+
+def init_worker(rate=None, concurrency=None):
+    """Initialize Earth Engine with this process's share of the request limits."""
+    import geemap
+
+    # ee_client reads its limits when the first request is made.
+    if rate is not None:
+        os.environ["EE_RATE_LIMIT"] = str(rate)
+        os.environ["EE_RATE_BURST"] = str(max(rate, 1))
+    if concurrency is not None:
+        os.environ["EE_CONCURRENCY"] = str(concurrency)
+        os.environ["EE_MAX_CONCURRENCY"] = str(concurrency)
+    geemap.ee_initialize()
+    ee_client.install()
+
+
+def compute_roi(roi_id, geometry, bounds, params):
+    """Compute the monthly water area for one ROI given as a GeoJSON geometry.
+
+    ``bounds`` decide locally whether the reduction runs as a batch export.
+    Throttled requests are retried with backoff by ee_client; other errors
+    fail the ROI, which the next run picks up again.
+    """
+    import ee
+    from analysis import monthly_water_area
+
+    region = ee.Geometry(geometry, None, False)
+    with ee_client.priority(ee_client.BATCH):
+        df = monthly_water_area(
+            region,
+            params["start_date"],
+            params["end_date"],
+            params["start_month"],
+            params["end_month"],
+            params["scale"],
+            bounds=bounds,
+        )
+
+    df.insert(0, "ROI", roi_id)
+    return df.to_dict(orient="records")
+
+
+def read_checkpoint(path):
+    """Return the records of the ROIs completed by a previous run."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+
+    with open(path) as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut short if the run was killed.
+                continue
+            done[item["roi"]] = item["records"]
+    return done
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compute JRC monthly water area for every ROI in a vector file."
+    )
+    parser.add_argument("input", help="GeoPackage, GeoJSON or any file geopandas reads")
+    parser.add_argument("-o", "--output", required=True, help="Output Parquet file")
+    parser.add_argument("--layer", help="Layer to read from a multi-layer file")
+    parser.add_argument(
+        "--id-field", help="Attribute identifying each ROI (default: row index)"
+    )
+    parser.add_argument("--start-year", type=int, default=1984)
+    parser.add_argument("--end-year", type=int, default=2021)
+    parser.add_argument("--start-month", type=int, default=1)
+    parser.add_argument("--end-month", type=int, default=12)
+    parser.add_argument("--scale", type=float, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="Run ROIs in a thread pool or a process pool",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5,
+        help="Maximum number of Earth Engine requests started per second",
+    )
+    parser.add_argument(
+        "--checkpoint", help="Checkpoint file (default: <output>.checkpoint.jsonl)"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import mapping
+
+    gdf = gpd.read_file(args.input, layer=args.layer)
+    gdf = gdf[gdf.geometry.notna()].to_crs(epsg=4326)
+    if args.id_field:
+        ids = gdf[args.id_field].astype(str)
+    else:
+        ids = gdf.index.astype(str)
+    duplicates = ids[ids.duplicated()].unique()
+    if len(duplicates):
+        logger.error(
+            "%d ROI ids are not unique (e.g. %s); use an --id-field with unique values",
+            len(duplicates),
+            ", ".join(map(str, duplicates[:5])),
+        )
+        return 2
+    rois = dict(zip(ids, gdf.geometry))
+
+    params = {
+        "start_date": f"{args.start_year}-{str(args.start_month).zfill(2)}-01",
+        "end_date": f"{args.end_year}-{str(args.end_month).zfill(2)}-01",
+        "start_month": args.start_month,
+        "end_month": args.end_month,
+        "scale": args.scale,
+    }
+
+    checkpoint = args.checkpoint or f"{args.output}.checkpoint.jsonl"
+    done = read_checkpoint(checkpoint)
+    todo = [roi_id for roi_id in rois if roi_id not in done]
+    logger.info("%d ROIs, %d already done, %d to go", len(rois), len(done), len(todo))
+
+    # ee_client limits the requests of one process, retries included. Threads
+    # share the client of this process; each worker process gets its share of
+    # the rate and one request in flight, so the pool stays within --rate.
+    if args.executor == "process":
+        executor = ProcessPoolExecutor(
+            args.workers,
+            initializer=init_worker,
+            initargs=(args.rate / args.workers, 1),
+        )
+    else:
+        init_worker(args.rate)
+        executor = ThreadPoolExecutor(args.workers)
+
+    failed = []
+    with executor, open(checkpoint, "a") as log:
+        pending = {}
+        queue = iter(todo)
+        finished = False
+        while pending or not finished:
+            while not finished and len(pending) < args.workers * 2:
+                roi_id = next(queue, None)
+                if roi_id is None:
+                    finished = True
+                    break
+                geometry = rois[roi_id]
+                future = executor.submit(
+                    compute_roi, roi_id, mapping(geometry), geometry.bounds, params
+                )
+                pending[future] = roi_id
+
+            if not pending:
+                break
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                roi_id = pending.pop(future)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    logger.error("ROI %s failed: %s", roi_id, e)
+                    failed.append(roi_id)
+                    continue
+                done[roi_id] = records
+                log.write(json.dumps({"roi": roi_id, "records": records}) + "\n")
+                log.flush()
+                logger.debug("ROI %s done (%d/%d)", roi_id, len(done), len(rois))
+
+    df = pd.DataFrame([record for roi_id in rois for record in done.get(roi_id, [])])
+    df.to_parquet(args.output, index=False)
+    logger.info("Wrote %d rows for %d ROIs to %s", len(df), len(done), args.output)
+
+    if failed:
+        logger.warning("%d ROIs failed; run again to retry them", len(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
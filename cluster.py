@@ -0,0 +1,250 @@
+"""Run several Streamlit workers behind a sticky-session proxy.
+
+Example:
+
+    python cluster.py --workers 4 --port 8501
+
+Starts one ``streamlit run Home.py`` process per worker on consecutive ports
+above ``--base-port``, writes an nginx configuration that balances them with
+sticky sessions (a Streamlit session lives in one process and talks to it
+over a websocket) and starts nginx in the foreground unless ``--no-proxy``
+is given. Workers that exit are restarted with exponential backoff; a worker
+that keeps crashing is given up after ``--max-restarts`` quick exits.
+
+Sessions stick to a worker through a random ``water_worker`` cookie set by
+nginx rather than through the client address, so users behind one NAT or
+proxy are still spread over the workers.
+
+The workers share results, pyramid levels and map IDs through
+``WATER_SHARED_CACHE``, which defaults to a SQLite file in the cache
+directory; set it to ``redis://...`` to share them between machines.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("cluster")
+
+# The same directory as spatial_index.CACHE_DIR, without importing Earth Engine.
+CACHE_DIR = os.environ.get(
+    "WATER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "streamlit-water")
+)
+
+NGINX_CONF = """\
+daemon off;
+worker_processes auto;
+pid {pid};
+error_log stderr;
+
+events {{
+    worker_connections 4096;
+}}
+
+http {{
+    access_log off;
+    client_max_body_size 200m;
+    client_body_temp_path {temp}/body;
+    proxy_temp_path {temp}/proxy;
+    fastcgi_temp_path {temp}/fastcgi;
+    uwsgi_temp_path {temp}/uwsgi;
+    scgi_temp_path {temp}/scgi;
+
+    # A browser keeps its worker through a cookie; a new one gets a random key.
+    map $cookie_water_worker $worker_key {{
+        "" $request_id;
+        default $cookie_water_worker;
+    }}
+
+    upstream streamlit {{
+        # A client always reaches the worker holding its session.
+        hash $worker_key consistent;
+{servers}
+    }}
+
+    map $http_upgrade $connection_upgrade {{
+        default upgrade;
+        '' close;
+    }}
+
+    server {{
+        listen {port};
+
+        location / {{
+            proxy_pass http://streamlit;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection $connection_upgrade;
+            proxy_set_header Host $host;
+            proxy_read_timeout 86400;
+            add_header Set-Cookie "water_worker=$worker_key; Path=/; HttpOnly; SameSite=Lax";
+        }}
+    }}
+}}
+"""
+
+
+def nginx_conf(port, worker_ports, directory):
+    """Return the nginx configuration for the workers."""
+    servers = "\n".join(f"        server 127.0.0.1:{p};" for p in worker_ports)
+    return NGINX_CONF.format(
+        port=port,
+        servers=servers,
+        pid=os.path.join(directory, "nginx.pid"),
+        temp=directory,
+    )
+
+
+# A worker running this long is healthy, and its next restart is immediate.
+HEALTHY_UPTIME = 60
+MAX_BACKOFF = 60
+
+
+def start_worker(port, script, env):
+    command = [
+        sys.executable,
+        "-m",
+        "streamlit",
+        "run",
+        script,
+        "--server.port",
+        str(port),
+        "--server.address",
+        "127.0.0.1",
+        "--server.headless",
+        "true",
+    ]
+    logger.info("Starting worker on port %d", port)
+    return subprocess.Popen(command, env=env)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run several Streamlit workers behind nginx."
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8501)))
+    parser.add_argument("--base-port", type=int, default=8601)
+    parser.add_argument("--script", default="Home.py")
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=10,
+        help="Give up a worker after this many restarts in a row that crashed",
+    )
+    parser.add_argument(
+        "--no-proxy",
+        action="store_true",
+        help="Only write the nginx configuration, e.g. for an external nginx",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    directory = os.path.join(CACHE_DIR, "cluster")
+    for name in ["body", "proxy", "fastcgi", "uwsgi", "scgi"]:
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    env = dict(os.environ)
+    env.setdefault(
+        "WATER_SHARED_CACHE", "sqlite:///" + os.path.join(CACHE_DIR, "shared.db")
+    )
+    logger.info("Sharing caches through %s", env["WATER_SHARED_CACHE"])
+
+    worker_ports = [args.base_port + i for i in range(args.workers)]
+    conf = os.path.join(directory, "nginx.conf")
+    with open(conf, "w") as f:
+        f.write(nginx_conf(args.port, worker_ports, directory))
+    logger.info("Wrote %s", conf)
+
+    workers = {port: start_worker(port, args.script, env) for port in worker_ports}
+    started = {port: time.monotonic() for port in worker_ports}
+    backoff = {port: 1 for port in worker_ports}
+    crashes = {port: 0 for port in worker_ports}
+    # Ports of exited workers and when to start them again.
+    restarts = {}
+    proxy = None
+    if not args.no_proxy:
+        nginx = shutil.which("nginx")
+        if nginx is None:
+            raise SystemExit("nginx not found; install it or run with --no-proxy")
+        proxy = subprocess.Popen([nginx, "-c", conf, "-p", directory])
+        logger.info("Serving %d workers on port %d", len(workers), args.port)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    code = 0
+    try:
+        while not stopping:
+            now = time.monotonic()
+            for port, process in list(workers.items()):
+                if process is None or process.poll() is None:
+                    continue
+                uptime = now - started[port]
+                # Quick crashes back off; a long healthy run resets the backoff.
+                if uptime > HEALTHY_UPTIME:
+                    backoff[port], crashes[port] = 1, 0
+                else:
+                    backoff[port] = min(backoff[port] * 2, MAX_BACKOFF)
+                    crashes[port] += 1
+                workers[port] = None
+                if crashes[port] > args.max_restarts:
+                    logger.error(
+                        "Worker on port %d crashed %d times in a row; giving up",
+                        port,
+                        crashes[port],
+                    )
+                    continue
+                logger.warning(
+                    "Worker on port %d exited with %d after %.0f s; restart in %d s",
+                    port,
+                    process.returncode,
+                    uptime,
+                    backoff[port],
+                )
+                restarts[port] = now + backoff[port]
+            for port, restart_at in list(restarts.items()):
+                if now >= restart_at:
+                    del restarts[port]
+                    workers[port] = start_worker(port, args.script, env)
+                    started[port] = now
+            if not restarts and all(process is None for process in workers.values()):
+                logger.error("All workers have been given up")
+                code = 1
+                break
+            if proxy is not None and proxy.poll() is not None:
+                logger.error("nginx exited with %d", proxy.returncode)
+                code = 1
+                break
+            time.sleep(1)
+    finally:
+        for process in list(workers.values()) + [proxy]:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in list(workers.values()) + [proxy]:
+            if process is not None:
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
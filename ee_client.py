@@ -0,0 +1,290 @@
+"""Process-wide throttling of Earth Engine requests.
+
+All sessions of a Streamlit process share one Earth Engine account, so
+concurrent reruns quickly run into "Too many concurrent aggregations" and
+quota errors. :func:`install` routes every ``getInfo()`` and ``getMapId()``
+call through a shared :class:`Client` that
+
+- limits the request rate with a token bucket,
+- limits the number of requests in flight with an AIMD limit that halves on
+  throttling errors and grows by one per round of successful requests,
+- retries throttled requests with jittered exponential backoff, and
+- lets interactive requests (map IDs) jump ahead of statistics and batch
+  requests waiting for a slot.
+
+Use :func:`priority` to change the class of the requests made by a thread.
+"""
+
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import ee
+
+import profiler
+from shared_cache import get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+STATS = 1
+BATCH = 2
+
+priority_names = {INTERACTIVE: "interactive", STATS: "stats", BATCH: "batch"}
+
+THROTTLE_MESSAGES = [
+    "too many concurrent",
+    "too many requests",
+    "quota exceeded",
+    "rate limit",
+    "429",
+    "503",
+    "service unavailable",
+]
+
+
+def is_throttled(error):
+    """Whether an error means Earth Engine asked us to slow down."""
+    message = str(error).lower()
+    return any(text in message for text in THROTTLE_MESSAGES)
+
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` acquisitions per second."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase and multiplicative decrease.
+
+    Waiting callers are admitted in priority order, then in arrival order.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=32):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    def acquire(self, priority=STATS):
+        with self.cond:
+            entry = (priority, next(self.counter))
+            heapq.heappush(self.waiters, entry)
+            while self.waiters[0] != entry or self.in_flight >= int(self.limit):
+                self.cond.wait()
+            heapq.heappop(self.waiters)
+            self.in_flight += 1
+            self.cond.notify_all()
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def queue_depth(self):
+        with self.cond:
+            depth = {name: 0 for name in priority_names.values()}
+            for priority, _ in self.waiters:
+                depth[priority_names.get(priority, str(priority))] += 1
+            return depth
+
+
+class Client:
+    """Run Earth Engine requests under a shared rate and concurrency limit."""
+
+    def __init__(
+        self,
+        rate=20,
+        burst=20,
+        concurrency=8,
+        max_concurrency=32,
+        retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(concurrency, 1, max_concurrency)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.counts = {
+            "requests": 0,
+            "throttled": 0,
+            "retries": 0,
+            "failures": 0,
+            "rate_wait_seconds": 0.0,
+        }
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def call(self, func, *args, priority=None, **kwargs):
+        """Call ``func`` once a slot and a token are available, with retries."""
+        if priority is None:
+            priority = current_priority()
+
+        for attempt in range(self.retries + 1):
+            throttled = False
+            self.limiter.acquire(priority)
+            try:
+                self._count("rate_wait_seconds", self.bucket.acquire())
+                self._count("requests")
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not is_throttled(e):
+                    self._count("failures")
+                    raise
+                throttled = True
+                self._count("throttled")
+                if attempt == self.retries:
+                    self._count("failures")
+                    raise
+            finally:
+                self.limiter.release(throttled)
+
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            logger.info("Earth Engine throttled the request, retrying in %.1fs", delay)
+            self._count("retries")
+            time.sleep(delay)
+
+    def metrics(self):
+        """Return the request counters, queue depth and current limits."""
+        with self.lock:
+            metrics = dict(self.counts)
+        metrics["in_flight"] = self.limiter.in_flight
+        metrics["concurrency_limit"] = int(self.limiter.limit)
+        metrics["queue_depth"] = self.limiter.queue_depth()
+        return metrics
+
+
+_local = threading.local()
+
+
+def current_priority(default=STATS):
+    return getattr(_local, "priority", default)
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Run the Earth Engine requests of this thread with the given priority."""
+    previous = getattr(_local, "priority", None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.priority
+        else:
+            _local.priority = previous
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the client shared by the whole process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(
+                rate=float(os.environ.get("EE_RATE_LIMIT", 20)),
+                burst=float(os.environ.get("EE_RATE_BURST", 20)),
+                concurrency=int(os.environ.get("EE_CONCURRENCY", 8)),
+                max_concurrency=int(os.environ.get("EE_MAX_CONCURRENCY", 32)),
+            )
+        return _client
+
+
+MAP_ID_TTL = float(os.environ.get("EE_MAP_ID_TTL", 3600))
+
+
+def map_id_key(params):
+    """Return a cache key for the parameters of a getMapId() call."""
+    options = {k: v for k, v in params.items() if k != "image"}
+    text = params["image"].serialize() + json.dumps(
+        options, sort_keys=True, default=str
+    )
+    return "mapid:" + hashlib.sha1(text.encode()).hexdigest()
+
+
+def install():
+    """Route ee.data.computeValue and ee.data.getMapId through the client.
+
+    Calling it more than once has no effect.
+    """
+    with _client_lock:
+        if getattr(ee.data, "_throttled", False):
+            return
+        compute_value = ee.data.computeValue
+        get_map_id = ee.data.getMapId
+
+        @functools.wraps(compute_value)
+        def throttled_compute_value(*args, **kwargs):
+            return get_client().call(compute_value, *args, **kwargs)
+
+        @functools.wraps(get_map_id)
+        def throttled_get_map_id(params, *args, **kwargs):
+            # Map IDs are shared with the other workers of the deployment.
+            key = map_id_key(params)
+            cache = get_shared_cache()
+            result = cache.get(key)
+            profiler.count("map id", result is not None)
+            if result is None:
+                result = get_client().call(
+                    get_map_id,
+                    params,
+                    *args,
+                    priority=current_priority(INTERACTIVE),
+                    **kwargs,
+                )
+                cache.set(key, result, MAP_ID_TTL)
+            return result
+
+        ee.data.computeValue = throttled_compute_value
+        ee.data.getMapId = throttled_get_map_id
+        ee.data._throttled = True
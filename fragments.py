@@ -0,0 +1,177 @@
+"""Parts of the pages that rerun independently of the rest of the page.
+
+Streamlit reruns the whole script on every interaction, rebuilding the map
+and its layers even when only a chart option changed. Panels wrapped in
+:func:`fragment` rerun on their own when their widgets change: clicking the
+map reruns only the map panel, editing vis params reruns only the map view of
+pages 1 and 2, zooming swaps only the ROI outline, and cancelling a job or
+changing a chart option reruns only that job's panel. Job panels also poll their job on a timer of their own
+instead of blocking the script. On Streamlit versions without fragments the
+panels are plain functions and the whole page reruns as before.
+"""
+
+import time
+
+import folium
+import streamlit as st
+from streamlit_folium import st_folium
+
+import profiler
+from analysis import inspect_point
+from jobs import CANCELLED, FAILED, get_manager
+
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+FRAGMENTS = _fragment is not None
+POLL_INTERVAL = 1.0
+MAP_KEY = "map"
+
+
+def fragment(func=None, *, run_every=None):
+    """``st.fragment``, or a plain function where fragments are not supported.
+
+    Use as ``@fragment`` or ``@fragment(run_every=...)``.
+    """
+    if func is None:
+        return lambda func: fragment(func, run_every=run_every)
+    if not FRAGMENTS:
+        return func
+    return _fragment(func, run_every=run_every)
+
+
+def rerun():
+    """Rerun the whole page, also when called from inside a fragment."""
+    if hasattr(st, "rerun"):
+        st.rerun()
+    else:
+        st.experimental_rerun()
+
+
+def outline_layer(geojson, name, style):
+    """Return a feature group drawing an ROI outline with a fixed style."""
+    group = folium.FeatureGroup(name=name)
+    folium.GeoJson(geojson, style_function=lambda _: style).add_to(group)
+    return group
+
+
+def show_map(Map, country_index=None, country=None, height=680, outline=None):
+    """Render the map and inspect the datasets at the clicked point.
+
+    With a ``country_index``, clicking inside another country selects it and
+    reruns the page. ``outline`` returns the ROI outline layer for a map zoom.
+    The outline is sent apart from the map, so zooming swaps it for one
+    simplified for the new zoom while the map keeps its view.
+    """
+    # The zoom the map reported last; zooming reruns this panel.
+    zoom = (st.session_state.get(MAP_KEY) or {}).get("zoom")
+    group = outline(zoom) if outline is not None else None
+    with profiler.span("map", "render map") as info:
+        if profiler.ENABLED:
+            info["bytes"] = len(Map.get_root().render())
+        output = st_folium(
+            Map,
+            height=height,
+            width=None,
+            returned_objects=["last_clicked", "zoom"],
+            feature_group_to_add=group,
+            key=MAP_KEY,
+        )
+
+    # Clicking inside a country selects it; the lookup is done locally.
+    click = output.get("last_clicked") if output else None
+    if click and click != st.session_state.get("last_clicked"):
+        st.session_state["last_clicked"] = click
+        if country_index is not None:
+            clicked = country_index.lookup(click["lng"], click["lat"])
+            if clicked is not None and clicked != country:
+                st.session_state["default_country"] = clicked
+                rerun()
+
+    # Every dataset is sampled at the clicked point in one cached request.
+    click = st.session_state.get("last_clicked")
+    if click:
+        with st.expander(
+            f"Pixel values at {click['lat']:.4f}, {click['lng']:.4f}", True
+        ):
+            st.table(inspect_point(click["lng"], click["lat"]))
+
+
+@fragment
+def map_panel(Map, country_index=None, country=None, height=680, outline=None):
+    """Render a prebuilt map with :func:`show_map` as its own fragment."""
+    show_map(Map, country_index, country, height, outline)
+
+
+def job_panel(
+    job_id,
+    session_key,
+    render,
+    title=None,
+    cancel_label="Cancel",
+    cancelled="The job was cancelled.",
+    waiting="Computing...",
+):
+    """Show the progress of a background job and then its result.
+
+    While the job runs, the panel reruns every ``POLL_INTERVAL`` seconds on
+    its own, so the rest of the page is not held up. Once the job is done the
+    page reruns once and the panel shows the result.
+
+    Args:
+        job_id (str): The job, shown only while ``st.session_state`` holds it
+            under ``session_key``.
+        render (callable): Displays the result of the job.
+    """
+    if job_id is None or st.session_state.get(session_key) != job_id:
+        return
+    jobs = get_manager()
+    job = jobs.get(job_id)
+    if job is None:
+        return
+
+    if title:
+        st.subheader(title)
+
+    if not FRAGMENTS:
+        # Nothing reruns the panel without fragments; wait for the job here.
+        if not job.done:
+            if st.button(cancel_label, key=f"cancel_{session_key}"):
+                jobs.cancel(job.id)
+            progress = st.progress(job.progress)
+            empty = st.empty()
+            while not job.done:
+                job.touch()
+                progress.progress(job.progress)
+                empty.text(job.message or waiting)
+                time.sleep(POLL_INTERVAL)
+            progress.empty()
+            empty.empty()
+        show_result(job, render, title or session_key, cancelled)
+        return
+
+    running = not job.done
+
+    @fragment(run_every=POLL_INTERVAL if running else None)
+    def panel():
+        if not job.done:
+            job.touch()
+            if st.button(cancel_label, key=f"cancel_{session_key}"):
+                jobs.cancel(job.id)
+            st.progress(job.progress)
+            st.text(job.message or waiting)
+        elif running:
+            # Stop polling; the page may also depend on the finished job.
+            rerun()
+        else:
+            show_result(job, render, title or session_key, cancelled)
+
+    panel()
+
+
+def show_result(job, render, name, cancelled):
+    if job.status == FAILED:
+        st.error(job.error)
+    elif job.status == CANCELLED:
+        st.warning(cancelled)
+    else:
+        with profiler.span("pandas/plotly", name):
+            render(job.result)
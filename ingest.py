@@ -0,0 +1,169 @@
+"""Bounded-memory reading of uploaded GeoJSON, KML and zipped shapefiles.
+
+Uploads are read straight from the bytes Streamlit already holds, with no
+temporary file, through pyogrio's Arrow stream. Features come in record
+batches, so attribute (``where``) and ``bbox`` filters are applied by GDAL
+before anything is materialized. Every batch is checked against the vertex
+budget, so a huge upload fails early with a clear message instead of
+exhausting memory.
+
+Budgets are read from the environment:
+
+- ``WATER_UPLOAD_MAX_MB``: size of an upload (default 200).
+- ``WATER_UPLOAD_MAX_VERTICES``: vertices of all features (default 2000000).
+
+:func:`upload_roi` is the ROI upload widget shared by the pages.
+"""
+
+import hashlib
+import os
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import shapely
+import streamlit as st
+from pyogrio import open_arrow
+
+import session_store
+
+MB = 2**20
+MAX_UPLOAD_BYTES = float(os.environ.get("WATER_UPLOAD_MAX_MB", 200)) * MB
+MAX_VERTICES = int(os.environ.get("WATER_UPLOAD_MAX_VERTICES", 2000000))
+BATCH_SIZE = 5000
+
+
+class UploadError(ValueError):
+    """An upload that cannot be read or exceeds a budget."""
+
+
+def read_upload(
+    data,
+    bbox=None,
+    where=None,
+    columns=None,
+    max_bytes=None,
+    max_vertices=None,
+    batch_size=BATCH_SIZE,
+):
+    """Read an uploaded vector file into a GeoDataFrame in Arrow batches.
+
+    Args:
+        data (UploadedFile): The upload, or any file-like object with
+            ``getvalue()``.
+        bbox (tuple): Only read features intersecting (minx, miny, maxx, maxy)
+            in the CRS of the file.
+        where (str): Only read features matching an SQL WHERE clause on their
+            attributes.
+        columns (list): Attributes to read; all of them by default.
+
+    Returns:
+        gpd.GeoDataFrame: The features.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    max_vertices = max_vertices or MAX_VERTICES
+    name = getattr(data, "name", "upload")
+
+    content = data.getvalue()
+    if len(content) > max_bytes:
+        raise UploadError(
+            f"{name} is {len(content) / MB:.0f} MB; uploads are limited to "
+            f"{max_bytes / MB:.0f} MB"
+        )
+
+    frames = []
+    vertices = 0
+    try:
+        with open_arrow(
+            content,
+            bbox=bbox,
+            where=where or None,
+            columns=columns,
+            batch_size=batch_size,
+            use_pyarrow=True,
+        ) as (meta, reader):
+            geometry_name = meta["geometry_name"] or "wkb_geometry"
+            for batch in reader:
+                table = pa.Table.from_batches([batch])
+                geometry = shapely.from_wkb(
+                    table.column(geometry_name).to_numpy(zero_copy_only=False)
+                )
+                vertices += int(shapely.get_num_coordinates(geometry).sum())
+                if vertices > max_vertices:
+                    raise UploadError(
+                        f"{name} has more than {max_vertices:,} vertices; "
+                        "simplify it or filter its features before uploading"
+                    )
+                frames.append(
+                    gpd.GeoDataFrame(
+                        table.drop([geometry_name]).to_pandas(),
+                        geometry=geometry,
+                        crs=meta["crs"],
+                    )
+                )
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f"Could not read {name}: {e}") from e
+
+    if not frames or not sum(len(frame) for frame in frames):
+        if where or bbox:
+            raise UploadError(f"No features of {name} match the filter")
+        raise UploadError(f"{name} contains no features")
+    return pd.concat(frames, ignore_index=True)
+
+
+def upload_digest(upload):
+    """Return the SHA-1 of an upload, hashing its bytes once per uploaded file."""
+    file_id = getattr(upload, "file_id", None) or upload.id
+    cached = st.session_state.get("upload_digest")
+    if cached is None or cached[0] != file_id:
+        cached = (file_id, hashlib.sha1(upload.getvalue()).hexdigest())
+        st.session_state["upload_digest"] = cached
+    return cached[1]
+
+
+def upload_roi(default):
+    """Show the ROI upload widgets and read the uploaded features.
+
+    The features and their ``ee.FeatureCollection`` live in the shared session
+    store under the digest of the upload and filter, not in session state.
+
+    Args:
+        default (ee.FeatureCollection): The ROI used without an upload.
+
+    Returns:
+        tuple: A key identifying the upload and filter, the features and the
+            ROI; the key and features are None without an upload.
+    """
+    import geemap.foliumap as geemap
+
+    with st.expander("Click here to upload an ROI", False):
+        upload = st.file_uploader(
+            "Upload a GeoJSON, KML or Shapefile (as a zif file) to use as an ROI. 😇👇",
+            type=["geojson", "kml", "zip"],
+        )
+
+        where = st.text_input(
+            "Only use the features matching (optional)",
+            placeholder="e.g. AREA > 10 AND TYPE = 'Reservoir'",
+            help="An SQL WHERE clause on the attributes of the upload",
+        )
+
+        if not upload:
+            return None, None, default
+
+        digest = upload_digest(upload)
+        if where:
+            digest = hashlib.sha1(f"{digest}:{where}".encode()).hexdigest()
+        try:
+            gdf = session_store.remember(
+                f"{digest}.gdf", lambda: read_upload(upload, where=where)
+            )
+        except UploadError as e:
+            st.error(e)
+            st.stop()
+        ROI = session_store.remember(
+            f"{digest}.ee", lambda: geemap.gdf_to_ee(gdf, geodesic=False)
+        )
+        return digest, gdf, ROI
@@ -0,0 +1,163 @@
+"""Background jobs for analyses that outlive a Streamlit script run.
+
+A job runs in a process-wide worker pool, so reruns caused by widget
+interactions do not interrupt or repeat it. Jobs are identified by a key
+derived from their parameters: submitting the same analysis again attaches to
+the existing job instead of starting a new one.
+
+Pages keep the job id in ``st.session_state`` and call :meth:`Job.touch`
+while they display it. Jobs nobody has looked at for ``abandon_after``
+seconds are cancelled.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, description=""):
+        self.id = job_id
+        self.description = description
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.touched = time.monotonic()
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def touch(self):
+        """Mark the job as still wanted by a session."""
+        self.touched = time.monotonic()
+
+    def check(self):
+        """Raise JobCancelled inside the job once it was cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def update(self, progress, message=""):
+        """Report progress from inside the job and honour cancellation."""
+        self.check()
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        self.message = message
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED)
+
+    def _finish(self, status):
+        self.status = status
+        self.finished = time.time()
+
+
+class JobManager:
+    """Run jobs in a thread pool and keep their state between reruns."""
+
+    def __init__(self, workers=4, abandon_after=120, keep_for=3600):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self.abandon_after = abandon_after
+        self.keep_for = keep_for
+        self.jobs = {}
+        self.lock = threading.Lock()
+        reaper = threading.Thread(target=self._reap, daemon=True)
+        reaper.start()
+
+    def submit(self, job_id, func, *args, description="", **kwargs):
+        """Start ``func(job, *args, **kwargs)`` unless the job already exists.
+
+        Failed and cancelled jobs are started again.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status not in (FAILED, CANCELLED):
+                job.touch()
+                return job
+
+            job = Job(job_id, description)
+            job.future = self.executor.submit(self._run, job, func, args, kwargs)
+            self.jobs[job_id] = job
+            return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.cancel()
+
+    def _run(self, job, func, args, kwargs):
+        if job._cancel.is_set():
+            job._finish(CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.progress = 1.0
+            job._finish(DONE)
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception as e:
+            job.error = e
+            logger.error("Job %s failed:\n%s", job.id, traceback.format_exc())
+            job._finish(FAILED)
+
+    def _reap(self):
+        while True:
+            time.sleep(min(10, self.abandon_after))
+            now = time.monotonic()
+            with self.lock:
+                jobs = list(self.jobs.values())
+            for job in jobs:
+                if not job.done and now - job.touched > self.abandon_after:
+                    logger.info("Cancelling abandoned job %s", job.id)
+                    job.cancel()
+                elif job.done and time.time() - job.finished > self.keep_for:
+                    with self.lock:
+                        if self.jobs.get(job.id) is job:
+                            del self.jobs[job.id]
+
+
+def job_key(*params):
+    """Derive a stable job id from JSON-serializable parameters."""
+    data = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Return the job manager shared by all sessions of this process."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
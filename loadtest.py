@@ -0,0 +1,457 @@
+"""Load test the pages with many concurrent simulated sessions.
+
+Sessions are driven with Streamlit's ``AppTest`` (Streamlit >= 1.28), which
+runs the page scripts in this process exactly as the server would. Earth
+Engine is replaced by a replay of recorded responses, so runs are offline
+and reproducible:
+
+    # Record the Earth Engine responses of every scenario once (needs EE).
+    python loadtest.py record fixtures/loadtest.json
+
+    # Replay them offline with 50 concurrent sessions.
+    python loadtest.py run fixtures/loadtest.json --sessions 50 --latency 0.3
+
+The report lists throughput, step latency percentiles, CPU time and the
+resident memory held per session.
+"""
+
+import argparse
+import gc
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+
+import session_store
+
+logger = logging.getLogger("loadtest")
+
+
+def page_path(prefix):
+    pages = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+    return glob.glob(os.path.join(pages, f"{prefix}_*.py"))[0]
+
+
+# Each scenario is a page and the widget interactions of one session. A step
+# is (widget type, label, value) and is followed by a rerun; ("run",) only
+# reruns the script and ("wait", key) waits for the background job whose id
+# the page keeps under ``key`` in the session state, then reruns.
+scenarios = {
+    "visualize": (
+        "1",
+        [
+            ("run",),
+            ("checkbox", "Select a country", True),
+            ("selectbox", "Select a country from dropdown list", "Kenya"),
+            ("selectbox", "Select a water dataset", "ESA Global Land Cover 2020"),
+            ("checkbox", "Show water class only", True),
+        ],
+    ),
+    "compare": (
+        "2",
+        [
+            ("run",),
+            ("checkbox", "Select a country", True),
+            ("selectbox", "Select a country from dropdown list", "Kenya"),
+            (
+                "selectbox",
+                "Select a dataset for the right layer",
+                "Dynamic World 2020",
+            ),
+        ],
+    ),
+    "analyze": (
+        "3",
+        [
+            ("run",),
+            ("selectbox", "Select a country from dropdown list", "Kenya"),
+            (
+                "multiselect",
+                "Select datatsets to analyze",
+                [
+                    "JRC Monthly Water History (1984-2020)",
+                    "ESA Global Land Cover 2020",
+                ],
+            ),
+            ("button", "Submit", None),
+            ("wait", "job_id"),
+        ],
+    ),
+    "landcover": (
+        "4",
+        [
+            ("run",),
+            ("selectbox", "Select a legend", "ESA Land Cover"),
+            ("button", "Compute", None),
+        ],
+    ),
+}
+
+
+def request_key(*parts):
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def map_id_key(params):
+    params = dict(params)
+    image = params.pop("image", None)
+    return request_key(image.serialize() if image is not None else None, params)
+
+
+class Recorder:
+    """Record Earth Engine responses while running against the real service."""
+
+    def __init__(self):
+        self.fixture = {"algorithms": None, "compute": {}, "map_ids": {}}
+        self.lock = threading.Lock()
+
+    def install(self):
+        get_algorithms = ee.data.getAlgorithms
+        compute_value = ee.data.computeValue
+        get_map_id = ee.data.getMapId
+
+        def recording_get_algorithms(*args, **kwargs):
+            result = get_algorithms(*args, **kwargs)
+            self.fixture["algorithms"] = result
+            return result
+
+        def recording_compute_value(obj):
+            result = compute_value(obj)
+            with self.lock:
+                self.fixture["compute"][request_key(obj.serialize())] = result
+            return result
+
+        def recording_get_map_id(params):
+            result = get_map_id(params)
+            with self.lock:
+                self.fixture["map_ids"][map_id_key(params)] = {
+                    "mapid": result["mapid"],
+                    "url_format": result["tile_fetcher"].url_format,
+                }
+            return result
+
+        ee.data.getAlgorithms = recording_get_algorithms
+        ee.data.computeValue = recording_compute_value
+        ee.data.getMapId = recording_get_map_id
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.fixture, f)
+
+
+class Replay:
+    """Offline stand-in for Earth Engine answering from recorded responses.
+
+    Every request sleeps for ``latency`` seconds (with +/-50% jitter drawn from
+    a seeded generator) before answering. Requests that were not recorded
+    raise ``ee.EEException``.
+    """
+
+    def __init__(self, path, latency=0.2, seed=0):
+        with open(path) as f:
+            self.fixture = json.load(f)
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"compute": 0, "map_ids": 0, "misses": 0}
+
+    def _wait(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+        time.sleep(delay)
+
+    def _miss(self, what):
+        with self.lock:
+            self.counts["misses"] += 1
+        raise ee.EEException(f"Request not recorded: {what}")
+
+    def install(self):
+        import geemap.common
+        import geemap.foliumap
+
+        def compute_value(obj):
+            self._wait("compute")
+            key = request_key(obj.serialize())
+            if key not in self.fixture["compute"]:
+                self._miss(key)
+            return self.fixture["compute"][key]
+
+        def get_map_id(params):
+            self._wait("map_ids")
+            key = map_id_key(params)
+            if key not in self.fixture["map_ids"]:
+                self._miss(key)
+            item = self.fixture["map_ids"][key]
+            return {
+                "mapid": item["mapid"],
+                "token": "",
+                "tile_fetcher": ee.data.TileFetcher(
+                    item["url_format"], map_name=item["mapid"]
+                ),
+            }
+
+        def noop(*args, **kwargs):
+            pass
+
+        # Initialize the client library from the recorded algorithm list
+        # without credentials or network access.
+        ee.data.initialize = noop
+        ee.data.getAlgorithms = lambda *args, **kwargs: self.fixture["algorithms"]
+        ee.data.computeValue = compute_value
+        ee.data.getMapId = get_map_id
+        ee.Initialize(None)
+
+        geemap.common.ee_initialize = noop
+        geemap.foliumap.ee_initialize = noop
+
+
+def rss_bytes():
+    """Return the resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak RSS is the best approximation without /proc.
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def deep_sizeof(obj):
+    """Approximate the memory referenced by an object, counting each once."""
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, type):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item, 0)
+        stack.extend(gc.get_referents(item))
+    return size
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+    return values[index]
+
+
+def find_widget(at, kind, label):
+    for widget in getattr(at, kind):
+        if widget.label == label:
+            return widget
+    raise LookupError(f"No {kind} labelled {label!r}")
+
+
+def wait_for_job(job_id, timeout):
+    """Wait until a background job started by a session is done."""
+    from jobs import get_manager
+
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_manager().get(job_id)
+        if job is None or job.done:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job_id} did not finish in {timeout} s")
+        job.touch()
+        time.sleep(0.1)
+
+
+def run_session(name, timeout):
+    """Run one scenario and return the AppTest and the timing of each step."""
+    from streamlit.testing.v1 import AppTest
+
+    prefix, steps = scenarios[name]
+    at = AppTest.from_file(page_path(prefix), default_timeout=timeout)
+    timings = []
+    errors = 0
+    for step in steps:
+        started = time.perf_counter()
+        try:
+            if step[0] == "run":
+                at.run()
+            elif step[0] == "wait":
+                wait_for_job(at.session_state[step[1]], timeout)
+                at.run()
+            else:
+                kind, label, value = step
+                widget = find_widget(at, kind, label)
+                if kind == "button":
+                    widget.click()
+                else:
+                    widget.set_value(value)
+                at.run()
+            if at.exception:
+                errors += 1
+                logger.debug("%s: %s", name, at.exception[0].message)
+        except Exception as e:
+            errors += 1
+            logger.debug("%s: %s", name, e)
+        timings.append(time.perf_counter() - started)
+    return at, timings, errors
+
+
+def record(args):
+    os.environ.setdefault("WATER_CACHE_DIR", tempfile.mkdtemp())
+    recorder = Recorder()
+    recorder.install()
+    for name in args.scenarios:
+        logger.info("Recording %s", name)
+        _, _, errors = run_session(name, args.timeout)
+        if errors:
+            logger.warning("%s had %d errors while recording", name, errors)
+    recorder.save(args.fixture)
+    logger.info("Saved %s", args.fixture)
+
+
+def run(args):
+    # A fresh cache directory keeps runs independent of each other.
+    os.environ["WATER_CACHE_DIR"] = tempfile.mkdtemp()
+    replay = Replay(args.fixture, args.latency, args.seed)
+    replay.install()
+
+    names = [args.scenarios[i % len(args.scenarios)] for i in range(args.sessions)]
+    gc.collect()
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(args.sessions) as executor:
+        results = list(executor.map(lambda n: run_session(n, args.timeout), names))
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    gc.collect()
+    rss_after = rss_bytes()
+
+    latencies = {}
+    errors = 0
+    state_sizes = []
+    for name, (at, timings, session_errors) in zip(names, results):
+        latencies.setdefault(name, []).extend(timings)
+        errors += session_errors
+        state = {key: at.session_state[key] for key in at.session_state.filtered_state}
+        state_sizes.append(deep_sizeof(state))
+
+    all_latencies = [t for values in latencies.values() for t in values]
+    report = {
+        "sessions": args.sessions,
+        "steps": len(all_latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_steps_per_second": round(len(all_latencies) / elapsed, 3),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_utilization": round(cpu / elapsed, 3),
+        "rss_before_mb": round(rss_before / 2**20, 1),
+        "rss_after_mb": round(rss_after / 2**20, 1),
+        "rss_per_session_mb": round((rss_after - rss_before) / args.sessions / 2**20, 2),
+        "session_state_mb": round(sum(state_sizes) / len(state_sizes) / 2**20, 3),
+        "ee_requests": dict(replay.counts),
+        "shared_store": {
+            k: v for k, v in session_store.get_store().usage().items() if k != "sessions"
+        },
+        "latency": {},
+    }
+    for name, values in [("all", all_latencies)] + sorted(latencies.items()):
+        report["latency"][name] = {
+            f"p{q}": round(percentile(values, q), 3) for q in (50, 90, 95, 99)
+        }
+        report["latency"][name]["max"] = round(max(values), 3)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+
+    if args.max_p95 is not None and report["latency"]["all"]["p95"] > args.max_p95:
+        logger.error("p95 latency is above %.3fs", args.max_p95)
+        return 1
+    return 1 if errors else 0
+
+
+def print_report(report):
+    print(f"Sessions:          {report['sessions']}")
+    print(f"Steps:             {report['steps']} ({report['errors']} errors)")
+    print(f"Wall time:         {report['seconds']} s")
+    print(f"Throughput:        {report['throughput_steps_per_second']} steps/s")
+    print(
+        f"CPU:               {report['cpu_seconds']} s "
+        f"({report['cpu_utilization']:.0%} of one core)"
+    )
+    print(
+        f"RSS:               {report['rss_before_mb']} -> {report['rss_after_mb']} MB "
+        f"({report['rss_per_session_mb']} MB per session)"
+    )
+    print(f"Session state:     {report['session_state_mb']} MB per session")
+    print(f"EE requests:       {report['ee_requests']}")
+    print(f"Shared store:      {report['shared_store']}")
+    print()
+    print(f"{'Latency (s)':<12}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for name, values in report["latency"].items():
+        print(
+            f"{name:<12}"
+            + "".join(f"{values[k]:>8}" for k in ("p50", "p90", "p95", "p99", "max"))
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record EE responses")
+    record_parser.add_argument("fixture")
+
+    run_parser = subparsers.add_parser("run", help="Replay sessions offline")
+    run_parser.add_argument("fixture")
+    run_parser.add_argument("--sessions", type=int, default=10)
+    run_parser.add_argument(
+        "--latency", type=float, default=0.2, help="Mean EE request latency (s)"
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--json", help="Also write the report to a JSON file")
+    run_parser.add_argument(
+        "--max-p95", type=float, help="Exit with 1 if p95 step latency is higher"
+    )
+
+    for sub in (record_parser, run_parser):
+        sub.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=list(scenarios),
+            default=list(scenarios),
+        )
+        sub.add_argument("--timeout", type=float, default=120)
+        sub.add_argument("-v", "--verbose", action="store_true")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    if args.command == "record":
+        record(args)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,20 @@
+# Imported first so that the profiler can time the other imports.
+import profiler
 import ee
 import geemap.foliumap as geemap
 import geemap.colormaps as cm
-import geopandas as gpd
 import streamlit as st
 
+import ee_client
+import session_store
+from fragments import fragment, outline_layer, show_map
+from ingest import upload_roi
+from spatial_index import get_country_index, outline_geojson
+
 st.set_page_config(layout="wide")
+ee_client.install()
+session_store.touch()
+profiler.start()
 
 # Customize the sidebar
 markdown = """
@@ -31,127 +41,77 @@ st.sidebar.info(
 st.title("Visualizing Global Surface Water Datasets")
 
 
-@st.cache
-def uploaded_file_to_gdf(data):
-    import tempfile
-    import os
-    import uuid
-
-    _, file_extension = os.path.splitext(data.name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
-
-    with open(file_path, "wb") as file:
-        file.write(data.getbuffer())
-
-    if file_path.lower().endswith(".kml"):
-        gpd.io.file.fiona.drvsupport.supported_drivers["KML"] = "rw"
-        gdf = gpd.read_file(file_path, driver="KML")
-    else:
-        gdf = gpd.read_file(file_path)
-
-    return gdf
-
-
-with st.expander("How to use this app"):
-
-    markdown = """
-    This interactive app allows you to explore and compare different datasets of Global Surface Water Extent (GSWE). How to use this web app?    
-    - **Step 1:** Select a basemap from the dropdown menu on the right. The default basemap is `HYBRID`, a Google Satellite basemap with labels.   
-    - **Step 2:** Select a region of interest (ROI) from the country dropdown menu or upload an ROI. The default ROI is the entire globe. 
-    - **Step 3:** Select surface water datasets from the dropdown menu. You can select multiple datasets to display on the map.
-    """
-    st.markdown(markdown)
-
-col1, col2 = st.columns([4, 1])
-
-Map = geemap.Map(Draw_export=True, locate_control=True, plugin_LatLngPopup=True)
-
-roi = ee.FeatureCollection("users/giswqs/public/countries")
-countries = roi.aggregate_array("name").getInfo()
-countries.sort()
-basemaps = list(geemap.basemaps.keys())
-
-with col2:
-
-    with st.expander("Map configuration"):
-        basemap = st.selectbox(
-            "Select a basemap",
-            basemaps,
-            index=basemaps.index("HYBRID"),
-        )
-        Map.add_basemap(basemap)
-
-        latitude = st.number_input("Map center latitude", -90.0, 90.0, 20.0, step=0.5)
-        longitude = st.number_input(
-            "Map center longitude", -180.0, 180.0, 0.0, step=0.5
-        )
-        zoom = st.slider("Map zoom level", 1, 22, 2)
-
-    select = st.checkbox("Select a country")
-    if select:
-        country = st.selectbox(
-            "Select a country from dropdown list",
-            countries,
-            index=countries.index("United States of America"),
-        )
-        st.session_state["ROI"] = roi.filter(ee.Filter.eq("name", country))
-    else:
-
-        with st.expander("Click here to upload an ROI", False):
-            upload = st.file_uploader(
-                "Upload a GeoJSON, KML or Shapefile (as a zif file) to use as an ROI. 😇👇",
-                type=["geojson", "kml", "zip"],
-            )
-
-            if upload:
-                gdf = uploaded_file_to_gdf(upload)
-                st.session_state["ROI"] = geemap.gdf_to_ee(gdf, geodesic=False)
-                # Map.add_gdf(gdf, "ROI")
-            else:
-                st.session_state["ROI"] = roi
-
-    datasets = [
-        "JRC Max Water Extent (1984-2020)",
-        "JRC Water Occurrence (1984-2020)",
-        "Dynamic World 2020",
-        "ESA Global Land Cover 2020",
-        "ESRI Global Land Cover 2020",
-        "OpenStreetMap Water Layer",
-        "Global River Width (GRWL)",
-        "Global floodplains (GFPLAIN250m)",
-        "HydroLAKES",
-    ]
-
-    dataset = st.selectbox("Select a water dataset", datasets)
-
-    with st.expander("Set visualization parameters"):
-        params_input = st.empty()
-        opacity = st.slider("Set layer opacity", 0.0, 1.0, 1.0)
+esri_classes_vis = {
+    "min": 1,
+    "max": 10,
+    "palette": [
+        "#1A5BAB",
+        "#358221",
+        "#A7D282",
+        "#87D19E",
+        "#FFDB5C",
+        "#EECFA8",
+        "#ED022A",
+        "#EDE9E4",
+        "#F2FAFF",
+        "#C8C8C8",
+    ],
+}
 
-    water_only = st.checkbox("Show water class only")
-    split = st.checkbox("Use split-panel map")
-    add_legend = st.checkbox("Add legend", True)
 
+def default_vis(dataset, water_only):
+    """Return the default vis params of a dataset as text, or None if fixed."""
     if dataset == "JRC Max Water Extent (1984-2020)":
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            "{'min': 1, 'max': 1, 'palette': ['0000ff']}",
-        )
+        return "{'min': 1, 'max': 1, 'palette': ['0000ff']}"
+    elif dataset == "JRC Water Occurrence (1984-2020)":
+        return "{'min': 0, 'max': 100, 'palette': ['ffffff', 'ffbbbb', '0000ff']}"
+    elif dataset == "Dynamic World 2020":
+        return "{'min': 1, 'max': 1, 'palette': ['419BDF']}" if water_only else None
+    elif dataset == "ESA Global Land Cover 2020":
+        return "{'min': 1, 'max': 1, 'palette': ['0064c8']}" if water_only else None
+    elif dataset == "ESRI Global Land Cover 2020":
+        if water_only:
+            return str({"min": 1, "max": 1, "palette": ["#1A5BAB"]})
+        return str(esri_classes_vis)
+    elif dataset == "OpenStreetMap Water Layer":
+        vis = {
+            "min": 1,
+            "max": 5,
+            "palette": ["08306b", "08519c", "2171b5", "4292c6", "6baed6"],
+        }
+        return str(vis)
+    elif dataset == "Global River Width (GRWL)":
+        vis = {
+            "min": 255,
+            "max": 255,
+            "palette": [
+                "#0000ff",
+            ],
+        }
+        return str(vis)
+    elif dataset == "Global floodplains (GFPLAIN250m)":
+        vis = {
+            "palette": [
+                "#0000ff",
+            ],
+        }
+        return str(vis)
+    elif dataset == "HydroLAKES":
+        vis = {
+            "color": "#00008B",
+        }
+        return str(vis)
 
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
 
+def add_dataset(Map, dataset, vis_params, ROI, water_only, split, add_legend, opacity):
+    """Add the layer and legend of a water dataset to the map."""
+    if dataset == "JRC Max Water Extent (1984-2020)":
         image = (
             ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("max_extent").selfMask()
         )
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
@@ -164,22 +124,10 @@ with col2:
             Map.add_legend(title="JRC Water", legend_dict=legend_dict)
 
     elif dataset == "JRC Water Occurrence (1984-2020)":
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            "{'min': 0, 'max': 100, 'palette': ['ffffff', 'ffbbbb', '0000ff']}",
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
-
         image = ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("occurrence")
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
@@ -193,8 +141,8 @@ with col2:
         start_date = "2020-01-01"
         end_date = "2021-01-01"
 
-        if st.session_state["ROI"] is not None:
-            region = st.session_state["ROI"]
+        if ROI is not None:
+            region = ROI
         else:
             region = ee.Geometry.BBox(-179, -89, 179, 89)
 
@@ -204,27 +152,14 @@ with col2:
             )
 
             image = image.eq(0).selfMask()
-
-            params = params_input.text_area(
-                "Enter vis params as a dictionary",
-                "{'min': 1, 'max': 1, 'palette': ['419BDF']}",
-            )
-
-            try:
-                vis_params = eval(params)
-            except Exception as e:
-                st.error(e)
-                st.error("Invalid vis params")
-                vis_params = {}
-
         else:
             image = geemap.dynamic_world(
                 region, start_date, end_date, return_type="hillshade"
             )
             vis_params = {}
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
@@ -245,23 +180,11 @@ with col2:
     elif dataset == "ESA Global Land Cover 2020":
         image = ee.ImageCollection("ESA/WorldCover/v100").first()
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if water_only:
             image = image.eq(80).selfMask()
-
-            params = params_input.text_area(
-                "Enter vis params as a dictionary",
-                "{'min': 1, 'max': 1, 'palette': ['0064c8']}",
-            )
-
-            try:
-                vis_params = eval(params)
-            except Exception as e:
-                st.error(e)
-                st.error("Invalid vis params")
-                vis_params = {}
         else:
             vis_params = {
                 "bands": ["Map"],
@@ -286,44 +209,12 @@ with col2:
             "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
         ).mosaic()
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if water_only:
             image = image.eq(1).selfMask()
 
-            esri_vis = {"min": 1, "max": 1, "palette": ["#1A5BAB"]}
-
-        else:
-            esri_vis = {
-                "min": 1,
-                "max": 10,
-                "palette": [
-                    "#1A5BAB",
-                    "#358221",
-                    "#A7D282",
-                    "#87D19E",
-                    "#FFDB5C",
-                    "#EECFA8",
-                    "#ED022A",
-                    "#EDE9E4",
-                    "#F2FAFF",
-                    "#C8C8C8",
-                ],
-            }
-
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            str(esri_vis),
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
-
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
             Map.split_map(layer, layer)
@@ -342,14 +233,8 @@ with col2:
             "projects/sat-io/open-datasets/OSM_waterLayer"
         ).mosaic()
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
-
-        vis = {
-            "min": 1,
-            "max": 5,
-            "palette": ["08306b", "08519c", "2171b5", "4292c6", "6baed6"],
-        }
+        if ROI is not None:
+            image = image.clip(ROI)
 
         legend_dict = {
             "Ocean": "08306b",
@@ -359,18 +244,6 @@ with col2:
             "Small Stream": "6baed6",
         }
 
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            str(vis),
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
-
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
             Map.split_map(layer, layer)
@@ -389,29 +262,9 @@ with col2:
             "projects/sat-io/open-datasets/GRWL/water_vector_v01_01"
         )
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
-            vector = vector.filterBounds(st.session_state["ROI"])
-
-        vis = {
-            "min": 255,
-            "max": 255,
-            "palette": [
-                "#0000ff",
-            ],
-        }
-
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            str(vis),
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
+        if ROI is not None:
+            image = image.clip(ROI)
+            vector = vector.filterBounds(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
@@ -436,26 +289,8 @@ with col2:
     elif dataset == "Global floodplains (GFPLAIN250m)":
         image = ee.ImageCollection("projects/sat-io/open-datasets/GFPLAIN250").mosaic()
 
-        if st.session_state["ROI"] is not None:
-            image = image.clip(st.session_state["ROI"])
-
-        vis = {
-            "palette": [
-                "#0000ff",
-            ],
-        }
-
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            str(vis),
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
+        if ROI is not None:
+            image = image.clip(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(image, vis_params, dataset, True, opacity)
@@ -475,24 +310,8 @@ with col2:
             "projects/sat-io/open-datasets/HydroLakes/lake_poly_v10"
         )
 
-        if st.session_state["ROI"] is not None:
-            vector = vector.filterBounds(st.session_state["ROI"])
-
-        vis = {
-            "color": "#00008B",
-        }
-
-        params = params_input.text_area(
-            "Enter vis params as a dictionary",
-            str(vis),
-        )
-
-        try:
-            vis_params = eval(params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
+        if ROI is not None:
+            vector = vector.filterBounds(ROI)
 
         if split:
             layer = geemap.ee_tile_layer(vector, vis_params, dataset, True, opacity)
@@ -508,6 +327,101 @@ with col2:
             Map.add_legend(title="HydroLAKES", legend_dict=legend_dict)
 
 
+@fragment
+def map_view(
+    basemap, dataset, ROI, water_only, split, add_legend, roi_outline, country, center
+):
+    """Edit the vis params and render the map; edits rerun only this panel."""
+    with st.expander("Set visualization parameters"):
+        default = default_vis(dataset, water_only)
+        vis_params = {}
+        if default is not None:
+            params = st.text_area("Enter vis params as a dictionary", default)
+
+            try:
+                vis_params = eval(params)
+            except Exception as e:
+                st.error(e)
+                st.error("Invalid vis params")
+                vis_params = {}
+        opacity = st.slider("Set layer opacity", 0.0, 1.0, 1.0)
+
+    Map = geemap.Map(Draw_export=True, locate_control=True, plugin_LatLngPopup=True)
+    Map.add_basemap(basemap)
+    add_dataset(Map, dataset, vis_params, ROI, water_only, split, add_legend, opacity)
+
+
+    if country is not None:
+        Map.zoom_to_bounds(country_index.bounds(country))
+    else:
+        Map.set_center(*center)
+
+    show_map(Map, country_index if country else None, country, outline=roi_outline)
+
+
+with st.expander("How to use this app"):
+
+    markdown = """
+    This interactive app allows you to explore and compare different datasets of Global Surface Water Extent (GSWE). How to use this web app?    
+    - **Step 1:** Select a basemap from the dropdown menu on the right. The default basemap is `HYBRID`, a Google Satellite basemap with labels.   
+    - **Step 2:** Select a region of interest (ROI) from the country dropdown menu or upload an ROI. The default ROI is the entire globe. 
+    - **Step 3:** Select surface water datasets from the dropdown menu. You can select multiple datasets to display on the map.
+    """
+    st.markdown(markdown)
+
+col1, col2 = st.columns([4, 1])
+
+roi = ee.FeatureCollection("users/giswqs/public/countries")
+country_index = get_country_index("name")
+countries = country_index.names()
+basemaps = list(geemap.basemaps.keys())
+
+with col2:
+
+    with st.expander("Map configuration"):
+        basemap = st.selectbox(
+            "Select a basemap",
+            basemaps,
+            index=basemaps.index("HYBRID"),
+        )
+
+        latitude = st.number_input("Map center latitude", -90.0, 90.0, 20.0, step=0.5)
+        longitude = st.number_input(
+            "Map center longitude", -180.0, 180.0, 0.0, step=0.5
+        )
+        zoom = st.slider("Map zoom level", 1, 22, 2)
+
+    select = st.checkbox("Select a country")
+    if select:
+        country = st.selectbox(
+            "Select a country from dropdown list",
+            countries,
+            index=countries.index(
+                st.session_state.get("default_country", "United States of America")
+            ),
+        )
+        ROI = roi.filter(ee.Filter.eq("name", country))
+    else:
+        upload, gdf, ROI = upload_roi(roi)
+
+    datasets = [
+        "JRC Max Water Extent (1984-2020)",
+        "JRC Water Occurrence (1984-2020)",
+        "Dynamic World 2020",
+        "ESA Global Land Cover 2020",
+        "ESRI Global Land Cover 2020",
+        "OpenStreetMap Water Layer",
+        "Global River Width (GRWL)",
+        "Global floodplains (GFPLAIN250m)",
+        "HydroLAKES",
+    ]
+
+    dataset = st.selectbox("Select a water dataset", datasets)
+
+    water_only = st.checkbox("Show water class only")
+    split = st.checkbox("Use split-panel map")
+    add_legend = st.checkbox("Add legend", True)
+
 style = {
     "color": "000000ff",
     "width": 1,
@@ -516,30 +430,49 @@ style = {
 }
 
 
-show = False
 if select and country is not None:
     name = country
     style["color"] = "#000000"
     style["width"] = 2
-    show = True
 elif upload:
     name = "ROI"
     style["color"] = "#FFFF00"
     style["width"] = 2
-    show = True
 else:
     name = "World"
 
-Map.addLayer(st.session_state["ROI"].style(**style), {}, name, show)
-Map.centerObject(st.session_state["ROI"])
+outline_style = {
+    "color": "#" + style["color"].lstrip("#")[:6],
+    "weight": style["width"],
+    "fillOpacity": 0,
+}
 
-with col1:
+# ROI outlines are drawn from local GeoJSON simplified for the map zoom
+# instead of an Earth Engine tile layer. The World outline is not drawn.
+if select and country is not None:
+    outline = lambda zoom: outline_layer(
+        country_index.outline(country, zoom), name, outline_style
+    )
+elif upload:
+    outline = lambda zoom: outline_layer(
+        outline_geojson(gdf, zoom=zoom), name, outline_style
+    )
+else:
+    outline = None
 
-    if select:
-        Map.centerObject(st.session_state["ROI"])
-    else:
-        Map.set_center(longitude, latitude, zoom)
-    Map.to_streamlit(height=680)
+with col1:
+    # Editing the vis params or clicking the map only reruns this panel.
+    map_view(
+        basemap,
+        dataset,
+        ROI,
+        water_only,
+        split,
+        add_legend,
+        outline,
+        country if select else None,
+        (longitude, latitude, zoom),
+    )
 
 with col2:
     with st.expander("Data Sources"):
@@ -555,3 +488,5 @@ with col2:
             - [HydroLAKES](https://samapriya.github.io/awesome-gee-community-datasets/projects/hydrolakes/)
         """
         st.markdown(desc)
+
+profiler.panel()
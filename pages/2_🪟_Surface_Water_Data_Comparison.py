@@ -1,11 +1,21 @@
+# Imported first so that the profiler can time the other imports.
+import profiler
 import ee
 import geemap.foliumap as geemap
 import geemap.colormaps as cm
-import geopandas as gpd
 import streamlit as st
 
+import ee_client
+import session_store
+from fragments import fragment, outline_layer, show_map
+from ingest import upload_roi
+from spatial_index import get_country_index, outline_geojson
+
 st.set_page_config(layout="wide")
 geemap.ee_initialize()
+ee_client.install()
+session_store.touch()
+profiler.start()
 
 # Customize the sidebar
 markdown = """
@@ -56,28 +66,6 @@ water_vis = {
 }
 
 
-@st.cache
-def uploaded_file_to_gdf(data):
-    import tempfile
-    import os
-    import uuid
-
-    _, file_extension = os.path.splitext(data.name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
-
-    with open(file_path, "wb") as file:
-        file.write(data.getbuffer())
-
-    if file_path.lower().endswith(".kml"):
-        gpd.io.file.fiona.drvsupport.supported_drivers["KML"] = "rw"
-        gdf = gpd.read_file(file_path, driver="KML")
-    else:
-        gdf = gpd.read_file(file_path)
-
-    return gdf
-
-
 def get_layer(dataset, vis_params, water_only, region=None, opacity=1.0):
 
     if isinstance(vis_params, str):
@@ -195,6 +183,49 @@ def get_layer(dataset, vis_params, water_only, region=None, opacity=1.0):
         return geemap.ee_tile_layer(vector, vis_params, dataset, True, opacity)
 
 
+@fragment
+def map_view(
+    basemap,
+    left_dataset,
+    right_dataset,
+    vis_options,
+    ROI,
+    water_only,
+    roi_outline,
+    country,
+    center,
+):
+    """Edit the vis params and render the map; edits rerun only this panel."""
+    with st.expander("Vis params for the left layer"):
+        left_params = st.text_area(
+            "Enter vis params as a dictionary",
+            vis_options[left_dataset],
+        )
+
+    with st.expander("Vis params for the right layer"):
+
+        right_params = st.text_area(
+            "Enter vis params as a dictionary",
+            vis_options[right_dataset],
+            key="right_vis",
+        )
+
+    Map = geemap.Map(Draw_export=True, locate_control=True, plugin_LatLngPopup=True)
+    Map.add_basemap(basemap)
+
+    left_layer = get_layer(left_dataset, left_params, water_only, ROI)
+    right_layer = get_layer(right_dataset, right_params, water_only, ROI)
+    Map.split_map(left_layer, right_layer)
+
+
+    if country is not None:
+        Map.zoom_to_bounds(country_index.bounds(country))
+    else:
+        Map.set_center(*center)
+
+    show_map(Map, country_index if country else None, country, outline=roi_outline)
+
+
 with st.expander("How to use this app"):
 
     markdown = """
@@ -207,11 +238,9 @@ with st.expander("How to use this app"):
 
 col1, col2 = st.columns([4, 1])
 
-Map = geemap.Map(Draw_export=True, locate_control=True, plugin_LatLngPopup=True)
-
 roi = ee.FeatureCollection("users/giswqs/public/countries")
-countries = roi.aggregate_array("name").getInfo()
-countries.sort()
+country_index = get_country_index("name")
+countries = country_index.names()
 basemaps = list(geemap.basemaps.keys())
 
 with col2:
@@ -223,7 +252,6 @@ with col2:
             basemaps,
             index=basemaps.index("HYBRID"),
         )
-        Map.add_basemap(basemap)
 
         latitude = st.number_input("Map center latitude", -90.0, 90.0, 20.0, step=0.5)
         longitude = st.number_input(
@@ -236,23 +264,13 @@ with col2:
         country = st.selectbox(
             "Select a country from dropdown list",
             countries,
-            index=countries.index("United States of America"),
+            index=countries.index(
+                st.session_state.get("default_country", "United States of America")
+            ),
         )
-        st.session_state["ROI"] = roi.filter(ee.Filter.eq("name", country))
+        ROI = roi.filter(ee.Filter.eq("name", country))
     else:
-
-        with st.expander("Click here to upload an ROI", False):
-            upload = st.file_uploader(
-                "Upload a GeoJSON, KML or Shapefile (as a zif file) to use as an ROI. 😇👇",
-                type=["geojson", "kml", "zip"],
-            )
-
-            if upload:
-                gdf = uploaded_file_to_gdf(upload)
-                st.session_state["ROI"] = geemap.gdf_to_ee(gdf, geodesic=False)
-                # Map.add_gdf(gdf, "ROI")
-            else:
-                st.session_state["ROI"] = roi
+        upload, gdf, ROI = upload_roi(roi)
 
     datasets = [
         "JRC Max Water Extent (1984-2020)",
@@ -276,34 +294,10 @@ with col2:
 
     left_dataset = st.selectbox("Select a dataset for the left layer", datasets)
 
-    with st.expander("Vis params for the left layer"):
-        left_params = st.text_area(
-            "Enter vis params as a dictionary",
-            vis_options[left_dataset],
-        )
-
     right_dataset = st.selectbox(
         "Select a dataset for the right layer", datasets, index=1, key="left_vis"
     )
 
-    with st.expander("Vis params for the right layer"):
-
-        right_params = st.text_area(
-            "Enter vis params as a dictionary",
-            vis_options[right_dataset],
-            key="right_vis",
-        )
-
-    left_layer = get_layer(
-        left_dataset, left_params, water_only, st.session_state["ROI"]
-    )
-
-    right_layer = get_layer(
-        right_dataset, right_params, water_only, st.session_state["ROI"]
-    )
-
-    Map.split_map(left_layer, right_layer)
-
 style = {
     "color": "000000ff",
     "width": 1,
@@ -312,30 +306,49 @@ style = {
 }
 
 
-show = False
 if select and country is not None:
     name = country
     style["color"] = "#000000"
     style["width"] = 2
-    show = True
 elif upload:
     name = "ROI"
     style["color"] = "#FFFF00"
     style["width"] = 2
-    show = True
 else:
     name = "World"
 
-Map.addLayer(st.session_state["ROI"].style(**style), {}, name, show)
-Map.centerObject(st.session_state["ROI"])
+outline_style = {
+    "color": "#" + style["color"].lstrip("#")[:6],
+    "weight": style["width"],
+    "fillOpacity": 0,
+}
 
-with col1:
+# ROI outlines are drawn from local GeoJSON simplified for the map zoom
+# instead of an Earth Engine tile layer. The World outline is not drawn.
+if select and country is not None:
+    outline = lambda zoom: outline_layer(
+        country_index.outline(country, zoom), name, outline_style
+    )
+elif upload:
+    outline = lambda zoom: outline_layer(
+        outline_geojson(gdf, zoom=zoom), name, outline_style
+    )
+else:
+    outline = None
 
-    if select:
-        Map.centerObject(st.session_state["ROI"])
-    else:
-        Map.set_center(longitude, latitude, zoom)
-    Map.to_streamlit(height=680)
+with col1:
+    # Editing the vis params or clicking the map only reruns this panel.
+    map_view(
+        basemap,
+        left_dataset,
+        right_dataset,
+        vis_options,
+        ROI,
+        water_only,
+        outline,
+        country if select else None,
+        (longitude, latitude, zoom),
+    )
 
 with col2:
     with st.expander("Data Sources"):
@@ -351,3 +364,5 @@ with col2:
             - [HydroLAKES](https://samapriya.github.io/awesome-gee-community-datasets/projects/hydrolakes/)
         """
         st.markdown(desc)
+
+profiler.panel()
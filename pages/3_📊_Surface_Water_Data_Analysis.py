@@ -1,14 +1,44 @@
+# Imported first so that the profiler can time the other imports.
+import profiler
 import ee
 import geemap.foliumap as geemap
 import geemap.colormaps as cm
-import geopandas as gpd
 import streamlit as st
 import plotly.express as px
-import pandas as pd
 import leafmap
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ee_client
+import session_store
+from analysis import (
+    FEATURE_ID,
+    WORLD_BOUNDS,
+    agreement_area,
+    area_by_group,
+    dataset_image,
+    feature_statistics,
+    monthly_water_area,
+    monthly_water_images,
+    occurrence_histogram,
+    water_agreement,
+    water_change_by_feature,
+    yearly_water_area,
+)
+from fragments import job_panel, map_panel, outline_layer
+from ingest import upload_roi
+from jobs import get_manager, job_key
+from pyramid import get_pyramid
+from raster_export import export_image
+from spatial_index import CACHE_DIR, gdf_bounds, get_country_index, outline_geojson
+from timelapse import timelapse
+from trends import seasonal_table, trend_table
 
 st.set_page_config(layout="wide")
 geemap.ee_initialize()
+ee_client.install()
+session_store.touch()
+profiler.start()
 
 # Customize the sidebar
 markdown = """
@@ -61,155 +91,250 @@ water_vis = {
 }
 
 
-# @st.cache
-def uploaded_file_to_gdf(data):
-    import tempfile
-    import os
-    import uuid
-
-    _, file_extension = os.path.splitext(data.name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
-
-    with open(file_path, "wb") as file:
-        file.write(data.getbuffer())
-
-    if file_path.lower().endswith(".kml"):
-        gpd.io.file.fiona.drvsupport.supported_drivers["KML"] = "rw"
-        gdf = gpd.read_file(file_path, driver="KML")
-    else:
-        gdf = gpd.read_file(file_path)
-
-    return gdf
-
-
-def get_layer(dataset, vis_params, water_only, region=None, opacity=1.0):
-
-    if isinstance(vis_params, str):
-        try:
-            vis_params = eval(vis_params)
-        except Exception as e:
-            st.error(e)
-            st.error("Invalid vis params")
-            vis_params = {}
-    elif isinstance(vis_params, dict):
-        pass
-    else:
-        st.error("Invalid vis params")
-        vis_params = {}
-
-    if dataset == "JRC Max Water Extent (1984-2020)":
+def get_layer(dataset, water_only, region=None):
+    """Return the image of a dataset; the caller styles it with its vis params."""
+    return dataset_image(dataset, water_only, region)
+
+
+def run_analysis(
+    job,
+    region,
+    bounds,
+    datasets,
+    agreement,
+    water_only,
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    reducer,
+    scale,
+    bin_width,
+    tolerance,
+):
+    """Compute the statistics of the selected datasets as a background job.
+
+    Results come from the statistics pyramid when one computed at a nearby
+    scale is within the tolerance. Large reductions run as batch exports,
+    which report their state and stop when the job is cancelled.
+    """
+    pyramid = get_pyramid()
+    region_key = region.serialize()
 
-        image = (
-            ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("max_extent").selfMask()
+    def exporting(fraction, name):
+        return lambda status: job.update(
+            fraction, f"Exporting {name} ({status['state'].lower()})..."
         )
 
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-    elif dataset == "JRC Water Occurrence (1984-2020)":
-        image = ee.Image("JRC/GSW1_3/GlobalSurfaceWater").select("occurrence")
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "JRC Monthly Water History (1984-2020)":
-        image = (
-            ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
-            .map(lambda img: img.eq(2).selfMask())
-            .max()
-            .selfMask()
+    if agreement:
+        job.update(0, "Computing dataset agreement...")
+        window = (start_date, end_date, start_month, end_month)
+        image, used = water_agreement(datasets, region, window)
+        df, used_scale, scale_error = pyramid.get(
+            job_key(region_key, "agreement", used, window),
+            scale,
+            lambda s: agreement_area(
+                image, region, s, bounds=bounds, poll=exporting(0, "agreement")
+            ),
+            lambda df: df["Area (ha)"].sum(),
+            tolerance,
         )
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "Dynamic World 2020":
-        start_date = "2020-01-01"
-        end_date = "2021-01-01"
-        if water_only:
-            image = geemap.dynamic_world(
-                region, start_date, end_date, return_type="class"
+        return [
+            {
+                "dataset": "Dataset agreement",
+                "datasets": used,
+                "df": df,
+                "scale": used_scale,
+                "scale_error": scale_error,
+            }
+        ]
+
+    results = []
+    for index, dataset in enumerate(datasets):
+        job.update(index / len(datasets), f"Computing {dataset}...")
+        poll = exporting(index / len(datasets), dataset)
+        if dataset == "JRC Monthly Water History (1984-2020)":
+            df, used_scale, scale_error = pyramid.get(
+                job_key(
+                    region_key, dataset, start_date, end_date, start_month, end_month
+                ),
+                scale,
+                lambda s: monthly_water_area(
+                    region,
+                    start_date,
+                    end_date,
+                    start_month,
+                    end_month,
+                    s,
+                    bounds=bounds,
+                    poll=poll,
+                ),
+                lambda df: df["Area (ha)"].sum(),
+                tolerance,
             )
-
-            image = image.eq(0).selfMask()
-        else:
-            image = geemap.dynamic_world(
-                region, start_date, end_date, return_type="hillshade"
+            df2 = yearly_water_area(df, reducer)
+            item = {"dataset": dataset, "df": df, "df2": df2}
+        elif dataset == "JRC Water Occurrence (1984-2020)":
+            df, used_scale, scale_error = pyramid.get(
+                job_key(region_key, dataset, bin_width),
+                scale,
+                lambda s: occurrence_histogram(
+                    region, s, bin_width, bounds=bounds, poll=poll
+                ),
+                lambda df: df["area"].sum(),
+                tolerance,
             )
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "ESA Global Land Cover 2020":
-        image = ee.ImageCollection("ESA/WorldCover/v100").first()
-
-        if water_only:
-            image = image.eq(80).selfMask()
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "ESRI Global Land Cover 2020":
-
-        image = ee.ImageCollection(
-            "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
-        ).mosaic()
-
-        if water_only:
-            image = image.eq(1).selfMask()
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "OpenStreetMap Water Layer":
-        image = ee.ImageCollection(
-            "projects/sat-io/open-datasets/OSM_waterLayer"
-        ).mosaic()
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "Global River Width (GRWL)":
-
-        image = ee.ImageCollection(
-            "projects/sat-io/open-datasets/GRWL/water_mask_v01_01"
-        ).mosaic()
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "Global floodplains (GFPLAIN250m)":
-        image = ee.ImageCollection("projects/sat-io/open-datasets/GFPLAIN250").mosaic()
-
-        if region is not None:
-            image = image.clip(region)
-
-        return image
-
-    elif dataset == "HydroLAKES":
-        vector = ee.FeatureCollection(
-            "projects/sat-io/open-datasets/HydroLakes/lake_poly_v10"
+            item = {"dataset": dataset, "df": df}
+        else:
+            try:
+                df, used_scale, scale_error = pyramid.get(
+                    job_key(region_key, dataset, water_only),
+                    scale,
+                    lambda s: area_by_group(
+                        dataset, region, s, water_only, bounds=bounds, poll=poll
+                    ),
+                    lambda df: df["area"].sum(),
+                    tolerance,
+                )
+            except ValueError as e:
+                results.append({"dataset": dataset, "error": str(e)})
+                continue
+            item = {"dataset": dataset, "df": df}
+        item.update({"scale": used_scale, "scale_error": scale_error})
+        results.append(item)
+    return results
+
+
+def run_trends(
+    job,
+    names,
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    reducer,
+    scale,
+    tolerance,
+):
+    """Compute the monthly series of many countries and their trends.
+
+    The series share the statistics pyramid with ``run_analysis``, so
+    countries analyzed before cost no requests.
+    """
+    pyramid = get_pyramid()
+    dataset = "JRC Monthly Water History (1984-2020)"
+    countries = ee.FeatureCollection("users/giswqs/public/countries")
+
+    def series(name):
+        region = countries.filter(ee.Filter.eq("NAME", name))
+        df, _, _ = pyramid.get(
+            job_key(
+                region.serialize(),
+                dataset,
+                start_date,
+                end_date,
+                start_month,
+                end_month,
+            ),
+            scale,
+            lambda s: monthly_water_area(
+                region,
+                start_date,
+                end_date,
+                start_month,
+                end_month,
+                s,
+                bounds=country_index.bounds(name),
+                poll=lambda status: job.check(),
+            ),
+            lambda df: df["Area (ha)"].sum(),
+            tolerance,
         )
+        return df
 
-        if region is not None:
-            vector = vector.filterBounds(region)
-
-        return vector
+    results = {}
+    job.update(0, f"Computing the series of {len(names)} countries...")
+    with ThreadPoolExecutor(8) as executor:
+        futures = {executor.submit(series, name): name for name in names}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                job.update(
+                    len(results) / len(names),
+                    f"Computed {len(results)} of {len(names)} countries",
+                )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    series_by_name = {name: results[name] for name in names}
+    climatology, anomalies = seasonal_table(series_by_name)
+    return {
+        "trends": trend_table(series_by_name, reducer),
+        "climatology": climatology,
+        "anomalies": anomalies,
+    }
+
+
+def run_features(job, gdf, start_date, end_date, start_month, end_month, scale):
+    """Compute the statistics of every feature of an uploaded ROI."""
+    job.update(0, f"Computing the statistics of {len(gdf)} features...")
+    return feature_statistics(
+        gdf,
+        start_date,
+        end_date,
+        start_month,
+        end_month,
+        scale,
+        progress=lambda fraction: job.update(fraction, "Computing features..."),
+    )
+
+
+def run_download(job, image, bounds, scale, path):
+    """Download a clipped layer as a Cloud Optimized GeoTIFF."""
+    job.update(0, "Downloading tiles...")
+    return export_image(
+        image,
+        bounds,
+        scale,
+        path,
+        progress=lambda fraction: job.update(fraction, "Downloading tiles..."),
+    )
+
+
+def run_timelapse(
+    job, region, start_date, end_date, start_month, end_month, fps, format, path
+):
+    """Create a timelapse of the JRC monthly water history."""
+    job.update(0, "Fetching frames...")
+    return timelapse(
+        region,
+        start_date,
+        end_date,
+        start_month,
+        end_month,
+        path,
+        fps=fps,
+        format=format,
+        progress=lambda fraction: job.update(fraction, "Fetching frames..."),
+    )
+
+
+def run_change(job, names, period1, period2, scale, tolerance):
+    """Compute the water change of every country in chunked reduceRegions calls."""
+    job.update(0, f"Computing the water change of {len(names)} countries...")
+    countries = ee.FeatureCollection("users/giswqs/public/countries")
+    df, _, _ = get_pyramid().get(
+        job_key("change", names, period1, period2),
+        scale,
+        lambda s: water_change_by_feature(
+            countries, "NAME", names, period1, period2, s
+        ),
+        lambda df: df.iloc[:, 1].sum(),
+        tolerance,
+    )
+    return df
 
 
 with st.expander("How to use this app"):
@@ -227,8 +352,8 @@ col1, col2 = st.columns([3.2, 1])
 Map = geemap.Map(Draw_export=True, locate_control=True, plugin_LatLngPopup=True)
 
 roi = ee.FeatureCollection("users/giswqs/public/countries")
-countries = roi.aggregate_array("NAME").getInfo()
-countries.sort()
+country_index = get_country_index("NAME")
+countries = country_index.names()
 basemaps = list(geemap.basemaps.keys())
 
 with col2:
@@ -253,23 +378,13 @@ with col2:
         country = st.selectbox(
             "Select a country from dropdown list",
             countries,
-            index=countries.index("United States of America"),
+            index=countries.index(
+                st.session_state.get("default_country", "United States of America")
+            ),
         )
-        st.session_state["ROI"] = roi.filter(ee.Filter.eq("NAME", country))
+        ROI = roi.filter(ee.Filter.eq("NAME", country))
     else:
-
-        with st.expander("Click here to upload an ROI", False):
-            upload = st.file_uploader(
-                "Upload a GeoJSON, KML or Shapefile (as a zif file) to use as an ROI. 😇👇",
-                type=["geojson", "kml", "zip"],
-            )
-
-            if upload:
-                gdf = uploaded_file_to_gdf(upload)
-                st.session_state["ROI"] = geemap.gdf_to_ee(gdf, geodesic=False)
-                # Map.add_gdf(gdf, "ROI")
-            else:
-                st.session_state["ROI"] = roi
+        upload, gdf, ROI = upload_roi(roi)
 
     options = [
         "JRC Max Water Extent (1984-2020)",
@@ -293,6 +408,17 @@ with col2:
             index=1,
         )
         scale = st.slider("Select a scale for computing", 10, 10000, 1000)
+        bin_width = st.slider("Select a bin width for water occurrence (%)", 1, 20, 5)
+        tolerance = (
+            st.slider(
+                "Tolerance for reusing results computed at other scales (%)",
+                0.0,
+                10.0,
+                2.0,
+                step=0.5,
+            )
+            / 100
+        )
 
         start_year = years[0]
         end_year = years[1]
@@ -316,9 +442,54 @@ with col2:
             options,
             default="JRC Monthly Water History (1984-2020)",
         )
+        agreement = st.checkbox(
+            "Show agreement among the selected datasets",
+            help="Count how many selected datasets classify each pixel as water",
+        )
+        per_feature = False
+        if not select and upload and len(gdf) > 1:
+            per_feature = st.checkbox(
+                f"Compute water statistics for each of the {len(gdf)} features",
+                help="JRC maximum water extent and monthly water area per feature",
+            )
 
         submitted = st.form_submit_button("Submit")
 
+    with st.expander("Compare water trends across countries"):
+        with st.form("trends"):
+            all_countries = st.checkbox("Rank all countries")
+            trend_countries = st.multiselect(
+                "Select countries to compare",
+                countries,
+                default=[country] if select else [],
+            )
+            trends_submitted = st.form_submit_button("Compare")
+        if all_countries:
+            trend_countries = countries
+
+    with st.expander("Download clipped layers"):
+        with st.form("download"):
+            download_dataset = st.selectbox(
+                "Select a dataset to download",
+                [option for option in options if option != "HydroLAKES"],
+            )
+            download_scale = st.slider("Select a pixel size (m)", 10, 5000, 250)
+            download_submitted = st.form_submit_button("Prepare GeoTIFF")
+
+    with st.expander("Create a timelapse of the monthly water history"):
+        with st.form("timelapse"):
+            st.caption("Uses the year and month ranges of the filter params.")
+            timelapse_format = st.radio("Format", ["gif", "mp4"], horizontal=True)
+            fps = st.slider("Frames per second", 1, 30, 5)
+            timelapse_submitted = st.form_submit_button("Create timelapse")
+
+    with st.expander("Rank all countries by water change"):
+        with st.form("change"):
+            period1 = st.slider("First period", 1984, 2021, (1984, 1999))
+            period2 = st.slider("Second period", 1984, 2021, (2000, 2021))
+            change_scale = st.slider("Scale for computing (m)", 1000, 10000, 5000)
+            change_submitted = st.form_submit_button("Rank")
+
     # left_dataset = st.selectbox("Select a dataset for the left layer", datasets)
 
     # with st.expander("Vis params for the left layer"):
@@ -339,13 +510,9 @@ with col2:
     #         key="right_vis",
     #     )
 
-    # left_layer = get_layer(
-    #     left_dataset, left_params, water_only, st.session_state["ROI"]
-    # )
+    # left_layer = get_layer(left_dataset, water_only, ROI)
 
-    # right_layer = get_layer(
-    #     right_dataset, right_params, water_only, st.session_state["ROI"]
-    # )
+    # right_layer = get_layer(right_dataset, water_only, ROI)
 
     # Map.split_map(left_layer, right_layer)
 
@@ -357,52 +524,250 @@ style = {
 }
 
 
-show = False
 if select and country is not None:
     name = country
     style["color"] = "#FFFF00"
     style["width"] = 2
-    show = True
 elif upload:
     name = "ROI"
     style["color"] = "#FFFF00"
     style["width"] = 2
-    show = True
 else:
     name = "World"
 
-Map.addLayer(st.session_state["ROI"].style(**style), {}, name, show)
-Map.centerObject(st.session_state["ROI"])
+outline_style = {
+    "color": "#" + style["color"].lstrip("#")[:6],
+    "weight": style["width"],
+    "fillOpacity": 0,
+}
+
+# ROI outlines are drawn from local GeoJSON simplified for the map zoom
+# instead of an Earth Engine tile layer. The World outline is not drawn.
+if select and country is not None:
+    outline = lambda zoom: outline_layer(
+        country_index.outline(country, zoom), name, outline_style
+    )
+elif upload:
+    outline = lambda zoom: outline_layer(
+        outline_geojson(gdf, zoom=zoom), name, outline_style
+    )
+else:
+    outline = None
+
+if select:
+    roi_bounds = country_index.bounds(country)
+elif upload:
+    roi_bounds = gdf_bounds(gdf)
+else:
+    roi_bounds = None
+
+jobs = get_manager()
+analysis_key = job_key(
+    ROI.serialize(),
+    datasets,
+    agreement,
+    water_only,
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    reducer,
+    scale,
+    bin_width,
+    tolerance,
+)
+if submitted:
+    jobs.submit(
+        analysis_key,
+        run_analysis,
+        ROI,
+        roi_bounds or WORLD_BOUNDS,
+        datasets,
+        agreement,
+        water_only,
+        start_date,
+        end_date,
+        start_month,
+        end_month,
+        reducer,
+        scale,
+        bin_width,
+        tolerance,
+        description=", ".join(datasets),
+    )
+    st.session_state["job_id"] = analysis_key
+job_attached = st.session_state.get("job_id") == analysis_key
+
+if per_feature:
+    features_key = job_key(
+        "features", upload, start_date, end_date, start_month, end_month, scale
+    )
+    if submitted:
+        jobs.submit(
+            features_key,
+            run_features,
+            gdf,
+            start_date,
+            end_date,
+            start_month,
+            end_month,
+            scale,
+            description=f"Statistics of {len(gdf)} features",
+        )
+        st.session_state["features_job_id"] = features_key
+else:
+    features_key = None
+
+trends_key = job_key(
+    "trends",
+    sorted(trend_countries),
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    reducer,
+    scale,
+    tolerance,
+)
+if trends_submitted and trend_countries:
+    jobs.submit(
+        trends_key,
+        run_trends,
+        list(trend_countries),
+        start_date,
+        end_date,
+        start_month,
+        end_month,
+        reducer,
+        scale,
+        tolerance,
+        description=f"Trends of {len(trend_countries)} countries",
+    )
+    st.session_state["trends_job_id"] = trends_key
+
+download_key = job_key(
+    "download",
+    ROI.serialize(),
+    download_dataset,
+    water_only,
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    download_scale,
+)
+if download_submitted:
+    if roi_bounds is None:
+        st.error("Select a country or upload an ROI to download a layer.")
+    else:
+        if download_dataset == "JRC Monthly Water History (1984-2020)":
+            download_image = (
+                monthly_water_images(start_date, end_date, start_month, end_month)
+                .max()
+                .clip(ROI)
+            )
+        else:
+            download_image = dataset_image(download_dataset, water_only, ROI)
+        download_dir = os.path.join(CACHE_DIR, "downloads")
+        os.makedirs(download_dir, exist_ok=True)
+        jobs.submit(
+            download_key,
+            run_download,
+            download_image,
+            roi_bounds,
+            download_scale,
+            os.path.join(download_dir, f"{download_key}.tif"),
+            description=f"Download of {download_dataset}",
+        )
+        st.session_state["download_job_id"] = download_key
+
+timelapse_key = job_key(
+    "timelapse",
+    ROI.serialize(),
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    fps,
+    timelapse_format,
+)
+if timelapse_submitted:
+    timelapse_dir = os.path.join(CACHE_DIR, "timelapse")
+    os.makedirs(timelapse_dir, exist_ok=True)
+    jobs.submit(
+        timelapse_key,
+        run_timelapse,
+        ROI,
+        start_date,
+        end_date,
+        start_month,
+        end_month,
+        fps,
+        timelapse_format,
+        os.path.join(timelapse_dir, f"{timelapse_key}.{timelapse_format}"),
+        description="Timelapse",
+    )
+    st.session_state["timelapse_job_id"] = timelapse_key
+
+change_key = job_key("change", period1, period2, change_scale, tolerance)
+if change_submitted:
+    jobs.submit(
+        change_key,
+        run_change,
+        countries,
+        period1,
+        period2,
+        change_scale,
+        tolerance,
+        description="Water change of all countries",
+    )
+    st.session_state["change_job_id"] = change_key
 
 with col1:
 
-    if select or upload:
-        Map.centerObject(st.session_state["ROI"])
+    if select:
+        Map.zoom_to_bounds(country_index.bounds(country))
+    elif upload:
+        Map.zoom_to_bounds(gdf_bounds(gdf))
     else:
         Map.set_center(longitude, latitude, zoom)
 
-    if submitted:
+    if job_attached and agreement:
+        try:
+            agreement_image, agreement_datasets = water_agreement(
+                datasets, ROI, (start_date, end_date, start_month, end_month)
+            )
+        except ValueError as e:
+            st.error(e)
+            st.stop()
+        agreement_vis = {
+            "min": 1,
+            "max": max(len(agreement_datasets), 2),
+            "palette": ["fff5eb", "6baed6", "08306b"],
+        }
+        Map.addLayer(agreement_image, agreement_vis, "Dataset agreement")
+        Map.add_colorbar(agreement_vis, label="Number of datasets agreeing")
+    elif job_attached:
         for dataset in datasets:
 
             vis_params = eval(vis_options[dataset])
             if dataset != "JRC Monthly Water History (1984-2020)":
 
-                layer = get_layer(
-                    dataset, vis_params, water_only, st.session_state["ROI"]
-                )
+                layer = get_layer(dataset, water_only, ROI)
             else:
-                layer = (
-                    ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
-                    .filterDate(start_date, end_date)
-                    .filter(ee.Filter.calendarRange(start_month, end_month, "month"))
-                    .map(lambda img: img.eq(2).selfMask())
-                    .max()
-                )
-                if st.session_state["ROI"] is not None:
-                    layer = layer.clip(st.session_state["ROI"])
+                layer = monthly_water_images(
+                    start_date, end_date, start_month, end_month
+                ).max()
+                if ROI is not None:
+                    layer = layer.clip(ROI)
             Map.addLayer(layer, vis_params, dataset)
 
-    Map.to_streamlit(height=680)
+    map_panel(
+        Map,
+        country_index if select else None,
+        country if select else None,
+        outline=outline,
+    )
 
 with col2:
     with st.expander("Data Sources"):
@@ -422,121 +787,209 @@ with col2:
         # empty = st.empty()
         # empty.text("Computing...")
 
-if submitted:
 
-    # with col2:
-    #     empty.text("Computing...")
-
-    for dataset in datasets:
-        # vis_params = eval(vis_options[dataset])
-        # layer = get_layer(dataset, vis_params, water_only, st.session_state["ROI"])
-        # Map.addLayer(layer, vis_params, dataset)
-
-        # if select or upload:
-        with col2:
-            region = st.session_state["ROI"]
-            empty = st.empty()
-            empty.text("Computing...")
-
-            if dataset == "JRC Monthly Water History (1984-2020)":
-                images = (
-                    ee.ImageCollection("JRC/GSW1_3/MonthlyHistory")
-                    .filterDate(start_date, end_date)
-                    .filter(ee.Filter.calendarRange(start_month, end_month, "month"))
-                    .map(lambda img: img.eq(2).selfMask())
-                )
+def show_analysis(result):
+    for item in result:
+        dataset = item["dataset"]
+        if item.get("scale", scale) != scale:
+            st.caption(
+                f"{dataset}: answered from the result at {item['scale']} m "
+                f"(estimated difference {item['scale_error']:.1%})"
+            )
+        if "error" in item:
+            st.write(dataset)
+            st.error(item["error"])
+        elif dataset == "Dataset agreement":
+            df = item["df"]
+            fig = px.bar(df, x="Datasets agreeing", y="Area (ha)")
+            st.plotly_chart(fig)
+
+            with st.expander("Statistics"):
+                st.write(", ".join(item["datasets"]))
+                st.write(df)
+                leafmap.st_download_button("Download data", df)
+        elif dataset == "JRC Monthly Water History (1984-2020)":
+            df, df2 = item["df"], item["df2"]
+            # fig = px.scatter(result, x="Year", y="Area (ha)", trendline="ols")
+            fig = px.bar(df2, x="Year", y="Area (ha)")
+            st.plotly_chart(fig)
+
+            with st.expander("Statistics"):
+                st.write(df)
+                leafmap.st_download_button("Download data", df)
+                st.write(df2)
+                leafmap.st_download_button("Download data", df2)
+        elif dataset == "JRC Water Occurrence (1984-2020)":
+            df = item["df"].reset_index()
+            fig = px.line(
+                df,
+                y="cum_pct",
+                x="group",
+                labels={
+                    "group": "Occurrence (%)",
+                    "cum_pct": "Cumulative percentage (%)",
+                },
+            )
+            st.write(dataset)
+            st.plotly_chart(fig)
 
-                def cal_area(img):
-                    pixel_area = img.multiply(ee.Image.pixelArea()).divide(1e4)
-                    img_area = pixel_area.reduceRegion(
-                        **{
-                            "geometry": region,
-                            "reducer": ee.Reducer.sum(),
-                            "scale": scale,
-                            "maxPixels": 1e12,
-                            "bestEffort": True,
-                        }
-                    )
-                    return img.set({"area": img_area})
-
-                areas = images.map(cal_area)
-                stats = areas.aggregate_array("area").getInfo()
-                values = [item["water"] for item in stats]
-                labels = areas.aggregate_array("system:index").getInfo()
-                dates = [d[:4] for d in labels]
-                data_dict = {"Date": labels, "Year": dates, "Area (ha)": values}
-                df = pd.DataFrame(data_dict)
-                result = df.groupby("Year").agg(reducer)
-                df2 = pd.DataFrame(
-                    {"Year": result.index, "Area (ha)": result["Area (ha)"]}
-                )
-                df2 = df2.reset_index(drop=True)
-
-                # fig = px.scatter(result, x="Year", y="Area (ha)", trendline="ols")
-                fig = px.bar(df2, x="Year", y="Area (ha)")
-                # with col2:
-                empty.plotly_chart(fig)
-
-                with st.expander("Statistics"):
-                    st.write(df)
-                    leafmap.st_download_button("Download data", df)
-                    st.write(df2)
-                    leafmap.st_download_button("Download data", df2)
-            else:
-                vis_params = eval(vis_options[dataset])
-                layer = get_layer(
-                    dataset, vis_params, water_only, st.session_state["ROI"]
-                )
-                Map.addLayer(layer, vis_params, dataset)
-
-                # if dataset == "JRC Max Water Extent (1984-2020)":
-                df = geemap.image_area_by_group(
-                    layer,
-                    region=region,
-                    scale=scale,
-                    denominator=1e4,
-                    decimal_places=2,
-                    verbose=True,
-                )
-                empty.text("")
-                st.write(dataset)
+            with st.expander("Statistics"):
                 st.write(df)
+                leafmap.st_download_button("Download data", df)
+        else:
+            st.write(dataset)
+            st.write(item["df"])
+
+
+def show_download(path):
+    if os.path.exists(path):
+        file_name = download_dataset.split(" (")[0].replace(" ", "_") + ".tif"
+        with open(path, "rb") as f:
+            st.download_button(
+                f"Download {download_dataset} (GeoTIFF)",
+                f,
+                file_name=file_name,
+                mime="image/tiff",
+            )
+
+
+def show_timelapse(path):
+    if os.path.exists(path):
+        if timelapse_format == "mp4":
+            st.video(path)
+        else:
+            st.image(path)
+        with open(path, "rb") as f:
+            st.download_button(
+                "Download timelapse",
+                f,
+                file_name=f"timelapse.{timelapse_format}",
+                mime="video/mp4" if timelapse_format == "mp4" else "image/gif",
+            )
+
+
+def show_features(result):
+    summary, series = result
+    st.dataframe(summary)
+    leafmap.st_download_button("Download feature statistics", summary)
+
+    yearly = series.groupby([FEATURE_ID, "Year"], as_index=False)["Area (ha)"].agg(
+        reducer
+    )
+    fig = px.line(
+        yearly,
+        x="Year",
+        y="Area (ha)",
+        color=FEATURE_ID,
+        labels={FEATURE_ID: "Feature"},
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    with st.expander("Monthly series of each feature"):
+        st.write(series)
+        leafmap.st_download_button("Download monthly series", series)
+
+
+def show_trends(result):
+    df = result["trends"]
+    st.dataframe(df)
+    leafmap.st_download_button("Download trends", df)
+
+    shown = st.multiselect(
+        "Show the seasonality of",
+        list(df["ROI"]),
+        default=list(df["ROI"][:3]),
+    )
+    climatology = result["climatology"]
+    anomalies = result["anomalies"]
+    col3, col4 = st.columns(2)
+    with col3:
+        fig = px.line(
+            climatology[climatology["ROI"].isin(shown)],
+            x="Month",
+            y="Area (ha)",
+            color="ROI",
+            title="Monthly climatology",
+        )
+        st.plotly_chart(fig, use_container_width=True)
+    with col4:
+        fig = px.line(
+            anomalies[anomalies["ROI"].isin(shown)],
+            x="Date",
+            y="Anomaly (ha)",
+            color="ROI",
+            title="Monthly anomalies",
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def show_change(df):
+    limit = df["Net change (%)"].abs().quantile(0.95)
+    fig = px.choropleth(
+        df,
+        geojson=country_index.outline(),
+        locations="Name",
+        featureidkey="properties.NAME",
+        color="Net change (%)",
+        color_continuous_scale="RdBu",
+        range_color=(-limit, limit),
+        hover_data=list(df.columns[1:6]),
+    )
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(df)
+    leafmap.st_download_button("Download water change", df)
+
+
+# Each job panel reruns on its own when its widgets change.
+with col2:
+    job_panel(
+        analysis_key,
+        "job_id",
+        show_analysis,
+        cancel_label="Cancel analysis",
+        cancelled="The analysis was cancelled.",
+    )
+    job_panel(
+        download_key,
+        "download_job_id",
+        show_download,
+        cancel_label="Cancel download",
+        cancelled="The download was cancelled.",
+        waiting="Downloading...",
+    )
+    job_panel(
+        timelapse_key,
+        "timelapse_job_id",
+        show_timelapse,
+        cancel_label="Cancel timelapse",
+        cancelled="The timelapse was cancelled.",
+        waiting="Creating timelapse...",
+    )
+
+job_panel(
+    features_key,
+    "features_job_id",
+    show_features,
+    title="Water statistics of each feature",
+    cancel_label="Cancel feature statistics",
+    cancelled="The feature statistics were cancelled.",
+)
+job_panel(
+    trends_key,
+    "trends_job_id",
+    show_trends,
+    title="Water trends across countries",
+    cancel_label="Cancel comparison",
+    cancelled="The comparison was cancelled.",
+)
+job_panel(
+    change_key,
+    "change_job_id",
+    show_change,
+    title="Water change across countries",
+    cancel_label="Cancel ranking",
+    cancelled="The ranking was cancelled.",
+)
 
-                # with col2:
-                #     st.write(stats)
-
-            # with col2:
-
-            #     region = st.session_state["ROI"]
-            #     empty = st.empty()
-            #     empty.text("Computing...")
-            #     df = geemap.image_area_by_group(
-            #         layer,
-            #         region=region,
-            #         scale=1000,
-            #         denominator=1e6,
-            #         decimal_places=2,
-            #         verbose=True,
-            #     )
-            #     df["group"] = df.index
-            #     df["cum_pct"] = df["percentage"].cumsum()
-
-            #     fig = px.line(
-            #         df,
-            #         y="area",
-            #         x="group",
-            #         orientation="h",
-            #         labels={"group": "Occurrence (%)", "area": "Area (ha)"},
-            #     )
-
-            # with col1:
-            #     st.header(dataset)
-            #     st.plotly_chart(fig)
-            #     # empty.bar_chart(df["area"])
-            #     st.dataframe(df)
-            #     leafmap.st_download_button("Download data", df)
-
-            # with col2:
-            #     empty.text("")
-
-    # empty.text("")
+profiler.panel()
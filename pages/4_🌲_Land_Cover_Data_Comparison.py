@@ -1,9 +1,19 @@
+# Imported first so that the profiler can time the other imports.
+import profiler
 import datetime
 import ee
+import folium
 import streamlit as st
 import geemap.foliumap as geemap
+import plotly.express as px
+import leafmap
+
+import ee_client
+from analysis import landcover_crosstab
 
 st.set_page_config(layout="wide")
+ee_client.install()
+profiler.start()
 
 markdown = """
 Web App URL: <https://waters.streamlitapp.com>
@@ -35,13 +45,8 @@ Map.add_basemap("ESA WorldCover 2020 S2 FCC")
 Map.add_basemap("ESA WorldCover 2020 S2 TCC")
 Map.add_basemap("HYBRID")
 
-esa = ee.ImageCollection("ESA/WorldCover/v100").first()
 esa_vis = {"bands": ["Map"]}
 
-
-esri = ee.ImageCollection(
-    "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
-).mosaic()
 esri_vis = {
     "min": 1,
     "max": 10,
@@ -59,6 +64,65 @@ esri_vis = {
     ],
 }
 
+layer_names = {
+    "Dynamic World": "Dynamic World Land Cover",
+    "ESA Land Cover": "ESA Land Cover",
+    "ESRI Land Cover": "ESRI Land Cover",
+}
+
+
+def get_tile_url(dataset, start_date=None, end_date=None):
+    """Return the tile URL of a dataset for a date window.
+
+    ``getMapId`` goes through the map-ID cache of :mod:`ee_client`, so a URL
+    is requested once per (dataset, date window) and again once it expires
+    after ``EE_MAP_ID_TTL`` seconds.
+    """
+    if dataset == "Dynamic World":
+        region = ee.Geometry.BBox(-179, -89, 179, 89)
+        image = geemap.dynamic_world(
+            region, start_date, end_date, return_type="hillshade"
+        )
+        vis_params = {}
+    elif dataset == "ESA Land Cover":
+        image = ee.ImageCollection("ESA/WorldCover/v100").first()
+        vis_params = esa_vis
+    elif dataset == "ESRI Land Cover":
+        image = ee.ImageCollection(
+            "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
+        ).mosaic()
+        vis_params = esri_vis
+    else:
+        raise ValueError(f"Unknown dataset: {dataset}")
+
+    map_id_dict = image.getMapId(vis_params)
+    return map_id_dict["tile_fetcher"].url_format
+
+
+def get_layer(dataset, start_date, end_date):
+    """Build a tile layer for the dataset, reusing the cached map ID."""
+    if dataset != "Dynamic World":
+        # Only Dynamic World depends on the date window.
+        start_date = end_date = None
+    url = get_tile_url(dataset, start_date, end_date)
+    return folium.raster_layers.TileLayer(
+        tiles=url,
+        attr="Google Earth Engine",
+        name=layer_names[dataset],
+        overlay=True,
+        control=True,
+    )
+
+
+@st.cache_data(show_spinner=False)
+def compute_crosstab(
+    left, right, longitude, latitude, distance, scale, start_date, end_date
+):
+    region = ee.Geometry.Point([longitude, latitude]).buffer(distance * 1000).bounds()
+    if "Dynamic World" not in (left, right):
+        start_date = end_date = None
+    return landcover_crosstab(left, right, region, scale, start_date, end_date)
+
 
 markdown = """
     - [Dynamic World Land Cover](https://developers.google.com/earth-engine/datasets/catalog/GOOGLE_DYNAMICWORLD_V1?hl=en)
@@ -81,21 +145,12 @@ with col2:
     start_date = start.strftime("%Y-%m-%d")
     end_date = end.strftime("%Y-%m-%d")
 
-    region = ee.Geometry.BBox(-179, -89, 179, 89)
-    dw = geemap.dynamic_world(region, start_date, end_date, return_type="hillshade")
-
-    layers = {
-        "Dynamic World": geemap.ee_tile_layer(dw, {}, "Dynamic World Land Cover"),
-        "ESA Land Cover": geemap.ee_tile_layer(esa, esa_vis, "ESA Land Cover"),
-        "ESRI Land Cover": geemap.ee_tile_layer(esri, esri_vis, "ESRI Land Cover"),
-    }
-
-    options = list(layers.keys())
+    options = list(layer_names.keys())
     left = st.selectbox("Select a left layer", options, index=1)
     right = st.selectbox("Select a right layer", options, index=0)
 
-    left_layer = layers[left]
-    right_layer = layers[right]
+    left_layer = get_layer(left, start_date, end_date)
+    right_layer = get_layer(right, start_date, end_date)
 
     Map.split_map(left_layer, right_layer)
 
@@ -110,9 +165,56 @@ with col2:
     elif legend == "ESRI Land Cover":
         Map.add_legend(title="ESRI Land Cover", builtin_legend="ESRI_LandCover")
 
+    with st.expander("Land cover agreement"):
+        with st.form("crosstab"):
+            stats_left = st.selectbox(
+                "Select a dataset for rows", options, index=options.index(left)
+            )
+            stats_right = st.selectbox(
+                "Select a dataset for columns", options, index=options.index(right)
+            )
+            distance = st.slider("Distance from map center (km)", 1, 100, 10)
+            stats_scale = st.slider("Select a scale for computing", 10, 1000, 100)
+            compute = st.form_submit_button("Compute")
+
     with st.expander("Data sources"):
         st.markdown(markdown)
 
 
 with col1:
     Map.to_streamlit(height=750)
+
+    if compute:
+        if stats_left == stats_right:
+            st.error("Please select two different datasets.")
+        else:
+            with st.spinner("Computing..."):
+                df, matrix = compute_crosstab(
+                    stats_left,
+                    stats_right,
+                    longitude,
+                    latitude,
+                    distance,
+                    stats_scale,
+                    start_date,
+                    end_date,
+                )
+
+            fig = px.imshow(
+                matrix,
+                text_auto=".0f",
+                aspect="auto",
+                color_continuous_scale="Blues",
+                labels={"x": stats_right, "y": stats_left, "color": "Area (ha)"},
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            with st.expander("Statistics"):
+                st.write(df)
+                leafmap.st_download_button("Download data", df)
+                st.write(matrix)
+                leafmap.st_download_button(
+                    "Download matrix", matrix.reset_index(), file_name="matrix.csv"
+                )
+
+profiler.panel()
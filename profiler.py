@@ -0,0 +1,313 @@
+"""Opt-in profiler of the cost of a Streamlit rerun, shown in the sidebar.
+
+Set ``WATER_PROFILER=1`` to enable it. Pages import this module first, call
+:func:`start` after ``st.set_page_config`` and :func:`panel` at the end. The
+panel shows a waterfall of the rerun:
+
+- imports made by the script thread while a session is profiling,
+- Earth Engine calls (``computeValue``) and map-ID requests with the size of
+  the request and response,
+- the map render with the size of its HTML, and
+- the pandas/plotly rendering of job results,
+
+plus cache hit and miss counts of the last reruns. A button captures a
+pyinstrument (if installed) or cProfile trace of the next rerun.
+
+Without ``WATER_PROFILER`` every function returns immediately.
+"""
+
+import builtins
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+ENABLED = os.environ.get("WATER_PROFILER") == "1"
+HISTORY = int(os.environ.get("WATER_PROFILER_HISTORY", 20))
+
+_local = threading.local()
+_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+class Rerun:
+    """Spans recorded by the script thread during one rerun."""
+
+    def __init__(self, started):
+        self.started = started
+        self.spans = []
+        self.counts = snapshot()
+
+    def add(self, category, name, start, end, size=None):
+        self.spans.append(
+            {
+                "Category": category,
+                "Name": name,
+                "Start (ms)": (start - self.started) * 1000,
+                "Duration (ms)": (end - start) * 1000,
+                "Bytes": size,
+            }
+        )
+
+
+def _current():
+    return getattr(_local, "rerun", None)
+
+
+def count(name, hit):
+    """Count a cache hit or miss; cheap enough to call when disabled."""
+    if not ENABLED:
+        return
+    with _counts_lock:
+        _counts[f"{name} {'hits' if hit else 'misses'}"] += 1
+
+
+def snapshot():
+    """Return the process-wide cache counters."""
+    import session_store
+
+    with _counts_lock:
+        counts = dict(_counts)
+    stats = session_store.get_store().stats
+    counts["session store hits"] = stats["hits"]
+    counts["session store misses"] = stats["misses"]
+    return counts
+
+
+@contextlib.contextmanager
+def span(category, name):
+    """Time a block of the rerun; set ``["bytes"]`` on the yielded dict."""
+    rerun = _current()
+    if rerun is None:
+        yield {}
+        return
+    info = {}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        rerun.add(category, name, start, time.perf_counter(), info.get("bytes"))
+
+
+def _size(obj):
+    try:
+        if hasattr(obj, "serialize"):
+            return len(obj.serialize())
+        if isinstance(obj, dict) and hasattr(obj.get("image"), "serialize"):
+            return len(obj["image"].serialize())
+        return len(json.dumps(obj, default=str))
+    except Exception:
+        return None
+
+
+def _call_name(obj):
+    try:
+        return obj.func.getSignature()["name"]
+    except Exception:
+        return type(obj).__name__
+
+
+def _timed(func, category, name=None):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rerun = _current()
+        if rerun is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        end = time.perf_counter()
+        sent = _size(args[0]) if args else None
+        received = _size(result)
+        size = None if sent is None or received is None else sent + received
+        label = name or (_call_name(args[0]) if args else func.__name__)
+        rerun.add(category, label, start, end, size)
+        return result
+
+    return wrapper
+
+
+def _timed_import(name, *args, **kwargs):
+    # Cached modules are cheap; only time the first import of a module made
+    # by a script thread, and not the imports it makes itself.
+    if (
+        name in sys.modules
+        or getattr(_local, "importing", False)
+        or threading.current_thread().name != SCRIPT_THREAD
+    ):
+        return _original_import(name, *args, **kwargs)
+    _local.importing = True
+    start = time.perf_counter()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        _local.importing = False
+        pending = getattr(_local, "imports", None)
+        if pending is None:
+            pending = _local.imports = []
+        pending.append((name, start, time.perf_counter()))
+
+
+_original_import = builtins.__import__
+_installed = False
+_install_lock = threading.Lock()
+# The thread Streamlit runs page scripts in.
+SCRIPT_THREAD = "ScriptRunner.scriptThread"
+# Sessions profiling their reruns; imports are timed while there are any.
+_profiling = set()
+
+
+def install():
+    """Time imports and Earth Engine calls of profiled reruns."""
+    global _installed
+    import ee
+
+    with _install_lock:
+        if _installed:
+            return
+        ee.data.computeValue = _timed(ee.data.computeValue, "ee")
+        ee.data.getMapId = _timed(ee.data.getMapId, "map id", "getMapId")
+        _installed = True
+
+
+def _set_profiling(session, on):
+    """Time imports while a session profiles its reruns, and only then."""
+    with _install_lock:
+        if on:
+            _profiling.add(session)
+        else:
+            _profiling.discard(session)
+        hooked = builtins.__import__ is _timed_import
+        if _profiling and not hooked:
+            builtins.__import__ = _timed_import
+        elif not _profiling and hooked:
+            builtins.__import__ = _original_import
+
+
+def start():
+    """Start profiling the current rerun if the session asked for it."""
+    if not ENABLED:
+        return
+    import streamlit as st
+
+    import session_store
+
+    install()
+    now = time.perf_counter()
+    imports = getattr(_local, "imports", None) or []
+    _local.imports = []
+    on = st.session_state.get("profiler_on", False)
+    _set_profiling(session_store.session_id(), on)
+    if not on:
+        _local.rerun = None
+        return
+
+    origin = min([now] + [start for _, start, _ in imports])
+    rerun = Rerun(origin)
+    for name, begin, end in imports:
+        rerun.add("import", name, begin, end)
+    _local.rerun = rerun
+
+    if st.session_state.pop("profiler_capture", False):
+        try:
+            from pyinstrument import Profiler
+
+            profile = Profiler()
+            profile.start()
+        except ImportError:
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
+        _local.profile = profile
+
+
+def _stop_profile():
+    """Stop a running trace and return the path of the dumped file."""
+    from spatial_index import CACHE_DIR
+
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return None
+    _local.profile = None
+
+    directory = os.path.join(CACHE_DIR, "profiles")
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if hasattr(profile, "output_html"):
+        profile.stop()
+        path = os.path.join(directory, f"rerun-{stamp}.html")
+        with open(path, "w") as f:
+            f.write(profile.output_html())
+    else:
+        profile.disable()
+        path = os.path.join(directory, f"rerun-{stamp}.prof")
+        profile.dump_stats(path)
+    return path
+
+
+def panel():
+    """Finish the rerun and show the profiler in the sidebar."""
+    if not ENABLED:
+        return
+    import pandas as pd
+    import plotly.express as px
+    import streamlit as st
+
+    rerun = _current()
+    _local.rerun = None
+    path = _stop_profile()
+    if path is not None:
+        st.session_state["profiler_trace"] = path
+
+    with st.sidebar.expander("Rerun profiler", expanded=rerun is not None):
+        st.checkbox("Profile reruns", key="profiler_on")
+        if rerun is None:
+            return
+
+        total = (time.perf_counter() - rerun.started) * 1000
+        counts = snapshot()
+        delta = {
+            name: value - rerun.counts.get(name, 0)
+            for name, value in counts.items()
+            if value - rerun.counts.get(name, 0)
+        }
+        history = st.session_state.setdefault("profiler_history", [])
+        history.append({"Total (ms)": round(total), **delta})
+        del history[:-HISTORY]
+
+        st.metric("This rerun", f"{total:.0f} ms")
+        df = pd.DataFrame(rerun.spans)
+        if not df.empty:
+            fig = px.bar(
+                df,
+                x="Duration (ms)",
+                base="Start (ms)",
+                y="Name",
+                color="Category",
+                orientation="h",
+                hover_data=["Bytes"],
+            )
+            fig.update_yaxes(autorange="reversed", title=None)
+            fig.update_layout(
+                height=120 + 18 * len(df), margin={"l": 0, "r": 0, "t": 0, "b": 0}
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(
+                df.groupby("Category")[["Duration (ms)", "Bytes"]].sum().round(1)
+            )
+
+        st.write(f"Cache hits and misses of the last {len(history)} reruns")
+        st.dataframe(pd.DataFrame(history).fillna(0))
+
+        if st.button("Capture a trace of the next rerun"):
+            st.session_state["profiler_capture"] = True
+        trace = st.session_state.get("profiler_trace")
+        if trace and os.path.exists(trace):
+            with open(trace, "rb") as f:
+                st.download_button(
+                    "Download the last trace", f, file_name=os.path.basename(trace)
+                )
@@ -0,0 +1,147 @@
+"""Multi-resolution cache of statistics answering from the nearest scale.
+
+Area statistics change slowly with the reduction scale, so a result computed
+at 1000 m is usually a good answer for 900 m. The pyramid keeps results per
+analysis at a ladder of scales and answers a request from the nearest cached
+scale when the estimated error is within the caller's tolerance.
+
+The error is estimated from how much a summary of the result (e.g. the total
+area) changes per decade of scale. With two or more cached scales for an
+analysis this rate is measured, but never taken as lower than the assumed
+``error_per_decade``.
+
+Levels are also written to the shared cache, so the other workers of a
+deployment and restarted processes start from them.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import profiler
+import shared_cache
+
+LADDER = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def snap(scale):
+    """Return the ladder scale nearest to ``scale`` in log space."""
+    return min(LADDER, key=lambda level: abs(math.log10(level / scale)))
+
+
+class StatsPyramid:
+    def __init__(self, maxsize=512, error_per_decade=0.05, shared=None, ttl=86400):
+        self.maxsize = maxsize
+        self.error_per_decade = error_per_decade
+        self.shared = shared
+        self.ttl = ttl
+        self.levels = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _error_rate(self, levels):
+        """Relative change of the summary per decade of scale (worst case).
+
+        Never below ``error_per_decade``: two levels that happen to agree
+        (e.g. both without water) say nothing about the other scales.
+        """
+        rate = self.error_per_decade
+        scales = sorted(levels)
+        for fine, coarse in zip(scales, scales[1:]):
+            a, b = levels[fine][1], levels[coarse][1]
+            if not a and not b:
+                continue
+            change = abs(b - a) / max(abs(a), abs(b))
+            rate = max(rate, change / math.log10(coarse / fine))
+        return rate
+
+    def _levels(self, key):
+        with self.lock:
+            levels = self.levels.get(key)
+            if levels is not None:
+                return dict(levels)
+        if self.shared is None:
+            return {}
+        levels = self.shared.get(f"pyramid:{key}") or {}
+        if levels:
+            with self.lock:
+                self.levels.setdefault(key, {}).update(levels)
+                self._trim()
+        return dict(levels)
+
+    def _trim(self):
+        while len(self.levels) > self.maxsize:
+            self.levels.popitem(last=False)
+
+    def estimate(self, key, scale):
+        """Return (cached scale, estimated relative error) nearest to ``scale``."""
+        levels = self._levels(key)
+        if not levels:
+            return None, math.inf
+
+        nearest = min(levels, key=lambda level: abs(math.log10(level / scale)))
+        decades = abs(math.log10(nearest / scale))
+        return nearest, self._error_rate(levels) * decades
+
+    def get(self, key, scale, compute, summarize, tolerance=0.02):
+        """Return a result for ``scale``, computing it only when needed.
+
+        Args:
+            key (str): Identifies the analysis and region, without the scale.
+            scale (float): The requested scale in meters.
+            compute (callable): Computes the result at a given scale.
+            summarize (callable): Reduces a result to a number, such as the
+                total area, used to estimate the error between scales.
+            tolerance (float): Acceptable relative error; 0 always answers at
+                exactly the requested scale.
+
+        Returns:
+            tuple: The result, the scale it was computed at and the estimated
+                relative error of using it for the requested scale.
+        """
+        nearest, error = self.estimate(key, scale)
+        if nearest == scale or (nearest is not None and error <= tolerance):
+            with self.lock:
+                levels = self.levels.get(key, {})
+                if nearest in levels:
+                    self.levels.move_to_end(key)
+                    profiler.count("pyramid", True)
+                    return levels[nearest][0], nearest, error
+
+        # Compute on the ladder so later requests can reuse the level, unless
+        # the ladder level itself is too far from the requested scale.
+        levels = self._levels(key)
+        target = snap(scale)
+        rate = self._error_rate(levels)
+        if (
+            tolerance == 0
+            or target in levels
+            or rate * abs(math.log10(target / scale)) > tolerance
+        ):
+            target = scale
+
+        profiler.count("pyramid", False)
+        result = compute(target)
+        with self.lock:
+            self.levels.setdefault(key, {})[target] = (result, summarize(result))
+            self.levels.move_to_end(key)
+            levels = dict(self.levels[key])
+            self._trim()
+        if self.shared is not None:
+            self.shared.set(f"pyramid:{key}", levels, self.ttl)
+        return result, target, rate * abs(math.log10(target / scale))
+
+
+_pyramid = None
+_pyramid_lock = threading.Lock()
+
+
+def get_pyramid():
+    """Return the pyramid shared by all sessions of this process."""
+    global _pyramid
+    with _pyramid_lock:
+        if _pyramid is None:
+            shared = None
+            if shared_cache.enabled():
+                shared = shared_cache.get_shared_cache()
+            _pyramid = StatsPyramid(shared=shared)
+        return _pyramid
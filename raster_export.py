@@ -0,0 +1,227 @@
+"""Download clipped Earth Engine images as a local GeoTIFF mosaic.
+
+``getDownloadURL`` refuses requests above about 32 MB, so the ROI is split
+into tiles on one pixel grid, each small enough for one request. Tiles are
+downloaded concurrently by a bounded pool with retries and written into
+their window of a tiled GeoTIFF as they arrive, so at most a few tiles are
+held in memory whatever the size of the mosaic. The mosaic is finally
+converted to a Cloud Optimized GeoTIFF.
+
+Tile URLs come from a callable, so the mosaic can be assembled from any HTTP
+server, such as a local stand-in serving prepared tiles.
+"""
+
+import logging
+import math
+import os
+import time
+import urllib.request
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import ee
+from osgeo import gdal
+
+logger = logging.getLogger(__name__)
+
+gdal.UseExceptions()
+
+MAX_BYTES = 32 * 2**20
+MAX_DIMENSION = 10000
+MAX_TILES = 2000
+# Meters per degree at the equator; scales are converted to degrees so every
+# tile shares one EPSG:4326 grid.
+METERS_PER_DEGREE = 111320
+
+
+def plan_tiles(bounds, scale, bands=1, bytes_per_pixel=4, max_bytes=None):
+    """Split bounds into download tiles on one pixel grid.
+
+    Args:
+        bounds (list): [minx, miny, maxx, maxy] in degrees.
+        scale (float): Pixel size in meters.
+
+    Returns:
+        tuple: The geotransform of the mosaic, its width and height, and the
+            tiles as (column offset, row offset, width, height).
+    """
+    max_bytes = max_bytes or MAX_BYTES
+    minx, miny, maxx, maxy = bounds
+    size = scale / METERS_PER_DEGREE
+    width = max(1, math.ceil((maxx - minx) / size))
+    height = max(1, math.ceil((maxy - miny) / size))
+    transform = (minx, size, 0.0, maxy, 0.0, -size)
+
+    side = int(math.sqrt(max_bytes / (bands * bytes_per_pixel)))
+    side = max(1, min(side, MAX_DIMENSION))
+    tiles = [
+        (col, row, min(side, width - col), min(side, height - row))
+        for row in range(0, height, side)
+        for col in range(0, width, side)
+    ]
+    return transform, width, height, tiles
+
+
+def tile_url(image, transform, tile):
+    """Return the download URL of one tile of an image."""
+    col, row, width, height = tile
+    x0, size, _, y0, _, _ = transform
+    return image.getDownloadURL(
+        {
+            "format": "GEO_TIFF",
+            "crs": "EPSG:4326",
+            "crs_transform": [size, 0, x0 + col * size, 0, -size, y0 - row * size],
+            "dimensions": f"{width}x{height}",
+        }
+    )
+
+
+def fetch(url, retries=3, timeout=300):
+    """Download a URL, retrying with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.read()
+        except OSError as e:
+            if attempt == retries:
+                raise
+            logger.warning("Retrying %s after %s", url, e)
+            time.sleep(2**attempt)
+
+
+def write_tile(dst, tile, data):
+    """Copy a downloaded GeoTIFF into its window of the mosaic."""
+    col, row, width, height = tile
+    name = f"/vsimem/{uuid.uuid4().hex}.tif"
+    gdal.FileFromMemBuffer(name, data)
+    try:
+        src = gdal.Open(name)
+        for band in range(1, dst.RasterCount + 1):
+            array = src.GetRasterBand(band).ReadAsArray(0, 0, width, height)
+            dst.GetRasterBand(band).WriteArray(array, col, row)
+        src = None
+    finally:
+        gdal.Unlink(name)
+
+
+def mosaic(
+    path,
+    url_for,
+    transform,
+    width,
+    height,
+    tiles,
+    bands=1,
+    nodata=None,
+    workers=8,
+    retries=3,
+    cog=True,
+    progress=None,
+):
+    """Download tiles concurrently and write them into a GeoTIFF.
+
+    Args:
+        path (str): The output file.
+        url_for (callable): Returns the URL of a tile.
+        cog (bool): Convert the mosaic to a Cloud Optimized GeoTIFF.
+        progress (callable): Called with the fraction of tiles written.
+
+    Returns:
+        str: The output file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp.tif"
+    dst = gdal.GetDriverByName("GTiff").Create(
+        tmp_path,
+        width,
+        height,
+        bands,
+        gdal.GDT_Float32,
+        options=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+    )
+    dst.SetGeoTransform(transform)
+    dst.SetProjection("EPSG:4326")
+    if nodata is not None:
+        for band in range(1, bands + 1):
+            dst.GetRasterBand(band).SetNoDataValue(nodata)
+
+    def download(tile):
+        return fetch(url_for(tile), retries)
+
+    try:
+        # Only a bounded number of tiles is downloaded ahead of the writer.
+        with ThreadPoolExecutor(workers) as executor:
+            queue = iter(tiles)
+            pending = {}
+            written = 0
+            while True:
+                while len(pending) < workers * 2:
+                    tile = next(queue, None)
+                    if tile is None:
+                        break
+                    pending[executor.submit(download, tile)] = tile
+                if not pending:
+                    break
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    tile = pending.pop(future)
+                    write_tile(dst, tile, future.result())
+                    written += 1
+                    if progress is not None:
+                        progress(written / len(tiles))
+        dst.FlushCache()
+        dst = None
+
+        if cog:
+            gdal.Translate(
+                path,
+                tmp_path,
+                format="COG",
+                creationOptions=["COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+            )
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        dst = None
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def export_image(
+    image, bounds, scale, path, nodata=-9999, workers=8, cog=True, progress=None
+):
+    """Download an Earth Engine image within bounds as a GeoTIFF.
+
+    Args:
+        image (ee.Image): The image, usually clipped to the ROI.
+        bounds (list): [minx, miny, maxx, maxy] of the ROI in degrees.
+        scale (float): Pixel size in meters.
+        path (str): The output file.
+
+    Returns:
+        str: The output file.
+    """
+    image = ee.Image(image).toFloat().unmask(nodata, False)
+    bands = image.bandNames().size().getInfo()
+    transform, width, height, tiles = plan_tiles(bounds, scale, bands)
+    if len(tiles) > MAX_TILES:
+        raise ValueError(
+            f"The download would take {len(tiles)} tiles at {scale} m; "
+            "choose a coarser scale or a smaller region"
+        )
+    logger.info(
+        "Downloading %dx%d pixels in %d tiles to %s", width, height, len(tiles), path
+    )
+    return mosaic(
+        path,
+        lambda tile: tile_url(image, transform, tile),
+        transform,
+        width,
+        height,
+        tiles,
+        bands,
+        nodata,
+        workers,
+        cog=cog,
+        progress=progress,
+    )
@@ -0,0 +1,210 @@
+"""Shared, memory-bounded storage for heavy per-session objects.
+
+Uploaded ROIs (the GeoDataFrame and its ``gdf_to_ee`` conversion) can be
+large, and keeping one copy per session in ``st.session_state`` lets idle
+sessions pin them in memory. Instead, pages keep heavy objects in one
+process-wide store keyed by a content hash: sessions uploading the same file
+share a copy, each session's references are accounted against a budget, and
+the references of idle sessions are dropped so their objects can be evicted.
+Evicted objects are rebuilt from their factory on the next access.
+
+Budgets are read from the environment:
+
+- ``WATER_STORE_BUDGET_MB``: total size of the shared store (default 1024).
+- ``WATER_SESSION_BUDGET_MB``: size referenced by one session (default 256).
+- ``WATER_SESSION_IDLE_SECONDS``: idle time after which a session's
+  references are dropped (default 900).
+"""
+
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MB = 2**20
+
+
+def estimate_size(obj):
+    """Approximate the memory held by an object in bytes."""
+    if hasattr(obj, "memory_usage") and hasattr(obj, "geometry"):
+        # GeoDataFrame: columns plus the coordinates of every geometry.
+        size = int(obj.memory_usage(deep=True).sum())
+        size += int(obj.geometry.apply(lambda g: len(g.wkb) if g else 0).sum())
+        return size
+    if hasattr(obj, "serialize"):
+        # Earth Engine objects hold their whole expression, including any
+        # client-side geometries.
+        return sys.getsizeof(obj) + len(obj.serialize())
+
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, type):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item, 0)
+        stack.extend(gc.get_referents(item))
+    return size
+
+
+class ContentStore:
+    """LRU store of objects keyed by content hash with session references."""
+
+    def __init__(self, budget=1024 * MB, session_budget=256 * MB, idle_after=900):
+        self.budget = budget
+        self.session_budget = session_budget
+        self.idle_after = idle_after
+        self.entries = OrderedDict()
+        self.sessions = {}
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def get(self, digest, factory, session=None):
+        """Return the object stored under ``digest``, building it if needed."""
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None:
+                self.entries.move_to_end(digest)
+                self.stats["hits"] += 1
+                self._reference(digest, session)
+                return entry["value"]
+
+        # Build outside the lock; two sessions racing on the same digest only
+        # waste one build.
+        value = factory()
+        size = estimate_size(value)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.stats["misses"] += 1
+                entry = {"value": value, "size": size}
+                self.entries[digest] = entry
+            self._reference(digest, session)
+            self._evict()
+            return entry["value"]
+
+    def _reference(self, digest, session):
+        if session is None:
+            return
+        state = self.sessions.setdefault(
+            session, {"digests": OrderedDict(), "last_seen": time.monotonic()}
+        )
+        state["digests"][digest] = True
+        state["digests"].move_to_end(digest)
+        state["last_seen"] = time.monotonic()
+
+        # Over budget: forget the session's least recently used objects, but
+        # never the one it is using right now.
+        while (
+            len(state["digests"]) > 1
+            and self.session_size(session) > self.session_budget
+        ):
+            oldest = next(iter(state["digests"]))
+            del state["digests"][oldest]
+            logger.info("Session %s over budget, released %s", session, oldest)
+
+    def session_size(self, session):
+        state = self.sessions.get(session)
+        if state is None:
+            return 0
+        return sum(
+            self.entries[d]["size"] for d in state["digests"] if d in self.entries
+        )
+
+    def referenced(self):
+        digests = set()
+        for state in self.sessions.values():
+            digests.update(state["digests"])
+        return digests
+
+    def touch(self, session):
+        """Mark a session active and release the references of idle ones."""
+        with self.lock:
+            now = time.monotonic()
+            if session is not None:
+                self.sessions.setdefault(
+                    session, {"digests": OrderedDict(), "last_seen": now}
+                )["last_seen"] = now
+            for other, state in list(self.sessions.items()):
+                if now - state["last_seen"] > self.idle_after:
+                    logger.info("Releasing heavy state of idle session %s", other)
+                    del self.sessions[other]
+            self._evict()
+
+    def _evict(self):
+        if self.size <= self.budget:
+            return
+
+        # Unreferenced objects go first, least recently used first; objects of
+        # active sessions only if that is not enough.
+        referenced = self.referenced()
+        candidates = [d for d in self.entries if d not in referenced]
+        candidates += [d for d in self.entries if d in referenced]
+        for digest in candidates:
+            if self.size <= self.budget or len(self.entries) <= 1:
+                break
+            del self.entries[digest]
+            self.stats["evictions"] += 1
+
+    def usage(self):
+        """Return the store size, entry count and per-session sizes."""
+        with self.lock:
+            return {
+                "store_mb": round(self.size / MB, 2),
+                "entries": len(self.entries),
+                "sessions": {
+                    session: round(self.session_size(session) / MB, 2)
+                    for session in self.sessions
+                },
+                **self.stats,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the store shared by all sessions of this process."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ContentStore(
+                budget=float(os.environ.get("WATER_STORE_BUDGET_MB", 1024)) * MB,
+                session_budget=float(os.environ.get("WATER_SESSION_BUDGET_MB", 256))
+                * MB,
+                idle_after=float(os.environ.get("WATER_SESSION_IDLE_SECONDS", 900)),
+            )
+        return _store
+
+
+def session_id():
+    """Return the id of the Streamlit session running this script, if any."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        from streamlit.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def touch():
+    """Record activity of the current session; call once per rerun."""
+    get_store().touch(session_id())
+
+
+def remember(digest, factory):
+    """Return the shared object for ``digest`` on behalf of the current session."""
+    return get_store().get(digest, factory, session_id())
@@ -0,0 +1,171 @@
+"""Cache shared by the worker processes of a multi-worker deployment.
+
+Results, map IDs and pyramid levels cached in one Streamlit process are
+invisible to the others and lost on restart. Caches that can be shared go
+through the backend selected by ``WATER_SHARED_CACHE``:
+
+- unset or ``memory``: a per-process dictionary (single-process deployments).
+- ``sqlite:///path/to/cache.db``: a SQLite file shared by the processes of
+  one machine; it survives restarts.
+- ``redis://host:6379/0``: a Redis-compatible server shared by machines.
+
+Values are pickled and expire after a time to live.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """A thread-safe LRU cache with a time to live, local to the process."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and time.time() > expires:
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = (None if ttl is None else time.time() + ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+class SQLiteCache:
+    """A cache in a SQLite file that processes on one machine can share."""
+
+    def __init__(self, path, purge_every=600):
+        self.path = path
+        self.purge_every = purge_every
+        self.purged = 0.0
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            # Readers do not block the writer of another process.
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def get(self, key):
+        db = self.connection()
+        row = db.execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and time.time() > expires:
+            return None
+        try:
+            return pickle.loads(value)
+        except Exception as e:
+            logger.warning("Dropping unreadable cache entry %s: %s", key, e)
+            self.delete(key)
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        with self.connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires),
+            )
+            now = time.time()
+            if now - self.purged > self.purge_every:
+                self.purged = now
+                db.execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+    def delete(self, key):
+        with self.connection() as db:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisCache:
+    """A cache on a Redis-compatible server shared by several machines."""
+
+    def __init__(self, url, prefix="water:", client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(
+            self.prefix + key,
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            ex=None if ttl is None else max(1, int(ttl)),
+        )
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def from_url(url):
+    """Return the cache backend for a ``WATER_SHARED_CACHE`` value."""
+    if not url or url == "memory":
+        return MemoryCache()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///") :])
+    raise ValueError(f"Unsupported WATER_SHARED_CACHE: {url}")
+
+
+def enabled():
+    """Whether a cache shared between processes is configured."""
+    return os.environ.get("WATER_SHARED_CACHE", "memory") not in ("", "memory")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Return the cache shared with the other workers of the deployment."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = from_url(os.environ.get("WATER_SHARED_CACHE"))
+        return _cache
@@ -0,0 +1,132 @@
+"""Local spatial index over country and uploaded ROI geometries.
+
+The countries collection is downloaded from Earth Engine once, stored on
+disk and indexed with an R-tree, so country names, bounds, centroids and
+point-in-polygon lookups are answered without network round trips.
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+import ee
+import geemap.foliumap as geemap
+import geopandas as gpd
+from shapely.geometry import Point
+
+COUNTRIES_ASSET = "users/giswqs/public/countries"
+CACHE_DIR = os.environ.get(
+    "WATER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "streamlit-water")
+)
+
+
+def load_countries():
+    """Return the countries collection as a GeoDataFrame, cached on disk."""
+    path = os.path.join(CACHE_DIR, "countries.geojson")
+    if os.path.exists(path):
+        return gpd.read_file(path)
+
+    gdf = geemap.ee_to_gdf(ee.FeatureCollection(COUNTRIES_ASSET))
+    gdf = gdf.set_crs(epsg=4326, allow_override=True)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    gdf.to_file(tmp_path, driver="GeoJSON")
+    os.replace(tmp_path, path)
+    return gdf
+
+
+# Simplification tolerances (degrees) from coarse to fine. Outlines shown at
+# a zoom level use the coarsest tolerance below the size of a pixel there.
+TOLERANCES = [0.1, 0.02, 0.005, 0.001, 0.0002]
+DEFAULT_ZOOM = 2
+
+
+def pick_tolerance(zoom=None):
+    """Return the simplification tolerance of outlines shown at a map zoom."""
+    if zoom is None:
+        zoom = DEFAULT_ZOOM
+    # Degrees of longitude covered by one pixel of a 256-pixel web map tile.
+    pixel = 360 / (256 * 2**zoom)
+    for tolerance in TOLERANCES:
+        if tolerance <= pixel:
+            return tolerance
+    return TOLERANCES[-1]
+
+
+def outline_geojson(gdf, columns=None, zoom=None, tolerance=None):
+    """Return a GeoJSON dict of the geometries simplified for a map zoom."""
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    gdf = gdf[(columns or []) + [gdf.geometry.name]].copy()
+    if tolerance is None:
+        tolerance = pick_tolerance(zoom)
+    gdf[gdf.geometry.name] = gdf.geometry.simplify(tolerance, preserve_topology=True)
+    return json.loads(gdf.to_json())
+
+
+def gdf_bounds(gdf):
+    """Return [minx, miny, maxx, maxy] of a GeoDataFrame in EPSG:4326."""
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    return [float(v) for v in gdf.total_bounds]
+
+
+class SpatialIndex:
+    """R-tree over named polygons answering bounds and point queries."""
+
+    def __init__(self, gdf, field):
+        self.gdf = gdf[gdf[field].notna()].reset_index(drop=True)
+        self.field = field
+        self.sindex = self.gdf.sindex
+        self.rows = {name: i for i, name in enumerate(self.gdf[field])}
+        self.outlines = {}
+
+    def names(self):
+        return sorted(self.rows)
+
+    def geometry(self, name):
+        return self.gdf.geometry.iloc[self.rows[name]]
+
+    def bounds(self, name):
+        """Return [minx, miny, maxx, maxy] of the named polygon."""
+        return [float(v) for v in self.geometry(name).bounds]
+
+    def centroid(self, name):
+        """Return (longitude, latitude) of a point inside the named polygon."""
+        point = self.geometry(name).representative_point()
+        return point.x, point.y
+
+    def outline(self, name=None, zoom=None):
+        """Return the outline of a polygon, or of all of them, for a map zoom.
+
+        Outlines are cached per tolerance level of :data:`TOLERANCES`.
+        """
+        key = (name, pick_tolerance(zoom))
+        if key not in self.outlines:
+            if name is None:
+                gdf = self.gdf
+            else:
+                gdf = self.gdf.iloc[[self.rows[name]]]
+            self.outlines[key] = outline_geojson(gdf, [self.field], tolerance=key[1])
+        return self.outlines[key]
+
+    def lookup(self, longitude, latitude):
+        """Return the name of the polygon containing the point, or None."""
+        point = Point(longitude, latitude)
+        for i in self.sindex.query(point):
+            if self.gdf.geometry.iloc[i].intersects(point):
+                return self.gdf[self.field].iloc[i]
+        return None
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_country_index(field="name"):
+    """Return the country index keyed by ``field``, shared by all sessions."""
+    with _lock:
+        if field not in _indexes:
+            _indexes[field] = SpatialIndex(load_countries(), field)
+        return _indexes[field]
@@ -1,14 +1,158 @@
-from subprocess import Popen
+"""Serve the Streamlit app from the Jupyter server on Binder.
 
+``postBuild`` installs this module as a Jupyter server extension. It starts
+the app under a supervisor thread that
 
-def load_jupyter_server_extension(nbapp):
-    """serve the streamlit app"""
-    Popen(
-        [
-            "streamlit",
-            "run",
-            "Home.py",
+- starts the server through ``warmup.py``, which warms the serving process
+  (imports, Earth Engine, country indexes) before it starts listening,
+- waits until the app answers its health check,
+- restarts the app with backoff when it exits, and
+- logs how long each startup phase took.
+
+Visitors are held until the app is ready: ``<base_url>streamlit/`` waits for
+the supervisor and then redirects to the proxied app, and
+``<base_url>streamlit/health`` answers 503 until then.
+
+This module is copied into site-packages, so it only uses the standard
+library and the Jupyter server's tornado; the app and the warm-up script run
+from the notebook directory.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+PORT = int(os.environ.get("STREAMLIT_PORT", 8501))
+SCRIPT = os.environ.get("STREAMLIT_SCRIPT", "Home.py")
+WARMUP = os.environ.get("STREAMLIT_WARMUP", "warmup.py")
+READY_TIMEOUT = float(os.environ.get("STREAMLIT_READY_TIMEOUT", 120))
+HEALTH_PATHS = ["/_stcore/health", "/healthz"]
+
+
+class Supervisor:
+    """Keep the Streamlit app running and report when it is ready."""
+
+    def __init__(self, log, cwd=None, port=PORT):
+        self.log = log
+        self.cwd = cwd or os.getcwd()
+        self.port = port
+        self.ready = threading.Event()
+        self.process = None
+        self.restarts = 0
+
+    def command(self):
+        if os.path.exists(os.path.join(self.cwd, WARMUP)):
+            # Warm the server process itself, then serve from it.
+            launcher = [sys.executable, WARMUP, "serve"]
+        else:
+            launcher = [sys.executable, "-m", "streamlit", "run"]
+        return launcher + [
+            SCRIPT,
+            f"--server.port={self.port}",
+            "--server.headless=true",
             "--browser.serverAddress=0.0.0.0",
             "--server.enableCORS=False",
         ]
+
+    def healthy(self):
+        for path in HEALTH_PATHS:
+            url = f"http://127.0.0.1:{self.port}{path}"
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    if response.status == 200:
+                        return True
+            except OSError:
+                continue
+        return False
+
+    def wait_ready(self):
+        """Wait until the app is healthy; False if it exits or times out."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                return False
+            if self.healthy():
+                return True
+            time.sleep(0.5)
+        return False
+
+    def phase(self, name, started):
+        self.log.info("Streamlit: %s after %.1f s", name, time.monotonic() - started)
+
+    def run(self):
+        backoff = 1
+        while True:
+            started = time.monotonic()
+            self.process = subprocess.Popen(self.command(), cwd=self.cwd)
+            self.phase(f"started process {self.process.pid}", started)
+
+            if self.wait_ready():
+                # The server listens only after its warm-up.
+                self.phase("warmed up and health check passed", started)
+                self.ready.set()
+                self.phase("ready", started)
+            else:
+                self.log.error("Streamlit did not become ready")
+                self.process.kill()
+
+            code = self.process.wait()
+            self.ready.clear()
+            uptime = time.monotonic() - started
+            self.restarts += 1
+            # Quick crashes back off; a long healthy run resets the backoff.
+            backoff = 1 if uptime > 60 else min(backoff * 2, 60)
+            self.log.warning(
+                "Streamlit exited with %d after %.0f s; restart %d in %d s",
+                code,
+                uptime,
+                self.restarts,
+                backoff,
+            )
+            time.sleep(backoff)
+
+
+def add_handlers(nbapp, supervisor):
+    """Serve the readiness gate and the health check from the Jupyter server."""
+    from tornado import web
+    from tornado.ioloop import IOLoop
+
+    base_url = nbapp.web_app.settings.get("base_url", "/")
+    app_url = f"{base_url}proxy/{supervisor.port}/"
+
+    class GateHandler(web.RequestHandler):
+        async def get(self):
+            ready = await IOLoop.current().run_in_executor(
+                None, supervisor.ready.wait, READY_TIMEOUT
+            )
+            if not ready:
+                self.set_status(503)
+                self.set_header("Retry-After", "10")
+                self.finish("The app is starting, please reload in a moment.")
+                return
+            self.redirect(app_url)
+
+    class HealthHandler(web.RequestHandler):
+        def get(self):
+            self.set_status(200 if supervisor.ready.is_set() else 503)
+            self.finish({"ready": supervisor.ready.is_set()})
+
+    nbapp.web_app.add_handlers(
+        ".*$",
+        [
+            (f"{base_url}streamlit/?", GateHandler),
+            (f"{base_url}streamlit/health", HealthHandler),
+        ],
     )
+
+
+def load_jupyter_server_extension(nbapp):
+    """serve the streamlit app"""
+    cwd = getattr(nbapp, "notebook_dir", None) or getattr(nbapp, "root_dir", None)
+    supervisor = Supervisor(nbapp.log, cwd)
+    thread = threading.Thread(target=supervisor.run, name="streamlit", daemon=True)
+    thread.start()
+    nbapp.streamlit_supervisor = supervisor
+    add_handlers(nbapp, supervisor)
@@ -0,0 +1,57 @@
+"""The request engine of the HTTP API, with plain functions as analyses."""
+
+import threading
+
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("geemap")
+api = pytest.importorskip("api")
+from shared_cache import MemoryCache  # noqa: E402
+
+
+def run(engine, key, func, timeout=5):
+    """Call ``engine.run`` in a thread and fail instead of hanging."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = engine.run(key, func)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "Engine.run deadlocked"
+    return outcome
+
+
+def test_results_are_cached():
+    cache = MemoryCache()
+    engine = api.Engine(workers=1, cache=cache, ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "table"
+
+    assert run(engine, "key", compute) == {"result": "table"}
+    assert run(engine, "key", compute) == {"result": "table"}
+    assert len(calls) == 1
+    assert cache.get("api:key") == "table"
+
+
+def test_failing_analyses_release_the_engine():
+    engine = api.Engine(workers=1, max_queue=0, cache=MemoryCache())
+
+    def fail():
+        raise ValueError("HydroLAKES is not a raster dataset")
+
+    # Failures that finish before the callback is added must not deadlock, and
+    # their slots must be released for the next requests.
+    for _ in range(5):
+        outcome = run(engine, "key", fail)
+        assert isinstance(outcome["error"], ValueError)
+    assert run(engine, "other", lambda: 1) == {"result": 1}
+    assert engine.running == {}
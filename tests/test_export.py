@@ -0,0 +1,141 @@
+"""Batch table exports, run against a local stand-in for Earth Engine tasks."""
+
+import itertools
+import math
+
+import pytest
+
+ee = pytest.importorskip("ee")
+pytest.importorskip("geemap")
+analysis = pytest.importorskip("analysis")
+
+
+class FakeTask:
+    """Stands in for an ee.batch.Task going through a list of states."""
+
+    def __init__(self, states):
+        self.id = "TASK"
+        self.states = iter(states)
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def status(self):
+        state = next(self.states)
+        status = {"state": state}
+        if state == "FAILED":
+            status["error_message"] = "out of memory"
+        return status
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeCollection:
+    """Stands in for the exported table asset."""
+
+    tables = {}
+
+    def __init__(self, asset_id):
+        self.asset_id = asset_id
+
+    def getInfo(self):
+        rows = self.tables[self.asset_id]
+        return {"features": [{"properties": row} for row in rows]}
+
+
+@pytest.fixture
+def export(monkeypatch):
+    """Replace the export API; returns the tasks and deleted assets."""
+    started = {"tasks": [], "deleted": [], "states": ["READY", "COMPLETED"]}
+    rows = [{"group": 1, "sum": 2.5}]
+
+    def to_asset(collection, description, assetId):
+        FakeCollection.tables[assetId] = rows
+        task = FakeTask(started["states"])
+        started["tasks"].append(task)
+        return task
+
+    monkeypatch.setattr(analysis, "EXPORT_ASSET_ROOT", "projects/test/assets/tmp")
+    monkeypatch.setattr(analysis, "EXPORT_POLL_INTERVAL", 0.001)
+    monkeypatch.setattr(ee.batch.Export.table, "toAsset", to_asset)
+    monkeypatch.setattr(ee, "FeatureCollection", FakeCollection)
+    monkeypatch.setattr(ee.data, "deleteAsset", started["deleted"].append)
+    return started
+
+
+def test_export_returns_rows_and_deletes_asset(export):
+    rows = analysis.export_table(None, "stats", poll_interval=0.001)
+
+    assert rows == [{"group": 1, "sum": 2.5}]
+    (task,) = export["tasks"]
+    assert task.started and not task.cancelled
+    assert len(export["deleted"]) == 1
+    assert export["deleted"][0].startswith("projects/test/assets/tmp/stats_")
+
+
+def test_failed_export_raises(export):
+    export["states"] = ["RUNNING", "FAILED"]
+
+    with pytest.raises(ee.EEException, match="out of memory"):
+        analysis.export_table(None, "stats", poll_interval=0.001)
+    assert not export["tasks"][0].cancelled
+    assert export["deleted"] == []
+
+
+def test_export_times_out_and_cancels_task(export):
+    export["states"] = itertools.repeat("RUNNING")
+
+    with pytest.raises(ee.EEException, match="timed out"):
+        analysis.export_table(None, "stats", poll_interval=0.001, timeout=0.01)
+    assert export["tasks"][0].cancelled
+
+
+def test_poll_reports_state_and_cancels_task(export):
+    from jobs import Job, JobCancelled
+
+    export["states"] = itertools.repeat("RUNNING")
+    job = Job("export")
+    seen = []
+
+    def poll(status):
+        seen.append(status["state"])
+        if len(seen) == 3:
+            job.cancel()
+        job.check()
+
+    with pytest.raises(JobCancelled):
+        analysis.export_table(None, "stats", poll=poll, poll_interval=0.001)
+    assert seen == ["RUNNING"] * 3
+    assert export["tasks"][0].cancelled
+
+
+def test_fetch_table_exports_only_when_asked(export):
+    class Computed:
+        def getInfo(self):
+            return {"features": [{"properties": {"sum": 1}}]}
+
+    assert analysis.fetch_table(Computed()) == [{"sum": 1}]
+    assert export["tasks"] == []
+    assert analysis.fetch_table(None, export=True) == [{"group": 1, "sum": 2.5}]
+
+
+def test_estimate_pixels_from_bounds():
+    earth = 4 * math.pi * analysis.EARTH_RADIUS**2
+    pixels = analysis.estimate_pixels(analysis.WORLD_BOUNDS, 1000)
+    assert pixels == pytest.approx(earth / 1e6)
+
+
+def test_use_export(monkeypatch):
+    monkeypatch.setattr(analysis, "EXPORT_ASSET_ROOT", "projects/test/assets/tmp")
+
+    assert not analysis.use_export(None, 10)
+    assert not analysis.use_export([0, 0, 0.1, 0.1], 1000)
+    assert analysis.use_export(analysis.WORLD_BOUNDS, 10)
+    # Many images of a small region add up.
+    assert analysis.use_export([0, 0, 1, 1], 30, images=1000)
+
+    monkeypatch.setattr(analysis, "EXPORT_ASSET_ROOT", None)
+    assert not analysis.use_export(analysis.WORLD_BOUNDS, 10)
@@ -0,0 +1,102 @@
+"""Monthly water statistics, built against stand-ins for Earth Engine objects."""
+
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("geemap")
+gpd = pytest.importorskip("geopandas")
+analysis = pytest.importorskip("analysis")
+from shapely.geometry import box  # noqa: E402
+
+
+class Chain:
+    """Accepts any chain of Earth Engine calls; ``getInfo`` returns ``info``."""
+
+    def __init__(self, info=None):
+        self.info = info
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def getInfo(self):
+        return self.info
+
+
+class MonthlyImages:
+    """Stands in for the monthly ee.ImageCollection and records ``map`` calls."""
+
+    def __init__(self):
+        self.mapped = []
+
+    def map(self, func):
+        self.mapped.append(func)
+        return Chain()
+
+
+@pytest.fixture
+def images(monkeypatch):
+    images = MonthlyImages()
+    monkeypatch.setattr(analysis, "monthly_water_images", lambda *args: images)
+    return images
+
+
+def test_monthly_water_area_maps_the_collection(monkeypatch, images):
+    rows = [
+        {"Date": "2020_02", "area": 2.0},
+        {"Date": "2020_01", "area": 1.0},
+    ]
+    monkeypatch.setattr(analysis, "ee", Chain())
+    monkeypatch.setattr(analysis, "fetch_table", lambda *args: rows)
+
+    df = analysis.monthly_water_area(
+        None, "2020-01-01", "2020-03-01", 1, 2, bounds=[0, 0, 1, 1]
+    )
+
+    assert len(images.mapped) == 1
+    assert list(df["Date"]) == ["2020_01", "2020_02"]
+    assert list(df["Area (ha)"]) == [1.0, 2.0]
+
+
+def test_feature_statistics_maps_the_collection(monkeypatch, images):
+    feature_id = analysis.FEATURE_ID
+    extent = [{feature_id: 0, "sum": 5.0}, {feature_id: 1, "sum": 7.0}]
+    series = [
+        {feature_id: 0, "Date": "2020_01", "sum": 1.0},
+        {feature_id: 0, "Date": "2020_02", "sum": 3.0},
+        {feature_id: 1, "Date": "2020_01", "sum": 4.0},
+    ]
+    info = {
+        "extent": [{"properties": row} for row in extent],
+        "series": [{"properties": row} for row in series],
+    }
+    monkeypatch.setattr(analysis, "ee", Chain(info))
+    monkeypatch.setattr(analysis.geemap, "gdf_to_ee", lambda *args, **kwargs: Chain())
+    gdf = gpd.GeoDataFrame(
+        {"feature": ["lake", "river"]},
+        geometry=[box(0, 0, 1, 1), box(2, 2, 3, 3)],
+        crs="EPSG:4326",
+    )
+
+    summary, series = analysis.feature_statistics(
+        gdf, "2020-01-01", "2020-03-01", 1, 2, workers=1
+    )
+
+    assert len(images.mapped) == 1
+    # An uploaded "feature" attribute is kept next to the private row id.
+    assert list(summary["feature"]) == ["lake", "river"]
+    assert list(summary["Max water extent (ha)"]) == [5.0, 7.0]
+    assert list(summary["Mean monthly area (ha)"]) == [2.0, 4.0]
+    assert list(series["Area (ha)"]) == [1.0, 3.0, 4.0]
+
+
+def test_feature_batches_share_the_pixel_budget():
+    gdf = gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1), box(2, 2, 3, 3)], crs="EPSG:4326")
+    pixels = gdf.geometry.to_crs(epsg=6933).area.sum() / 1000**2
+
+    assert analysis.feature_batches(gdf, 1000, max_pixels=pixels) == [[0, 1]]
+    assert analysis.feature_batches(gdf, 1000, 2, max_pixels=pixels) == [[0], [1]]
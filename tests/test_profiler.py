@@ -0,0 +1,61 @@
+"""The import hook of the rerun profiler."""
+
+import builtins
+import threading
+
+import pytest
+
+import profiler
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """Return a factory of modules that have not been imported yet."""
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = iter(f"profiled_module_{i}" for i in range(100))
+
+    def new_module():
+        name = next(names)
+        (tmp_path / f"{name}.py").write_text("")
+        return name
+
+    yield new_module
+    profiler._set_profiling("session", False)
+
+
+def import_in_thread(name, thread_name):
+    """Import a module in a new thread and return the imports it recorded."""
+    recorded = {}
+
+    def target():
+        __import__(name)
+        recorded["imports"] = getattr(profiler._local, "imports", None) or []
+
+    thread = threading.Thread(target=target, name=thread_name)
+    thread.start()
+    thread.join()
+    return [name for name, _, _ in recorded["imports"]]
+
+
+def test_hook_is_installed_only_while_profiling(modules):
+    original = builtins.__import__
+    assert original is not profiler._timed_import
+
+    profiler._set_profiling("session", True)
+    profiler._set_profiling("other", True)
+    assert builtins.__import__ is profiler._timed_import
+
+    profiler._set_profiling("session", False)
+    assert builtins.__import__ is profiler._timed_import
+    profiler._set_profiling("other", False)
+    assert builtins.__import__ is original
+
+
+def test_only_script_threads_are_timed(modules):
+    profiler._set_profiling("session", True)
+
+    name = modules()
+    assert import_in_thread(name, profiler.SCRIPT_THREAD) == [name]
+    assert import_in_thread(modules(), "worker") == []
+    # Modules already imported are not timed again.
+    assert import_in_thread(name, profiler.SCRIPT_THREAD) == []
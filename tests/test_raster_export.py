@@ -0,0 +1,173 @@
+"""Tiled raster downloads, served by a local HTTP stand-in for Earth Engine."""
+
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("ee")
+gdal = pytest.importorskip("osgeo.gdal")
+raster_export = pytest.importorskip("raster_export")
+
+# 1/64 degree pixels, exact in binary, over a 2 x 1 degree ROI.
+SCALE = raster_export.METERS_PER_DEGREE / 64
+BOUNDS = [0.0, 0.0, 2.0, 1.0]
+# Tiles of at most 50 x 50 one-band float pixels.
+MAX_BYTES = 4 * 50 * 50
+
+
+def tile_name(tile):
+    col, row, _, _ = tile
+    return f"{col}_{row}.tif"
+
+
+def tile_value(tile):
+    col, row, _, _ = tile
+    return float(col * 1000 + row + 1)
+
+
+class TileHandler(SimpleHTTPRequestHandler):
+    """Serves prepared tiles; the first request of ``flaky`` paths fails."""
+
+    flaky = set()
+
+    def do_GET(self):
+        if self.path in self.flaky:
+            self.flaky.discard(self.path)
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server(tmp_path):
+    """Write the tiles of the plan to disk and serve them on localhost."""
+    transform, width, height, tiles = raster_export.plan_tiles(
+        BOUNDS, SCALE, max_bytes=MAX_BYTES
+    )
+    directory = tmp_path / "tiles"
+    directory.mkdir()
+    for tile in tiles:
+        _, _, tile_width, tile_height = tile
+        ds = gdal.GetDriverByName("GTiff").Create(
+            str(directory / tile_name(tile)),
+            tile_width,
+            tile_height,
+            1,
+            gdal.GDT_Float32,
+        )
+        ds.GetRasterBand(1).Fill(tile_value(tile))
+        ds = None
+
+    handler = functools.partial(TileHandler, directory=str(directory))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", transform, tiles
+    finally:
+        server.shutdown()
+        server.server_close()
+        TileHandler.flaky.clear()
+
+
+def check_mosaic(path, transform, tiles):
+    ds = gdal.Open(path)
+    assert (ds.RasterXSize, ds.RasterYSize) == (128, 64)
+    assert ds.GetGeoTransform() == pytest.approx(transform)
+    assert ds.GetMetadata("IMAGE_STRUCTURE").get("LAYOUT") == "COG"
+
+    minx, size, _, maxy, _, _ = ds.GetGeoTransform()
+    bounds = [minx, maxy - ds.RasterYSize * size, minx + ds.RasterXSize * size, maxy]
+    assert bounds == pytest.approx(BOUNDS)
+
+    band = ds.GetRasterBand(1)
+    for tile in tiles:
+        col, row, width, height = tile
+        window = band.ReadAsArray(col, row, width, height)
+        assert (window == tile_value(tile)).all()
+
+
+def test_plan_tiles():
+    transform, width, height, tiles = raster_export.plan_tiles(
+        BOUNDS, SCALE, max_bytes=MAX_BYTES
+    )
+
+    assert transform == (0.0, 1 / 64, 0.0, 1.0, 0.0, -1 / 64)
+    assert (width, height) == (128, 64)
+    assert tiles == [
+        (0, 0, 50, 50),
+        (50, 0, 50, 50),
+        (100, 0, 28, 50),
+        (0, 50, 50, 14),
+        (50, 50, 50, 14),
+        (100, 50, 28, 14),
+    ]
+
+
+def test_mosaic_retries_and_writes_every_tile(tile_server, tmp_path):
+    url, transform, tiles = tile_server
+    TileHandler.flaky.add("/" + tile_name(tiles[1]))
+    done = []
+
+    path = raster_export.mosaic(
+        str(tmp_path / "mosaic.tif"),
+        lambda tile: f"{url}/{tile_name(tile)}",
+        transform,
+        128,
+        64,
+        tiles,
+        nodata=-9999,
+        workers=2,
+        progress=done.append,
+    )
+
+    check_mosaic(path, transform, tiles)
+    assert done[-1] == 1
+    assert not TileHandler.flaky
+    assert not [name for name in os.listdir(tmp_path) if ".tmp" in name]
+
+
+class FakeImage:
+    """Stands in for an ee.Image; download URLs point at the tile server."""
+
+    def __init__(self, url):
+        self.url = url
+
+    def toFloat(self):
+        return self
+
+    def unmask(self, *args):
+        return self
+
+    def bandNames(self):
+        return self
+
+    def size(self):
+        return self
+
+    def getInfo(self):
+        return 1
+
+    def getDownloadURL(self, params):
+        size, _, x, _, _, y = params["crs_transform"]
+        col = round((x - BOUNDS[0]) / size)
+        row = round((BOUNDS[3] - y) / size)
+        return f"{self.url}/{col}_{row}.tif"
+
+
+def test_export_image(tile_server, tmp_path, monkeypatch):
+    url, transform, tiles = tile_server
+    monkeypatch.setattr(raster_export, "MAX_BYTES", MAX_BYTES)
+    monkeypatch.setattr(raster_export.ee, "Image", lambda image: image)
+
+    path = raster_export.export_image(
+        FakeImage(url), BOUNDS, SCALE, str(tmp_path / "export.tif"), workers=3
+    )
+
+    check_mosaic(path, transform, tiles)
@@ -0,0 +1,177 @@
+"""Shared cache backends, with a local stand-in for the Redis client."""
+
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import pytest
+
+import shared_cache
+from shared_cache import MemoryCache, RedisCache, SQLiteCache, from_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeRedis:
+    """The subset of redis.Redis used by RedisCache, with a settable clock."""
+
+    def __init__(self):
+        self.data = {}
+        self.now = 0.0
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and self.now >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        assert isinstance(value, bytes)
+        assert ex is None or (isinstance(ex, int) and ex >= 1)
+        self.data[key] = (value, None if ex is None else self.now + ex)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    if request.param == "sqlite":
+        return SQLiteCache(str(tmp_path / "cache.db"))
+    return RedisCache(None, client=FakeRedis())
+
+
+def test_round_trip(cache):
+    value = {"scale": 1000, "rows": [1.5, None, "a"]}
+    assert cache.get("key") is None
+    cache.set("key", value)
+    assert cache.get("key") == value
+    cache.set("key", [1])
+    assert cache.get("key") == [1]
+    cache.delete("key")
+    assert cache.get("key") is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_ttl_expiry(backend, tmp_path):
+    if backend == "memory":
+        cache = MemoryCache()
+    else:
+        cache = SQLiteCache(str(tmp_path / "cache.db"))
+    cache.set("short", 1, ttl=0.05)
+    cache.set("long", 2, ttl=60)
+    cache.set("forever", 3)
+    assert cache.get("short") == 1
+
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert cache.get("forever") == 3
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_sqlite_purges_expired_entries(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), purge_every=0)
+    cache.set("old", 1, ttl=0.01)
+    time.sleep(0.05)
+    cache.set("new", 2)
+    rows = cache.connection().execute("SELECT key FROM cache").fetchall()
+    assert rows == [("new",)]
+
+
+def test_sqlite_drops_unreadable_entries(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    with cache.connection() as db:
+        db.execute("INSERT INTO cache VALUES ('bad', ?, NULL)", (b"not a pickle",))
+    assert cache.get("bad") is None
+    assert cache.connection().execute("SELECT * FROM cache").fetchall() == []
+
+
+def run_python(code, *args):
+    return subprocess.Popen(
+        [sys.executable, "-c", code, *args],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+WRITER = """
+import sys
+from shared_cache import SQLiteCache
+
+cache = SQLiteCache(sys.argv[1])
+worker = sys.argv[2]
+for i in range(50):
+    cache.set(f"{worker}:{i}", {"worker": worker, "i": i}, ttl=60)
+print(cache.get("parent"))
+"""
+
+
+def test_sqlite_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "shared" / "cache.db")
+    cache = SQLiteCache(path)
+    cache.set("parent", "from the parent")
+
+    workers = [run_python(WRITER, path, str(n)) for n in range(4)]
+    for worker in workers:
+        out, err = worker.communicate(timeout=60)
+        assert worker.returncode == 0, err
+        assert out.strip() == "from the parent"
+
+    for n in range(4):
+        for i in range(50):
+            assert cache.get(f"{n}:{i}") == {"worker": str(n), "i": i}
+
+
+def test_redis_cache_prefixes_pickles_and_expires():
+    client = FakeRedis()
+    cache = RedisCache(None, prefix="test:", client=client)
+    cache.set("key", {"a": 1}, ttl=0.2)
+    cache.set("other", 2, ttl=30)
+
+    assert pickle.loads(client.data["test:key"][0]) == {"a": 1}
+    # Redis counts whole seconds; sub-second TTLs are rounded up to one.
+    assert client.data["test:key"][1] == 1
+    assert cache.get("key") == {"a": 1}
+
+    client.now = 1
+    assert cache.get("key") is None
+    assert cache.get("other") == 2
+    client.now = 31
+    assert cache.get("other") is None
+
+
+def test_from_url(tmp_path, monkeypatch):
+    assert isinstance(from_url(None), MemoryCache)
+    assert isinstance(from_url("memory"), MemoryCache)
+    sqlite = from_url(f"sqlite:///{tmp_path}/cache.db")
+    assert isinstance(sqlite, SQLiteCache)
+    assert sqlite.path == f"{tmp_path}/cache.db"
+    with pytest.raises(ValueError):
+        from_url("memcached://localhost")
+
+    for value, expected in [("", False), ("memory", False), ("sqlite:///x", True)]:
+        monkeypatch.setenv("WATER_SHARED_CACHE", value)
+        assert shared_cache.enabled() is expected
+    monkeypatch.delenv("WATER_SHARED_CACHE")
+    assert not shared_cache.enabled()
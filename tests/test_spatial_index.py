@@ -0,0 +1,35 @@
+"""Outlines simplified for the map zoom, on a local polygon."""
+
+import pytest
+
+pytest.importorskip("geemap")
+gpd = pytest.importorskip("geopandas")
+spatial_index = pytest.importorskip("spatial_index")
+from shapely.geometry import Point  # noqa: E402
+
+
+def test_tolerance_follows_the_zoom():
+    tolerances = [spatial_index.pick_tolerance(zoom) for zoom in range(0, 19)]
+
+    assert tolerances[0] == spatial_index.TOLERANCES[0]
+    assert tolerances[-1] == spatial_index.TOLERANCES[-1]
+    assert tolerances == sorted(tolerances, reverse=True)
+    assert spatial_index.pick_tolerance() == spatial_index.pick_tolerance(
+        spatial_index.DEFAULT_ZOOM
+    )
+
+
+def test_outlines_are_cached_per_tolerance_level():
+    gdf = gpd.GeoDataFrame(
+        {"name": ["Lake"]}, geometry=[Point(0, 0).buffer(1)], crs="EPSG:4326"
+    )
+    index = spatial_index.SpatialIndex(gdf, "name")
+
+    def vertices(outline):
+        return len(outline["features"][0]["geometry"]["coordinates"][0])
+
+    coarse = index.outline("Lake", zoom=2)
+    fine = index.outline("Lake", zoom=12)
+    assert vertices(coarse) < vertices(fine)
+    # Zooms with the same tolerance share one outline.
+    assert index.outline("Lake", zoom=1) is coarse
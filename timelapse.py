@@ -0,0 +1,178 @@
+"""Timelapse animations of the JRC monthly water history of an ROI.
+
+Frame thumbnails are fetched concurrently and cached on disk by ROI, frame
+and visualization, so a repeated or extended timelapse only fetches the
+frames it has not seen. Frames are labeled with their month and assembled
+with ffmpeg; GIFs are optimized with gifsicle.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ee
+from PIL import Image, ImageDraw, ImageFont
+
+from raster_export import fetch
+from spatial_index import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+FRAME_DIR = os.path.join(CACHE_DIR, "frames")
+MONTHLY_HISTORY = "JRC/GSW1_3/MonthlyHistory"
+DEFAULT_VIS = {"min": 0, "max": 2, "palette": ["ffffff", "fffcb8", "0905ff"]}
+
+
+def frame_ids(start_date, end_date, start_month, end_month):
+    """Return the ids of the monthly images in a date and month window."""
+    images = (
+        ee.ImageCollection(MONTHLY_HISTORY)
+        .filterDate(start_date, end_date)
+        .filter(ee.Filter.calendarRange(start_month, end_month, "month"))
+    )
+    return sorted(images.aggregate_array("system:index").getInfo())
+
+
+def frame_path(region_key, frame, vis, dimensions):
+    key = json.dumps([region_key, frame, vis, dimensions], sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(FRAME_DIR, f"{digest}.png")
+
+
+def fetch_frame(region, region_key, frame, vis, dimensions):
+    """Return the cached thumbnail of a frame, fetching it if needed."""
+    path = frame_path(region_key, frame, vis, dimensions)
+    if os.path.exists(path):
+        return path
+
+    image = ee.Image(f"{MONTHLY_HISTORY}/{frame}").clip(region)
+    url = image.visualize(**vis).getThumbURL(
+        {
+            "region": region.geometry().bounds(),
+            "dimensions": dimensions,
+            "format": "png",
+        }
+    )
+    data = fetch(url)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def fetch_frames(region, frames, vis, dimensions, workers=8, progress=None):
+    """Fetch frame thumbnails concurrently and return their paths in order."""
+    os.makedirs(FRAME_DIR, exist_ok=True)
+    region_key = region.serialize()
+    paths = [None] * len(frames)
+
+    def fetch_one(frame):
+        return fetch_frame(region, region_key, frame, vis, dimensions)
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(fetch_one, frame): index
+            for index, frame in enumerate(frames)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            paths[futures[future]] = future.result()
+            if progress is not None:
+                progress(done / len(frames))
+    return paths
+
+
+def annotate(path, label, out_path):
+    """Write a copy of a frame with a label in its top left corner."""
+    # Pixels outside the ROI are transparent; show them as white.
+    frame = Image.open(path).convert("RGBA")
+    image = Image.alpha_composite(Image.new("RGBA", frame.size, "white"), frame)
+    image = image.convert("RGB")
+    draw = ImageDraw.Draw(image)
+    size = max(12, image.height // 20)
+    try:
+        font = ImageFont.truetype("DejaVuSans-Bold.ttf", size)
+    except OSError:
+        font = ImageFont.load_default()
+    margin = size // 2
+    draw.text(
+        (margin, margin),
+        label,
+        fill="black",
+        font=font,
+        stroke_width=max(1, size // 10),
+        stroke_fill="white",
+    )
+    # ffmpeg's encoders need even dimensions.
+    width, height = image.width // 2 * 2, image.height // 2 * 2
+    image.crop((0, 0, width, height)).save(out_path)
+
+
+def assemble(frames, out_path, fps=5, format="gif"):
+    """Assemble numbered frames (frame_0000.png, ...) into an animation."""
+    pattern = os.path.join(os.path.dirname(frames[0]), "frame_%04d.png")
+    if format == "mp4":
+        command = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps)]
+        command += ["-i", pattern, "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        command += ["-movflags", "+faststart", out_path]
+        subprocess.run(command, check=True)
+        return out_path
+
+    # One palette for the whole animation keeps the colors stable.
+    filters = "split[a][b];[a]palettegen=stats_mode=diff[p];[b][p]paletteuse"
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps)]
+    command += ["-i", pattern, "-filter_complex", filters, out_path]
+    subprocess.run(command, check=True)
+    if shutil.which("gifsicle"):
+        subprocess.run(["gifsicle", "-O3", "-b", out_path], check=True)
+    return out_path
+
+
+def timelapse(
+    region,
+    start_date,
+    end_date,
+    start_month,
+    end_month,
+    out_path,
+    vis=None,
+    dimensions=768,
+    fps=5,
+    format="gif",
+    workers=8,
+    progress=None,
+):
+    """Create a timelapse of the JRC monthly water history of a region.
+
+    Args:
+        region (ee.FeatureCollection): The ROI.
+        out_path (str): The output file.
+        vis (dict): Visualization parameters of the frames.
+        dimensions (int): Size of the longer side of the frames in pixels.
+        format (str): "gif" or "mp4".
+        progress (callable): Called with the fraction of frames fetched.
+
+    Returns:
+        str: The output file.
+    """
+    vis = vis or DEFAULT_VIS
+    frames = frame_ids(start_date, end_date, start_month, end_month)
+    if not frames:
+        raise ValueError("No monthly images in the selected date range")
+
+    paths = fetch_frames(region, frames, vis, dimensions, workers, progress)
+    with tempfile.TemporaryDirectory() as tmp:
+        numbered = []
+        for index, (frame, path) in enumerate(zip(frames, paths)):
+            out = os.path.join(tmp, f"frame_{index:04d}.png")
+            # Frame ids are "YYYY_MM".
+            annotate(path, frame.replace("_", "-"), out)
+            numbered.append(out)
+        logger.info("Assembling %d frames into %s", len(numbered), out_path)
+        return assemble(numbered, out_path, fps, format)
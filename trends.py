@@ -0,0 +1,220 @@
+"""Vectorized trend and seasonality statistics for many monthly series.
+
+The monthly water area of many ROIs is stacked into one matrix with a row per
+ROI and a column per month, so every statistic is computed for all ROIs at
+once with NumPy instead of one pandas pipeline per ROI. Missing months are
+NaN and are ignored.
+
+- Trends use the annual series: Sen's slope (median of pairwise slopes) and
+  the Mann-Kendall test.
+- The climatology is the mean area of each calendar month, and anomalies are
+  the monthly areas minus the climatology of their month.
+- Change points are located with the Pettitt test on the annual series.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+REDUCERS = {"sum": np.nansum, "mean": np.nanmean, "min": np.nanmin, "max": np.nanmax}
+
+_erfc = np.vectorize(math.erfc, otypes=[float])
+
+
+def series_matrix(series):
+    """Stack monthly water area tables into a matrix.
+
+    Args:
+        series (dict): Tables returned by ``analysis.monthly_water_area``
+            keyed by ROI name.
+
+    Returns:
+        tuple: The ROI names, the months as a ``pd.PeriodIndex`` and a float
+            array of shape (ROIs, months) with NaN where a month is missing.
+    """
+    names = list(series)
+    frames = []
+    for name in names:
+        df = series[name]
+        dates = pd.PeriodIndex(
+            [f"{d[:4]}-{d[5:7]}" for d in df["Date"]], freq="M", name="Date"
+        )
+        frames.append(pd.Series(df["Area (ha)"].to_numpy(float), index=dates))
+
+    if not frames:
+        return names, pd.PeriodIndex([], freq="M", name="Date"), np.empty((0, 0))
+    table = pd.concat(frames, axis=1, keys=range(len(names))).sort_index()
+    return names, table.index, table.to_numpy(float).T
+
+
+def annual(values, months, reducer="mean"):
+    """Aggregate the monthly matrix by year.
+
+    Returns:
+        tuple: The years and an array of shape (ROIs, years).
+    """
+    years = np.unique(months.year)
+    reduce = REDUCERS[reducer]
+    result = np.full((values.shape[0], len(years)), np.nan)
+    with np.errstate(all="ignore"):
+        for i, year in enumerate(years):
+            columns = values[:, months.year == year]
+            present = ~np.isnan(columns).all(axis=1)
+            result[present, i] = reduce(columns[present], axis=1)
+    return years, result
+
+
+def _pairs(values):
+    """Return the pairwise differences x[j] - x[i] for i < j and their lags."""
+    i, j = np.triu_indices(values.shape[1], k=1)
+    return values[:, j] - values[:, i], (j - i).astype(float)
+
+
+def sens_slope(values):
+    """Return Sen's slope of every row, in units per column."""
+    if values.shape[1] < 2:
+        return np.full(values.shape[0], np.nan)
+    differences, lags = _pairs(values)
+    with np.errstate(all="ignore"):
+        slopes = differences / lags
+        return np.nanmedian(slopes, axis=1)
+
+
+def mann_kendall(values):
+    """Run the Mann-Kendall trend test on every row.
+
+    Ties are not corrected for; rows with fewer than three values get NaN.
+
+    Returns:
+        tuple: Arrays of the S statistic, the Z score and the two-sided
+            p-value.
+    """
+    differences, _ = _pairs(values)
+    s = np.nansum(np.sign(differences), axis=1)
+    n = (~np.isnan(values)).sum(axis=1).astype(float)
+    variance = n * (n - 1) * (2 * n + 5) / 18
+    with np.errstate(all="ignore"):
+        z = np.where(s == 0, 0.0, (s - np.sign(s)) / np.sqrt(variance))
+    z[n < 3] = np.nan
+    p = np.full_like(z, np.nan)
+    valid = ~np.isnan(z)
+    p[valid] = _erfc(np.abs(z[valid]) / math.sqrt(2))
+    return s, z, p
+
+
+def climatology(values, months):
+    """Return the mean of each calendar month, an array of shape (ROIs, 12)."""
+    result = np.full((values.shape[0], 12), np.nan)
+    with np.errstate(all="ignore"):
+        for month in range(1, 13):
+            columns = values[:, months.month == month]
+            if columns.shape[1]:
+                present = ~np.isnan(columns).all(axis=1)
+                result[present, month - 1] = np.nanmean(columns[present], axis=1)
+    return result
+
+
+def anomalies(values, months, clim=None):
+    """Return the monthly values minus the climatology of their month."""
+    if clim is None:
+        clim = climatology(values, months)
+    return values - clim[:, np.asarray(months.month) - 1]
+
+
+def pettitt(values):
+    """Locate the most likely change point of every row with the Pettitt test.
+
+    Missing values are dropped from the sign comparisons, so they never
+    count for either side of a change.
+
+    Returns:
+        tuple: The index of the last column before the change and the
+            approximate p-value of the change.
+    """
+    t = values.shape[1]
+    if t < 2:
+        nan = np.full(values.shape[0], np.nan)
+        return nan, nan
+
+    # signs[r, i, j] = sign(x[j] - x[i]); U_k sums it over i <= k < j.
+    signs = np.nan_to_num(np.sign(values[:, None, :] - values[:, :, None]))
+    upper = np.triu(np.ones((t, t), dtype=bool), k=1)
+    cumulative = np.cumsum(signs, axis=1)
+    u = np.where(upper, cumulative, 0).sum(axis=2)[:, :-1]
+    k = np.abs(u).max(axis=1)
+    index = np.abs(u).argmax(axis=1).astype(float)
+
+    n = (~np.isnan(values)).sum(axis=1).astype(float)
+    with np.errstate(all="ignore"):
+        p = np.minimum(1.0, 2 * np.exp(-6 * k**2 / (n**3 + n**2)))
+    index[n < 3] = np.nan
+    p[n < 3] = np.nan
+    return index, p
+
+
+def trend_table(series, reducer="mean", alpha=0.05):
+    """Compute trend and change point statistics for many ROIs.
+
+    Args:
+        series (dict): Monthly water area tables keyed by ROI name.
+        reducer (str): How months are aggregated to years.
+        alpha (float): Significance level of the trend and change point.
+
+    Returns:
+        pd.DataFrame: One row per ROI, sorted by Sen's slope.
+    """
+    names, months, values = series_matrix(series)
+    years, yearly = annual(values, months, reducer)
+    slope = sens_slope(yearly)
+    s, z, p = mann_kendall(yearly)
+    change, change_p = pettitt(yearly)
+    with np.errstate(all="ignore"):
+        mean = np.nanmean(yearly, axis=1)
+        relative = 100 * slope / mean
+
+    trend = np.where(
+        p < alpha, np.where(slope > 0, "increasing", "decreasing"), "no trend"
+    )
+    change_year = np.full(len(names), np.nan)
+    found = ~np.isnan(change) & (change_p < alpha)
+    # The change happens after the last year before it.
+    change_year[found] = years[change[found].astype(int) + 1]
+
+    df = pd.DataFrame(
+        {
+            "ROI": names,
+            "Mean area (ha)": mean,
+            "Sen's slope (ha/year)": slope,
+            "Slope (%/year)": relative,
+            "Mann-Kendall Z": z,
+            "p-value": p,
+            "Trend": trend,
+            "Change year": change_year,
+            "Change p-value": change_p,
+        }
+    )
+    return df.sort_values("Sen's slope (ha/year)", ascending=False).reset_index(
+        drop=True
+    )
+
+
+def seasonal_table(series):
+    """Return the climatology and monthly anomalies of many ROIs.
+
+    Returns:
+        tuple: The climatology with one row per ROI and calendar month, and
+            the anomalies with one row per ROI and month, both long tables.
+    """
+    names, months, values = series_matrix(series)
+    clim = climatology(values, months)
+    anomaly = anomalies(values, months, clim)
+
+    df_clim = pd.DataFrame(clim, index=names, columns=range(1, 13))
+    df_clim = df_clim.rename_axis(index="ROI", columns="Month").stack()
+    df_anomaly = pd.DataFrame(anomaly, index=names, columns=months.to_timestamp())
+    df_anomaly = df_anomaly.rename_axis(index="ROI", columns="Date").stack()
+    return (
+        df_clim.rename("Area (ha)").reset_index(),
+        df_anomaly.rename("Anomaly (ha)").reset_index(),
+    )
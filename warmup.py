@@ -0,0 +1,102 @@
+"""Warm up the app before the first visitor arrives.
+
+The Binder launcher (``streamlit_call.py``) starts the app through this
+script, which warms the serving process itself and then runs the Streamlit
+server in it:
+
+    python warmup.py serve Home.py --server.port=8501
+
+Streamlit runs the page scripts in the server process, so the modules the
+pages import, the Earth Engine session and the country indexes built here
+are what the first visitor uses. The server only starts listening once the
+warm-up is done, so its health check doubles as a readiness check.
+
+Run without arguments to only fill the on-disk caches, e.g. after a
+deployment:
+
+    python warmup.py
+
+Each phase is timed and logged.
+"""
+
+import importlib
+import logging
+import sys
+import time
+
+logger = logging.getLogger("warmup")
+
+# The modules the pages import, heaviest first.
+MODULES = [
+    "analysis",
+    "geemap.foliumap",
+    "leafmap",
+    "plotly.express",
+    "fragments",
+    "ingest",
+    "pyramid",
+    "raster_export",
+    "timelapse",
+    "trends",
+    "jobs",
+    "session_store",
+]
+
+
+def phase(name, func):
+    started = time.monotonic()
+    result = func()
+    logger.info("%s took %.1f s", name, time.monotonic() - started)
+    return result
+
+
+def initialize():
+    import geemap
+
+    import ee_client
+
+    geemap.ee_initialize()
+    ee_client.install()
+
+
+def import_modules():
+    for name in MODULES:
+        importlib.import_module(name)
+
+
+def build_indexes():
+    from spatial_index import get_country_index
+
+    # Pages 1 and 2 look countries up by "name", page 3 by "NAME".
+    for field in ["name", "NAME"]:
+        get_country_index(field)
+
+
+def warm_up():
+    started = time.monotonic()
+    phase("Importing the app modules", import_modules)
+    phase("Initializing Earth Engine", initialize)
+    phase("Building the country indexes", build_indexes)
+    logger.info("Warm-up finished in %.1f s", time.monotonic() - started)
+
+
+def serve(argv):
+    """Warm up this process, then run ``streamlit run <argv>`` in it."""
+    from streamlit.web import cli
+
+    warm_up()
+    sys.argv = ["streamlit", "run"] + list(argv)
+    return cli.main()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if argv and argv[0] == "serve":
+        return serve(argv[1:])
+    warm_up()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())